@@ -0,0 +1,167 @@
+import argparse
+import logging
+import timeit
+from os import path
+
+import numpy
+import pandas
+
+from arbitrage import find_triangles, calculate_arbitrage_opportunity, evaluate_arbitrage_opportunity
+from arbitrage import triangle_legs, evaluate_triangles
+
+_DEFAULT_ASSETS_COUNTS = '50,100,200,500'
+_DEFAULT_PAIRS_PER_ASSET = 6
+_DEFAULT_LEGACY_MAX_ASSETS = 100
+_DEFAULT_REPEAT = 3
+
+
+def generate_tradeable_pairs(count_assets, pairs_per_asset, seed=0):
+    """
+    Synthetic universe of tradeable pairs, most assets being quoted against a handful of majors.
+
+    :param count_assets:
+    :param pairs_per_asset:
+    :param seed:
+    :return: DataFrame with columns pair_code, base and quote
+    """
+    generator = numpy.random.RandomState(seed)
+    assets = ['A{:03d}'.format(count) for count in range(count_assets)]
+    majors = assets[:max(3, count_assets // 50)]
+    pairs = set()
+    for base in assets:
+        quotes = set(generator.choice(assets, pairs_per_asset - 2, replace=False)).union(
+            generator.choice(majors, 2, replace=False))
+        pairs.update((base, quote) for quote in quotes if quote != base and (quote, base) not in pairs)
+
+    return pandas.DataFrame([{'pair_code': base + quote, 'base': base, 'quote': quote} for base, quote in sorted(pairs)])
+
+
+def legacy_triangles(tradeable_pairs):
+    """
+    Triangles enumeration by looping over every combination of three assets.
+
+    :param tradeable_pairs:
+    :return:
+    """
+    assets = set(tradeable_pairs['base'].tolist()).union(tradeable_pairs['quote'].tolist())
+    available_pairs = set(tradeable_pairs['pair_code'].tolist())
+    triangles = list()
+    for common_leg in assets:
+        for leg_pair1 in assets:
+            if leg_pair1 == common_leg:
+                continue
+
+            for leg_pair2 in assets:
+                if leg_pair2 == common_leg or leg_pair2 == leg_pair1:
+                    continue
+
+                direct_pair = leg_pair1 + leg_pair2
+                indirect_pair_1 = leg_pair1 + common_leg
+                indirect_pair_2 = leg_pair2 + common_leg
+                if available_pairs.issuperset({direct_pair, indirect_pair_1, indirect_pair_2}):
+                    triangles.append((direct_pair, indirect_pair_1, indirect_pair_2))
+
+    return triangles
+
+
+def time_evaluation(repeat, number=100):
+    """
+    Timing of one triangle evaluation building frames against the numeric core.
+
+    :param repeat:
+    :param number:
+    :return: (frames seconds, numeric seconds)
+    """
+    pairs = ['A000A001', 'A000A002', 'A001A002']
+    bids = [{'price': price, 'volume': 10.} for price in (0.5, 0.25, 0.5)]
+    asks = [{'price': price * 1.001, 'volume': 10.} for price in (0.5, 0.25, 0.5)]
+    frames_timing = min(timeit.repeat(lambda: calculate_arbitrage_opportunity(pairs[0], bids[0], asks[0], pairs[1],
+                                                                              bids[1], asks[1], pairs[2], bids[2],
+                                                                              asks[2], skip_capped=False),
+                                      repeat=repeat, number=number)) / number
+    numeric_bids = [(bid['price'], bid['volume']) for bid in bids]
+    numeric_asks = [(ask['price'], ask['volume']) for ask in asks]
+    numeric_timing = min(timeit.repeat(lambda: evaluate_arbitrage_opportunity(pairs, numeric_bids, numeric_asks,
+                                                                              skip_capped=False),
+                                       repeat=repeat, number=number)) / number
+    return frames_timing, numeric_timing
+
+
+def time_batch_evaluation(tradeable_pairs, triangles, repeat, seed=0):
+    """
+    Timing of the evaluation of all the triangles at once from random top of the book quotes.
+
+    :param tradeable_pairs:
+    :param triangles:
+    :param repeat:
+    :param seed:
+    :return: seconds
+    """
+    generator = numpy.random.RandomState(seed)
+    pair_codes = tradeable_pairs['pair_code'].tolist()
+    mids = generator.uniform(0.01, 100., len(pair_codes))
+    volumes = generator.uniform(1., 100., len(pair_codes))
+    legs, sells_base = triangle_legs(pair_codes, triangles)
+    return min(timeit.repeat(lambda: evaluate_triangles(mids * 0.999, volumes, mids * 1.001, volumes, legs, sells_base),
+                             repeat=repeat, number=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarking triangles enumeration against number of assets',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+    parser.add_argument('--assets',
+                        type=str,
+                        help='comma-separated list of assets counts',
+                        default=_DEFAULT_ASSETS_COUNTS
+                        )
+    parser.add_argument('--pairs-per-asset',
+                        type=int,
+                        help='number of pairs quoting each asset',
+                        default=_DEFAULT_PAIRS_PER_ASSET
+                        )
+    parser.add_argument('--legacy-max-assets',
+                        type=int,
+                        help='largest universe timed with the asset loop (cubic in the number of assets)',
+                        default=_DEFAULT_LEGACY_MAX_ASSETS
+                        )
+    parser.add_argument('--repeat',
+                        type=int,
+                        help='number of timed runs for each assets count',
+                        default=_DEFAULT_REPEAT
+                        )
+    args = parser.parse_args()
+
+    logging.info('{:>8} {:>8} {:>10} {:>12} {:>12} {:>12}'.format('assets', 'pairs', 'triangles', 'graph',
+                                                                  'asset loop', 'evaluation'))
+    for count_assets in [int(count) for count in args.assets.split(',')]:
+        tradeable_pairs = generate_tradeable_pairs(count_assets, args.pairs_per_asset)
+        triangles = find_triangles(tradeable_pairs)
+        graph_timing = min(timeit.repeat(lambda: find_triangles(tradeable_pairs), repeat=args.repeat, number=1))
+        legacy_timing = numpy.NaN
+        if count_assets <= args.legacy_max_assets:
+            if set(legacy_triangles(tradeable_pairs)) != set(triangles):
+                raise RuntimeError('triangles mismatch for {} assets'.format(count_assets))
+
+            legacy_timing = min(timeit.repeat(lambda: legacy_triangles(tradeable_pairs), repeat=args.repeat, number=1))
+
+        evaluation_timing = time_batch_evaluation(tradeable_pairs, triangles, args.repeat)
+        logging.info('{:>8} {:>8} {:>10} {:>12.4f} {:>12.4f} {:>12.4f}'.format(count_assets, tradeable_pairs.shape[0],
+                                                                               len(triangles), graph_timing,
+                                                                               legacy_timing, evaluation_timing))
+
+    frames_timing, numeric_timing = time_evaluation(args.repeat)
+    logging.info('triangle evaluation: {:.6f}s with frames, {:.6f}s numeric'.format(frames_timing, numeric_timing))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    file_handler = logging.FileHandler('{}.log'.format(path.basename(__file__).split('.')[0]), mode='w')
+    formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    file_handler.setFormatter(formatter)
+    logging.getLogger().addHandler(file_handler)
+    try:
+        main()
+
+    except:
+        logging.exception('error occured')
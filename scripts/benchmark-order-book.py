@@ -0,0 +1,113 @@
+import argparse
+import logging
+import timeit
+import tracemalloc
+from os import path
+from unittest import mock
+
+import numpy
+
+from exchanges import kraken
+
+_DEFAULT_DEPTHS = '1,10,100,500'
+_DEFAULT_BOOKS_COUNT = 200
+_DEFAULT_REPEAT = 3
+_PAIR = 'XETHXXBT'
+
+
+def generate_depth_response(depth, seed=0):
+    """
+    Synthetic response of the Depth public method, prices and volumes being strings as sent by Kraken.
+
+    :param depth:
+    :param seed:
+    :return:
+    """
+    generator = numpy.random.RandomState(seed)
+    spreads = numpy.cumsum(generator.uniform(0.00001, 0.0001, depth))
+    volumes = generator.uniform(0.1, 100., (2, depth))
+    timestamps = 1500000000 + generator.randint(0, 3600, (2, depth))
+    bids = [['{:.5f}'.format(0.09 - spread), '{:.3f}'.format(volume), int(timestamp)]
+            for spread, volume, timestamp in zip(spreads, volumes[0], timestamps[0])]
+    asks = [['{:.5f}'.format(0.09 + spread), '{:.3f}'.format(volume), int(timestamp)]
+            for spread, volume, timestamp in zip(spreads, volumes[1], timestamps[1])]
+    return {'error': [], 'result': {_PAIR: {'bids': bids, 'asks': asks}}}
+
+
+def retained_memory(load_book, count):
+    """
+    Memory held by count order books.
+
+    :param load_book:
+    :param count:
+    :return: bytes
+    """
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    books = [load_book() for _ in range(count)]
+    retained = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del books
+    return retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarking order book representations against depth',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+    parser.add_argument('--depths',
+                        type=str,
+                        help='comma-separated list of book depths',
+                        default=_DEFAULT_DEPTHS
+                        )
+    parser.add_argument('--books',
+                        type=int,
+                        help='number of books held when measuring memory',
+                        default=_DEFAULT_BOOKS_COUNT
+                        )
+    parser.add_argument('--repeat',
+                        type=int,
+                        help='number of timed runs for each depth',
+                        default=_DEFAULT_REPEAT
+                        )
+    args = parser.parse_args()
+
+    logging.info('{:>8} {:>12} {:>12} {:>12} {:>12} {:>12} {:>12}'.format('depth', 'frames', 'compact', 'frames L1',
+                                                                           'compact L1', 'frames KB', 'compact KB'))
+    for depth in [int(count) for count in args.depths.split(',')]:
+        response = generate_depth_response(depth)
+        with mock.patch('exchanges.kraken.api_call_public', lambda method, options=None, client=None: response):
+            def load_frames():
+                return kraken.get_order_book(_PAIR, depth=depth)
+
+            def load_compact():
+                return kraken.get_order_book(_PAIR, depth=depth, compact=True)
+
+            def best_frames():
+                bid, ask = load_frames()
+                return bid.iloc[0], ask.iloc[0]
+
+            def best_compact():
+                bid, ask = load_compact()
+                return bid.best(), ask.best()
+
+            timings = [min(timeit.repeat(function, repeat=args.repeat, number=10)) / 10
+                       for function in (load_frames, load_compact, best_frames, best_compact)]
+            memory = [retained_memory(function, args.books) / args.books / 1024.
+                      for function in (load_frames, load_compact)]
+
+        logging.info('{:>8} {:>12.6f} {:>12.6f} {:>12.6f} {:>12.6f} {:>12.1f} {:>12.1f}'.format(depth,
+                                                                                              *(timings + memory)))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    file_handler = logging.FileHandler('{}.log'.format(path.basename(__file__).split('.')[0]), mode='w')
+    formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    file_handler.setFormatter(formatter)
+    logging.getLogger().addHandler(file_handler)
+    try:
+        main()
+
+    except:
+        logging.exception('error occured')
@@ -0,0 +1,101 @@
+import argparse
+import logging
+import timeit
+from os import path
+
+import numpy
+import pandas
+
+from sbcireport import compute_pnl
+
+_DEFAULT_FLOWS_COUNTS = '5,10,20,40,80'
+_DEFAULT_PRICES_COUNT = 2000
+_DEFAULT_TRADES_COUNT = 200
+_DEFAULT_REPEAT = 3
+_ASSETS = ('BTC', 'ETH', 'XRP', 'LTC')
+_REPORTING_CURRENCY = 'USD'
+
+
+def generate_data(count_flows, count_prices, count_trades, seed=0):
+    """
+    Synthetic hourly prices, deposits and trades for benchmarking.
+
+    :param count_flows:
+    :param count_prices:
+    :param count_trades:
+    :param seed:
+    :return: (flows, prices, trades)
+    """
+    generator = numpy.random.RandomState(seed)
+    dates = pandas.date_range('2017-01-01', periods=count_prices, freq='H')
+    prices = pandas.DataFrame({'date': dates})
+    for asset in _ASSETS:
+        returns = 1. + generator.normal(0., 0.01, count_prices)
+        prices['{}/{}'.format(asset, _REPORTING_CURRENCY)] = 100. * numpy.cumprod(returns)
+
+    offset = pandas.Timedelta('17s')
+    flow_dates = numpy.sort(generator.choice(dates[:-1], count_flows, replace=False)) + offset
+    flows = pandas.DataFrame({'date': flow_dates,
+                              'asset': generator.choice(_ASSETS, count_flows),
+                              'amount': generator.uniform(1., 10., count_flows),
+                              'fee': 0.,
+                              'exchange': 'benchmark'})
+
+    trade_dates = numpy.sort(generator.choice(dates[:-1], count_trades, replace=False)) + 2 * offset
+    trade_assets = generator.choice(_ASSETS, (count_trades, 2))
+    trades = pandas.DataFrame({'date': numpy.repeat(trade_dates, 2),
+                               'asset': trade_assets.ravel(),
+                               'amount': generator.uniform(-5., 5., 2 * count_trades),
+                               'fee': 0.,
+                               'exchange': 'benchmark'})
+    return flows, prices, trades
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarking P&L computation against number of flows',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+    parser.add_argument('--flows',
+                        type=str,
+                        help='comma-separated list of flows counts',
+                        default=_DEFAULT_FLOWS_COUNTS
+                        )
+    parser.add_argument('--prices',
+                        type=int,
+                        help='number of price timestamps',
+                        default=_DEFAULT_PRICES_COUNT
+                        )
+    parser.add_argument('--trades',
+                        type=int,
+                        help='number of trades',
+                        default=_DEFAULT_TRADES_COUNT
+                        )
+    parser.add_argument('--repeat',
+                        type=int,
+                        help='number of timed runs for each flows count',
+                        default=_DEFAULT_REPEAT
+                        )
+    args = parser.parse_args()
+
+    logging.info('{:>8} {:>12}'.format('flows', 'seconds'))
+    for count_flows in [int(count) for count in args.flows.split(',')]:
+        flows, prices, trades = generate_data(count_flows, args.prices, args.trades)
+        # silencing the P&L computation logs while timing
+        logging.disable(logging.INFO)
+        timings = timeit.repeat(lambda: compute_pnl(_REPORTING_CURRENCY, flows, prices, trades),
+                                repeat=args.repeat, number=1)
+        logging.disable(logging.NOTSET)
+        logging.info('{:>8} {:>12.4f}'.format(count_flows, min(timings)))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    file_handler = logging.FileHandler('{}.log'.format(path.basename(__file__).split('.')[0]), mode='w')
+    formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    file_handler.setFormatter(formatter)
+    logging.getLogger().addHandler(file_handler)
+    try:
+        main()
+
+    except:
+        logging.exception('error occured')
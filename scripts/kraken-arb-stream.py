@@ -0,0 +1,97 @@
+import argparse
+import logging
+import time
+from os import path
+
+from arbitrage import find_triangles
+from bookstream import BookStream, iter_recorded_messages, iter_socket_messages, create_replay_server
+from exchanges import kraken
+
+_DEFAULT_DEPTH = 10
+_DEFAULT_FEED_HOST = 'localhost'
+_DEFAULT_FEED_PORT = 9876
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scanning arbitrage opportunities from streamed order books',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+    parser.add_argument('--replay',
+                        type=str,
+                        help='file of recorded book messages, one JSON document per line'
+                        )
+    parser.add_argument('--feed-host',
+                        type=str,
+                        help='host of the book messages feed',
+                        default=_DEFAULT_FEED_HOST
+                        )
+    parser.add_argument('--feed-port',
+                        type=int,
+                        help='port of the book messages feed, used when no replay file is given',
+                        default=_DEFAULT_FEED_PORT
+                        )
+    parser.add_argument('--serve',
+                        action='store_true',
+                        help='serving the replay file on the feed port instead of scanning'
+                        )
+    parser.add_argument('--interval',
+                        type=float,
+                        help='seconds between two replayed messages when serving',
+                        default=0.
+                        )
+    parser.add_argument('--depth',
+                        type=int,
+                        help='number of levels kept on each side of the books',
+                        default=_DEFAULT_DEPTH
+                        )
+    args = parser.parse_args()
+    if args.serve and args.replay is None:
+        parser.error('--serve requires a --replay file')
+
+    if args.serve:
+        messages = list(iter_recorded_messages(args.replay))
+        server = create_replay_server(messages, host=args.feed_host, port=args.feed_port, interval=args.interval)
+        logging.info('serving {} messages on {}'.format(len(messages), server.server_address))
+        server.serve_forever()
+        return
+
+    kraken.connect()
+    tradeable_pairs = kraken.get_tradeable_pairs()
+    pair_codes = dict()
+    if 'wsname' in tradeable_pairs.columns:
+        pair_codes = dict(zip(tradeable_pairs['wsname'], tradeable_pairs['pair_code']))
+
+    stream = BookStream(find_triangles(tradeable_pairs), depth=args.depth, pair_codes=pair_codes)
+    if args.replay:
+        messages = iter_recorded_messages(args.replay)
+
+    else:
+        messages = iter_socket_messages(args.feed_host, args.feed_port)
+
+    for message in messages:
+        start = time.perf_counter()
+        result = stream.on_message(message)
+        if result is None:
+            continue
+
+        pair_code, opportunities = result
+        logging.debug('updated {} in {:.6f}s'.format(pair_code, time.perf_counter() - start))
+        for triangle, opportunity in opportunities:
+            trades, balances = opportunity.to_frames()
+            logging.info('opportunity on {}:\n{}\n{}'.format(triangle, trades, balances))
+
+    logging.info('evaluated {} triangles'.format(stream.evaluations))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    logging.getLogger('requests').setLevel(logging.WARNING)
+    file_handler = logging.FileHandler('{}.log'.format(path.basename(__file__).split('.')[0]), mode='w')
+    formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    file_handler.setFormatter(formatter)
+    logging.getLogger().addHandler(file_handler)
+    try:
+        main()
+
+    except:
+        logging.exception('error occured')
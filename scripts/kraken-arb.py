@@ -1,35 +1,102 @@
 import argparse
+import itertools
 import json
 import logging
 import os
 from os import path
 
-from arbitrage import scan_arbitrage_opportunities
+from arbitrage import scan_arbitrage_opportunities, scan_arbitrage_cycles, scan_arbitrage_depth
+from arbitrage import find_triangles, build_currency_graph
 from exchanges import kraken
 
 _DEFAULT_CONFIG_FILE = 'config.json'
+_DEFAULT_MAX_LEGS = 4
+_DEFAULT_FEE = 0.0026
+_DEFAULT_DEPTH = 25
+_DEFAULT_MAX_WORKERS = 4
 
 
 def main():
     parser = argparse.ArgumentParser(description='Scanning arbitrage opportunities',
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter
                                      )
+    parser.add_argument('--mode',
+                        type=str,
+                        choices=['triangles', 'table', 'depth', 'cycles'],
+                        help='scanning triangles of pairs, ranking all the triangles at once, sizing them against the '
+                             'order books depth or scanning cycles of any number of legs',
+                        default='triangles'
+                        )
+    parser.add_argument('--max-legs',
+                        type=int,
+                        help='maximum number of legs in cycles mode',
+                        default=_DEFAULT_MAX_LEGS
+                        )
+    parser.add_argument('--fee',
+                        type=float,
+                        help='fee rate charged on each leg in cycles and depth modes',
+                        default=_DEFAULT_FEE
+                        )
+    parser.add_argument('--depth',
+                        type=int,
+                        help='number of order book levels in depth mode',
+                        default=_DEFAULT_DEPTH
+                        )
+    parser.add_argument('--max-workers',
+                        type=int,
+                        help='number of concurrent order book requests',
+                        default=_DEFAULT_MAX_WORKERS
+                        )
+    args = parser.parse_args()
 
     kraken.connect()
 
     tradeable_pairs = kraken.get_tradeable_pairs()
 
+    if args.mode == 'cycles':
+        graph = build_currency_graph(tradeable_pairs)
+        pairs = [pair_code for pair_code, _, _ in graph[1]]
+
+    else:
+        triangles = find_triangles(tradeable_pairs)
+        pairs = itertools.chain.from_iterable(triangles)
+
+    # one request per pair for the whole scan
+    depth = args.depth if args.mode == 'depth' else 1
+    order_books = kraken.get_order_books(pairs, depth=depth, max_workers=args.max_workers, compact=True)
+    logging.info('loaded {} order books'.format(len(order_books)))
+
+    def order_book():
+        def wrapped(pair):
+            return order_books.get(pair, (None, None))
+
+        return wrapped
+
     def order_book_l1():
         def wrapped(pair):
-            bid, ask = kraken.get_order_book(pair)
+            bid, ask = order_books.get(pair, (None, None))
             if bid is None or ask is None:
                 return None, None
 
-            return bid.iloc[0], ask.iloc[0]
+            return bid.best(), ask.best()
 
         return wrapped
 
-    results = scan_arbitrage_opportunities(tradeable_pairs, order_book_callbak=order_book_l1())
+    if args.mode == 'cycles':
+        results = scan_arbitrage_cycles(tradeable_pairs, order_book_callbak=order_book_l1(), max_length=args.max_legs,
+                                        fee=args.fee, graph=graph)
+
+    elif args.mode == 'depth':
+        results, _ = scan_arbitrage_depth(tradeable_pairs, order_book_callbak=order_book(), triangles=triangles,
+                                          fee=args.fee)
+
+    elif args.mode == 'table':
+        results = scan_arbitrage_opportunities(tradeable_pairs, order_book_callbak=order_book_l1(),
+                                               triangles=triangles, mode='table')
+
+    else:
+        results = scan_arbitrage_opportunities(tradeable_pairs, order_book_callbak=order_book_l1(),
+                                               triangles=triangles)
 
     logging.info('results:\n{}'.format(results))
 
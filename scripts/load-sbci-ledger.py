@@ -4,8 +4,14 @@ import logging
 import os
 from os import path
 
+import exchanges
+from datastore import save_dataset
+from ledgerstore import LedgerStore
+
 _DEFAULT_CONFIG_FILE = os.sep.join(('.', 'config.json'))
 _DEFAULT_DATA_PATH = '.'
+_DEFAULT_LEDGER_STORE_DIR = 'ledger-store'
+_DECIMAL_COLUMNS = ['amount', 'fee']
 
 
 def main():
@@ -27,6 +33,12 @@ def main():
                         default=_DEFAULT_DATA_PATH
                         )
 
+    help_msg_store_path = 'location of the local ledgers copy, using "{}" under the data path by default'
+    parser.add_argument('--ledger-store',
+                        metavar='STORE_PATH',
+                        type=str,
+                        help=help_msg_store_path.format(_DEFAULT_LEDGER_STORE_DIR)
+                        )
     args = parser.parse_args()
 
     full_config_path = os.path.abspath(args.config)
@@ -40,32 +52,20 @@ def main():
         raise RuntimeError('not a directory: {}'.format(full_data_path))
 
     os.makedirs(full_data_path, exist_ok=True)
+    store_path = args.ledger_store
+    if store_path is None:
+        store_path = os.sep.join([full_data_path, _DEFAULT_LEDGER_STORE_DIR])
 
-    # Exchange-related part ... TODO: make it generic by reading from config file
-    from exchanges import bittrex
-    api_key_bittrex = config_json['exchanges']['bittrex']['key']
-    secret_key_bittrex = config_json['exchanges']['bittrex']['secret']
-    flows_bittrex, trades_bittrex, currencies_bittrex = bittrex.retrieve_data(api_key_bittrex, secret_key_bittrex)
+    store = LedgerStore(os.path.abspath(store_path))
 
-    #from exchanges import kraken
-    #api_key_kraken = config_json['exchanges']['kraken']['key']
-    #secret_key_kraken = config_json['exchanges']['kraken']['secret']
-    #flows_kraken, trades_kraken, currencies_kraken = kraken.retrieve_data(api_key_kraken, secret_key_kraken)
-
-    #flows = flows_kraken
-    #trades = trades_kraken
-    #currencies = currencies_kraken
-
-    flows = flows_bittrex
-    trades = trades_bittrex
-    currencies = currencies_bittrex
-    flows.to_pickle(os.sep.join([full_data_path, 'flows.pkl']))
-    trades.to_pickle(os.sep.join([full_data_path, 'trades.pkl']))
+    exchanges_config = config_json['exchanges']
+    logging.info('loading ledgers from {}'.format(', '.join(sorted(exchanges_config))))
+    flows, trades, currencies = exchanges.retrieve_ledgers(exchanges_config, store=store)
+    save_dataset(flows, os.sep.join([full_data_path, 'flows']), decimal_columns=_DECIMAL_COLUMNS)
+    save_dataset(trades, os.sep.join([full_data_path, 'trades']), decimal_columns=_DECIMAL_COLUMNS)
     with open(os.sep.join([full_data_path, 'currencies.json']), 'w') as currencies_file:
         json.dump(list(currencies), currencies_file)
 
-    #
-
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
@@ -4,12 +4,17 @@ import logging
 import os
 from os import path
 
-from cryptocompare import load_crypto_compare_data
+from datetime import datetime
+
+from cryptocompare import load_crypto_compare_data, backfill_pairs_histo
+from pricestore import PriceStore
+from datastore import save_dataset
 
 _DEFAULT_EXCHANGE = 'CCCAGG'
 _DEFAULT_DATA_PATH = '.'
 _DEFAULT_TIME_SCALE = 'spot'
 _DEFAULT_REPORTING_CURRENCY = 'ETH'
+_DEFAULT_STORE_DIR = 'prices-store'
 
 
 def main():
@@ -47,6 +52,17 @@ def main():
                         help=help_msg_data_path.format(_DEFAULT_REPORTING_CURRENCY),
                         default=_DEFAULT_REPORTING_CURRENCY
                         )
+    help_msg_store_path = 'location of the local prices history, using "{}" under the data path by default'
+    parser.add_argument('--store',
+                        metavar='STORE_PATH',
+                        type=str,
+                        help=help_msg_store_path.format(_DEFAULT_STORE_DIR)
+                        )
+    help_msg_backfill = 'loads history back to the given date (YYYY-MM-DD) before updating prices'
+    parser.add_argument('--backfill-start',
+                        type=str,
+                        help=help_msg_backfill
+                        )
     args = parser.parse_args()
     reporting_currency = args.reporting_currency
 
@@ -63,8 +79,20 @@ def main():
     currencies.append(reporting_currency)
 
     reference_currencies = set([currency for pair in reference_pairs for currency in pair])
-    prices = load_crypto_compare_data(set(currencies), reference_currencies, exchange, time_scale=args.time_scale)
-    prices.to_pickle(os.sep.join([full_data_path, '_'.join([args.time_scale, 'prices']) + '.pkl']))
+    store_path = args.store
+    if store_path is None:
+        store_path = os.sep.join([full_data_path, _DEFAULT_STORE_DIR])
+
+    store = PriceStore(os.path.abspath(store_path))
+    if args.backfill_start is not None and args.time_scale != 'spot':
+        backfill_start = datetime.strptime(args.backfill_start, '%Y-%m-%d')
+        all_currencies = reference_currencies.union(currencies)
+        pairs = [(source, target) for source in all_currencies for target in reference_currencies if source != target]
+        backfill_pairs_histo(pairs, exchange, args.time_scale, backfill_start, store)
+
+    prices = load_crypto_compare_data(set(currencies), reference_currencies, exchange, time_scale=args.time_scale,
+                                      store=store)
+    save_dataset(prices, os.sep.join([full_data_path, '_'.join([args.time_scale, 'prices'])]))
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
@@ -6,10 +6,10 @@ from os import path
 from datetime import datetime
 
 import pandas
-import gspread
 
-from gservices import save_sheet, authorize_services
+from gservices import sync_frame, setup_services
 from sbcireport import compute_balances, extend_balances, compute_pnl
+from datastore import load_dataset, dataset_columns
 
 _DEFAULT_CONFIG_FILE = os.sep.join(('.', 'config.json'))
 _DEFAULT_GOOGLE_SVC_ACCT_CREDS_FILE = os.sep.join(('.', 'google-service-account-creds.json'))
@@ -32,14 +32,12 @@ def process_spreadsheet(credentials_file, spreadsheet_id, prices, pnl_history_re
     :return:
     """
     header_prices = [field for field in prices.reset_index().columns.tolist() if field != 'index']
-    authorized_http, credentials = authorize_services(credentials_file)
-    svc_sheet = gspread.authorize(credentials)
+    svc_drive, svc_sheets = setup_services(credentials_file)
     header_pnl = ['date', 'Portfolio P&L'] + [column for column in pnl_history_records.columns if
                                               column not in ('date', 'Portfolio P&L')]
-    pnl_history_records = pnl_history_records[header_pnl]
-    price_records = prices.sort_values('date', ascending=False).to_dict(orient='records')
-    save_sheet(svc_sheet, spreadsheet_id, _SHEET_TAB_PRICES, header_prices, price_records)
-    save_sheet(svc_sheet, spreadsheet_id, _SHEET_TAB_PNL, header_pnl, pnl_history_records.to_dict(orient='records'))
+    sync_frame(svc_sheets, spreadsheet_id, _SHEET_TAB_PRICES, prices.sort_values('date', ascending=False),
+               header=header_prices)
+    sync_frame(svc_sheets, spreadsheet_id, _SHEET_TAB_PNL, pnl_history_records, header=header_pnl)
 
 
 def main():
@@ -107,15 +105,24 @@ def main():
     if not os.path.isdir(full_data_path):
         raise RuntimeError('not a directory: {}'.format(full_data_path))
 
-    flows = pandas.read_pickle(os.sep.join([full_data_path, 'flows.pkl']))
-    trades = pandas.read_pickle(os.sep.join([full_data_path, 'trades.pkl']))
-    prices_daily = pandas.read_pickle(os.sep.join([full_data_path, 'day_prices.pkl']))
-    prices_hourly = pandas.read_pickle(os.sep.join([full_data_path, 'hour_prices.pkl']))
-    prices_spot = pandas.read_pickle(os.sep.join([full_data_path, 'spot_prices.pkl']))
-    prices = pandas.concat([prices_daily, prices_hourly, prices_spot]).sort_values('date', ascending=False)
-    prices[args.reporting_currency] = 1
+    flows = load_dataset(os.sep.join([full_data_path, 'flows']))
+    trades = load_dataset(os.sep.join([full_data_path, 'trades']))
     reporting_currency = args.reporting_currency
     fund_inception_date = datetime.strptime(args.inception_date, '%Y-%m-%d')
+    prices_start = min(flows['date'].min(), fund_inception_date) if not flows.empty else fund_inception_date
+    prices_list = list()
+    for time_scale in ('day', 'hour', 'spot'):
+        dataset_path = os.sep.join([full_data_path, '{}_prices'.format(time_scale)])
+        columns = None
+        if args.skip_google_update:
+            # only prices in the reporting currency are needed for the P&L
+            columns = [column for column in dataset_columns(dataset_path)
+                       if column == 'date' or column.endswith(reporting_currency)]
+
+        prices_list.append(load_dataset(dataset_path, columns=columns, start=prices_start))
+
+    prices = pandas.concat(prices_list).sort_values('date', ascending=False)
+    prices[args.reporting_currency] = 1
 
     pnl_history_records = compute_pnl(reporting_currency, flows, prices, trades)
     if fund_inception_date is not None:
@@ -127,7 +134,7 @@ def main():
         reporting_pairs = ['/'.join(pair) for pair in reference_pairs]
         remaining_columns = set(prices.columns).difference(set(reporting_pairs))
         remaining_columns.discard('date')
-        prices_out = prices[['date'] + reporting_pairs + list(remaining_columns)]
+        prices_out = prices[['date'] + reporting_pairs + sorted(remaining_columns)]
         logging.info('uploading {} rows for prices data'.format(prices.count().max()))
         process_spreadsheet(args.google_creds, config_json['target_sheet_id'], prices_out, pnl_history_records)
 
@@ -1,6 +1,7 @@
 import logging
 
 import itertools
+from collections import defaultdict, namedtuple
 
 import numpy
 import pandas
@@ -95,6 +96,112 @@ def sell_currency_using_pair(currency, volume, pair_code, bid, ask):
     return balance, performed_trade
 
 
+_TRADE_FIELDS = ('direction', 'pair', 'quantity', 'price', 'capped')
+
+
+class ArbitrageOpportunity(namedtuple('ArbitrageOpportunity', ['trades', 'balances'])):
+    """
+    Outcome of an arbitrage sequence: trades as tuples (direction, pair, quantity, price, capped) and balances as one
+    dict of amounts by currency for each trade.
+    """
+    __slots__ = ()
+
+    @property
+    def capped(self):
+        return any(trade is not None and trade[4] == trade[4] for trade in self.trades)
+
+    def balance(self, currency):
+        return sum(balance.get(currency, 0) for balance in self.balances)
+
+    def to_frames(self):
+        """
+        :return: (trades, balances) as DataFrame and Series
+        """
+        balances = pandas.concat([pandas.Series(balance, name=name) for balance, name in
+                                  zip(self.balances, ['initial', 'next', 'final'])], axis=1)
+        trades_df = pandas.DataFrame([dict(zip(_TRADE_FIELDS, trade)) if trade is not None else None
+                                      for trade in self.trades])
+        return trades_df, balances.sum(axis=1)
+
+
+def _trade(pair_code, bid_price, bid_volume, ask_price, ask_volume, volume):
+    """
+    Same as trade_pair using plain numbers.
+
+    :return: (balance, trade)
+    """
+    currency_first = pair_code[:4]
+    currency_second = pair_code[4:]
+    if volume > 0:
+        allowed_volume = min(volume, bid_volume)
+        capped = allowed_volume if allowed_volume < volume else numpy.NaN
+        return {currency_first: allowed_volume * -1, currency_second: allowed_volume * bid_price}, \
+            ('buy', pair_code, allowed_volume, bid_price, capped)
+
+    elif volume < 0:
+        allowed_volume = min(abs(volume), ask_volume)
+        capped = allowed_volume if allowed_volume < abs(volume) else numpy.NaN
+        return {currency_first: allowed_volume, currency_second: allowed_volume * ask_price * -1}, \
+            ('sell', pair_code, allowed_volume, ask_price, capped)
+
+    return {currency_first: 0, currency_second: 0}, None
+
+
+def evaluate_arbitrage_opportunity(pairs, bids, asks, skip_capped=True):
+    """
+    Numeric core of calculate_arbitrage_opportunity, without any pandas object or logging.
+
+    :param pairs: three pair codes
+    :param bids: top of the book (price, volume) for each pair
+    :param asks: top of the book (price, volume) for each pair
+    :param skip_capped:
+    :return: list of ArbitrageOpportunity
+    """
+    results = list()
+    for first, second, third in itertools.permutations([0, 1, 2]):
+        currency_initial = pairs[first][4:]
+        if currency_initial in pairs[second]:
+            following, final = second, third
+
+        else:
+            following, final = third, second
+
+        next_pair = pairs[following]
+        final_pair = pairs[final]
+        if next_pair[:4] != currency_initial:
+            currency_next = next_pair[:4]
+
+        else:
+            currency_next = next_pair[4:]
+
+        # buying one unit of the initial currency
+        bid_price, bid_volume = bids[first]
+        ask_price, ask_volume = asks[first]
+        balance_initial, trade_initial = _trade(pairs[first], bid_price, bid_volume, ask_price, ask_volume,
+                                                round(1 / bid_price, 10))
+        # selling it, then the next currency
+        volume = balance_initial[currency_initial]
+        bid_price, bid_volume = bids[following]
+        ask_price, ask_volume = asks[following]
+        if next_pair[4:] == currency_initial:
+            volume = round(-1 * volume / ask_price, 10)
+
+        balance_next, trade_next = _trade(next_pair, bid_price, bid_volume, ask_price, ask_volume, volume)
+        volume = balance_next[currency_next]
+        bid_price, bid_volume = bids[final]
+        ask_price, ask_volume = asks[final]
+        if final_pair[4:] == currency_next:
+            volume = round(-1 * volume / ask_price, 10)
+
+        balance_final, trade_final = _trade(final_pair, bid_price, bid_volume, ask_price, ask_volume, volume)
+        opportunity = ArbitrageOpportunity((trade_initial, trade_next, trade_final),
+                                           (balance_initial, balance_next, balance_final))
+        if not skip_capped or not opportunity.capped:
+            results.append(opportunity)
+
+    return results
+
+
 def calculate_arbitrage_opportunity(pair_1, pair_bid_1, pair_ask_1, pair_2, pair_bid_2, pair_ask_2, pair_3, pair_bid_3,
                                     pair_ask_3, skip_capped=True):
     """
@@ -111,90 +218,539 @@ def calculate_arbitrage_opportunity(pair_1, pair_bid_1, pair_ask_1, pair_2, pair
     :param skip_capped:
     :return: (trades, balances)
     """
-    pairs = [pair_1, pair_2, pair_3]
-    pair_bids = [pair_bid_1, pair_bid_2, pair_bid_3]
-    pair_asks = [pair_ask_1, pair_ask_2, pair_ask_3]
+    bids = [(pair_bid['price'], pair_bid['volume']) for pair_bid in (pair_bid_1, pair_bid_2, pair_bid_3)]
+    asks = [(pair_ask['price'], pair_ask['volume']) for pair_ask in (pair_ask_1, pair_ask_2, pair_ask_3)]
+    opportunities = evaluate_arbitrage_opportunity([pair_1, pair_2, pair_3], bids, asks, skip_capped=skip_capped)
+    return [opportunity.to_frames() for opportunity in opportunities]
+
+
+def find_triangles(tradeable_pairs):
+    """
+    Lists the triangles of the currency graph, as tuples of pair codes (direct, indirect 1, indirect 2) with
+    direct = leg 1 + leg 2, indirect 1 = leg 1 + common leg and indirect 2 = leg 2 + common leg.
+
+    The index only depends on the tradeable pairs and can be reused across scans.
+
+    :param tradeable_pairs: DataFrame with columns pair_code, base and quote
+    :return: list of (direct_pair, indirect_pair_1, indirect_pair_2)
+    """
+    available_pairs = set(tradeable_pairs['pair_code'].tolist())
+    quotes_by_base = defaultdict(set)
+    bases_by_quote = defaultdict(set)
+    for base, quote in zip(tradeable_pairs['base'].tolist(), tradeable_pairs['quote'].tolist()):
+        if base != quote and base + quote in available_pairs:
+            quotes_by_base[base].add(quote)
+            bases_by_quote[quote].add(base)
+
+    triangles = list()
+    for common_leg in sorted(bases_by_quote):
+        legs = bases_by_quote[common_leg]
+        for leg_pair1 in sorted(legs):
+            for leg_pair2 in sorted(quotes_by_base[leg_pair1] & legs):
+                triangles.append((leg_pair1 + leg_pair2, leg_pair1 + common_leg, leg_pair2 + common_leg))
+
+    return triangles
+
+
+def triangle_legs(pair_codes, triangles):
+    """
+    Execution order of the six permutations of each triangle, as evaluated by calculate_arbitrage_opportunity.
+
+    The first leg sells the base of its pair for one unit of its quote, the next legs either sell the base of their
+    pair or buy it, until getting back to the base of the first pair.
+
+    :param pair_codes: list of pair codes, positions being used as pair indices
+    :param triangles: list of triangles of pair codes, as returned by find_triangles
+    :return: (legs, sells_base) arrays of shape (6 * triangles, 3), pair indices and whether each leg sells the base
+    """
+    positions = {pair_code: position for position, pair_code in enumerate(pair_codes)}
+    legs = list()
+    sells_base = list()
+    for pairs in triangles:
+        for first, second, third in itertools.permutations([0, 1, 2]):
+            currency_initial = pairs[first][4:]
+            if currency_initial in pairs[second]:
+                following, final = second, third
+
+            else:
+                following, final = third, second
+
+            next_pair = pairs[following]
+            if next_pair[:4] != currency_initial:
+                currency_next = next_pair[:4]
+
+            else:
+                currency_next = next_pair[4:]
+
+            legs.append([positions[pairs[first]], positions[next_pair], positions[pairs[final]]])
+            sells_base.append([True, next_pair[4:] != currency_initial, pairs[final][4:] != currency_next])
+
+    return numpy.array(legs, dtype=int).reshape(-1, 3), numpy.array(sells_base, dtype=bool).reshape(-1, 3)
+
+
+def evaluate_triangles(bid_prices, bid_volumes, ask_prices, ask_volumes, legs, sells_base):
+    """
+    Batched version of evaluate_arbitrage_opportunity over arrays of top of the book quotes.
+
+    :param bid_prices: bid price by pair index
+    :param bid_volumes: bid volume by pair index
+    :param ask_prices: ask price by pair index
+    :param ask_volumes: ask volume by pair index
+    :param legs: pair indices as returned by triangle_legs
+    :param sells_base: as returned by triangle_legs
+    :return: (balances, capped) with balances of shape (n, 3) for the base of the first pair, the currency received
+     from the first leg and the currency received from the second leg
+    """
+    count = legs.shape[0]
+    volume = numpy.ones(count)
+    received = list()
+    paid = list()
+    capped = numpy.zeros(count, dtype=bool)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for step in range(3):
+            pair = legs[:, step]
+            selling = sells_base[:, step]
+            if step == 0:
+                # buying one unit of the quote
+                volume = numpy.round(volume / bid_prices[pair], 10)
+
+            else:
+                volume = numpy.where(selling, volume, numpy.round(volume / ask_prices[pair], 10))
+
+            available = numpy.where(selling, bid_volumes[pair], ask_volumes[pair])
+            allowed_volume = numpy.minimum(volume, available)
+            capped |= allowed_volume < volume
+            paid.append(numpy.where(selling, allowed_volume, allowed_volume * ask_prices[pair]))
+            volume = numpy.where(selling, allowed_volume * bid_prices[pair], allowed_volume)
+            received.append(volume)
+
+    balances = numpy.column_stack([received[2] - paid[0], received[0] - paid[1], received[1] - paid[2]])
+    return balances, capped
+
+
+def scan_arbitrage_table(tradeable_pairs, order_book_callbak, triangles=None):
+    """
+    Evaluates all the triangles at once from the top of the book of each pair.
+
+    :param tradeable_pairs: DataFrame with columns pair_code, base and quote
+    :param order_book_callbak: function returning top of the book (bid, ask) for a pair code
+    :param triangles: triangles index as returned by find_triangles, computed from tradeable_pairs if missing
+    :return: DataFrame of opportunities ranked by decreasing return, with columns pair_1, pair_2, pair_3, currency,
+     volume, balance, return and capped
+    """
+    if triangles is None:
+        triangles = find_triangles(tradeable_pairs)
+
+    pair_codes = sorted(set(itertools.chain.from_iterable(triangles)))
+    quotes = numpy.full((len(pair_codes), 4), numpy.NaN)
+    for position, pair_code in enumerate(pair_codes):
+        bid, ask = order_book_callbak(pair_code)
+        if bid is None or ask is None:
+            continue
+
+        quotes[position] = [bid['price'], bid['volume'], ask['price'], ask['volume']]
+
+    legs, sells_base = triangle_legs(pair_codes, triangles)
+    balances, capped = evaluate_triangles(quotes[:, 0], quotes[:, 1], quotes[:, 2], quotes[:, 3], legs, sells_base)
+    pair_codes = numpy.array(pair_codes, dtype=object)
+    first_pairs = pair_codes[legs[:, 0]]
+    volume = numpy.round(1. / quotes[legs[:, 0], 0], 10)
+    table = pandas.DataFrame({'pair_1': first_pairs,
+                              'pair_2': pair_codes[legs[:, 1]],
+                              'pair_3': pair_codes[legs[:, 2]],
+                              'currency': [pair_code[:4] for pair_code in first_pairs],
+                              'volume': volume,
+                              'balance': balances[:, 0],
+                              'return': balances[:, 0] / volume,
+                              'capped': capped},
+                             columns=['pair_1', 'pair_2', 'pair_3', 'currency', 'volume', 'balance', 'return',
+                                      'capped'])
+    table = table[numpy.isfinite(quotes[legs].reshape(legs.shape[0], -1)).all(axis=1)]
+    # permutations of a triangle come by pairs of identical execution sequences
+    table = table.drop_duplicates(['pair_1', 'pair_2', 'pair_3'])
+    return table.sort_values('return', ascending=False).reset_index(drop=True)
+
+
+def depth_curve(prices, volumes, sells_base, fee=0.):
+    """
+    Cumulated amounts given and received when walking one side of the book. Selling the base walks down the bids,
+    giving base and receiving quote, buying the base walks up the asks, giving quote and receiving base.
+
+    :param prices: level prices, from the best one
+    :param volumes: level volumes
+    :param sells_base:
+    :param fee: fee rate charged on the received amount
+    :return: (given, received) non decreasing arrays starting at zero, one point per level
+    """
+    prices = numpy.asarray(prices, dtype=float)
+    volumes = numpy.asarray(volumes, dtype=float)
+    volume_sums = numpy.concatenate([[0.], numpy.cumsum(volumes)])
+    notional_sums = numpy.concatenate([[0.], numpy.cumsum(prices * volumes)])
+    if sells_base:
+        return volume_sums, notional_sums * (1. - fee)
+
+    return notional_sums, volume_sums * (1. - fee)
+
+
+class ArbitrageSizing(namedtuple('ArbitrageSizing', ['pairs', 'sells_base', 'amounts', 'depths'])):
+    """
+    Sized arbitrage sequence: amounts[0] is given to the first leg and amounts[i] is received from leg i and given to
+    the next one. Depths are the largest amounts each leg can take from the book.
+    """
+    __slots__ = ()
+
+    @property
+    def currency(self):
+        return self.pairs[0][:4] if self.sells_base[0] else self.pairs[0][4:]
+
+    @property
+    def volume(self):
+        return self.amounts[0]
+
+    @property
+    def profit(self):
+        return self.amounts[-1] - self.amounts[0]
+
+    @property
+    def prices(self):
+        """
+        Volume weighted execution price of each leg.
+        """
+        prices = list()
+        for sells_base, given, received in zip(self.sells_base, self.amounts[:-1], self.amounts[1:]):
+            base, quote = (given, received) if sells_base else (received, given)
+            prices.append(quote / base if base > 0 else numpy.NaN)
+
+        return prices
+
+    def to_frames(self):
+        """
+        :return: (trades, balances) as DataFrame and Series, in the format of calculate_arbitrage_opportunity
+        """
+        trades = list()
+        balances = list()
+        legs = zip(self.pairs, self.sells_base, self.amounts[:-1], self.amounts[1:], self.depths, self.prices)
+        for pair_code, sells_base, given, received, depth, price in legs:
+            base, quote = (given, received) if sells_base else (received, given)
+            capped = base if given >= depth else numpy.NaN
+            if sells_base:
+                balances.append(pandas.Series({pair_code[:4]: -base, pair_code[4:]: quote}))
+                trades.append({'direction': 'buy', 'pair': pair_code, 'quantity': base, 'price': price,
+                               'capped': capped})
+
+            else:
+                balances.append(pandas.Series({pair_code[:4]: base, pair_code[4:]: -quote}))
+                trades.append({'direction': 'sell', 'pair': pair_code, 'quantity': base, 'price': price,
+                               'capped': capped})
+
+        return pandas.DataFrame(trades), pandas.concat(balances, axis=1).sum(axis=1)
+
+
+def size_arbitrage(pairs, sells_base, curves):
+    """
+    Largest amount traded along the legs while every additional unit is still profitable, which maximizes the profit.
+
+    The composition of the depth curves is piecewise linear and concave, so the optimum is found among the levels of
+    every leg mapped back to amounts given to the first leg.
+
+    :param pairs: pair code of each leg
+    :param sells_base: whether each leg sells the base of its pair
+    :param curves: (given, received) of each leg, as returned by depth_curve
+    :return: ArbitrageSizing
+    """
+    depth = curves[-1][0][-1]
+    depths = [depth]
+    for given, received in reversed(curves[:-1]):
+        depth = min(given[-1], numpy.interp(depth, received, given))
+        depths.insert(0, depth)
+
+    candidates = list()
+    for position, (given, received) in enumerate(curves):
+        points = given
+        for previous_given, previous_received in reversed(curves[:position]):
+            points = numpy.interp(points, previous_received, previous_given)
+
+        candidates.append(points)
+
+    candidates = numpy.unique(numpy.clip(numpy.concatenate(candidates), 0., depths[0]))
+    amounts = [candidates]
+    for given, received in curves:
+        amounts.append(numpy.interp(amounts[-1], given, received))
+
+    profits = amounts[-1] - amounts[0]
+    best = profits.argmax()
+    if profits[best] <= 0.:
+        best = 0
+
+    return ArbitrageSizing(tuple(pairs), tuple(sells_base), tuple(float(amount[best]) for amount in amounts),
+                           tuple(float(given[-1]) for given, _ in curves))
+
+
+def scan_arbitrage_depth(tradeable_pairs, order_book_callbak, triangles=None, fee=0.):
+    """
+    Sizes every triangle against the full depth of the order books.
+
+    :param tradeable_pairs: DataFrame with columns pair_code, base and quote
+    :param order_book_callbak: function returning the order book (bids, asks) for a pair code, as DataFrames of
+     levels with columns price and volume or as orderbook.BookSide
+    :param triangles: triangles index as returned by find_triangles, computed from tradeable_pairs if missing
+    :param fee: fee rate charged on each leg
+    :return: (table, sizings) with the table ranked by decreasing return, with columns pair_1, pair_2, pair_3,
+     currency, volume, balance, return, price_1, price_2 and price_3, and the matching ArbitrageSizing records
+    """
+    if triangles is None:
+        triangles = find_triangles(tradeable_pairs)
+
+    pair_codes = sorted(set(itertools.chain.from_iterable(triangles)))
+    curves = dict()
+    for pair_code in pair_codes:
+        bids, asks = order_book_callbak(pair_code)
+        if bids is None or asks is None:
+            continue
+
+        curves[(pair_code, True)] = depth_curve(bids['price'], bids['volume'], True, fee)
+        curves[(pair_code, False)] = depth_curve(asks['price'], asks['volume'], False, fee)
+
+    legs, sells_base = triangle_legs(pair_codes, triangles)
+    sequences = numpy.unique(numpy.column_stack([legs, sells_base]), axis=0)
+    sizings = list()
+    for sequence in sequences:
+        pairs = [pair_codes[leg] for leg in sequence[:3]]
+        sequence_sells_base = sequence[3:].astype(bool).tolist()
+        keys = list(zip(pairs, sequence_sells_base))
+        if any(key not in curves for key in keys):
+            continue
+
+        sizings.append(size_arbitrage(pairs, sequence_sells_base, [curves[key] for key in keys]))
+
+    table = pandas.DataFrame([dict([('pair_{}'.format(count + 1), pair_code)
+                                    for count, pair_code in enumerate(sizing.pairs)] +
+                                   [('price_{}'.format(count + 1), price)
+                                    for count, price in enumerate(sizing.prices)] +
+                                   [('currency', sizing.currency), ('volume', sizing.volume),
+                                    ('balance', sizing.profit),
+                                    ('return', sizing.profit / sizing.volume if sizing.volume > 0 else 0.)])
+                              for sizing in sizings],
+                             columns=['pair_1', 'pair_2', 'pair_3', 'currency', 'volume', 'balance', 'return',
+                                      'price_1', 'price_2', 'price_3'])
+    ranking = table.sort_values('return', ascending=False).index
+    return table.loc[ranking].reset_index(drop=True), [sizings[position] for position in ranking]
+
+
+_SCAN_MODES = ('frames', 'records', 'table')
+
+
+def scan_arbitrage_opportunities(tradeable_pairs, order_book_callbak, triangles=None, mode='frames', as_frames=None):
+    """
+    Evaluates arbitrage opportunities over all the triangles of tradeable pairs.
+
+    :param tradeable_pairs: DataFrame with columns pair_code, base and quote
+    :param order_book_callbak: function returning top of the book (bid, ask) for a pair code
+    :param triangles: triangles index as returned by find_triangles, computed from tradeable_pairs if missing
+    :param mode: 'frames' for (trades, balances) frames, 'records' for ArbitrageOpportunity records, 'table' for a
+     ranked table of all the directions of every triangle as returned by scan_arbitrage_table
+    :param as_frames: kept for compatibility, True for mode 'frames' and False for mode 'records'
+    :return: list of opportunities as returned by calculate_arbitrage_opportunity, one per triangle
+    """
+    if as_frames is not None:
+        mode = 'frames' if as_frames else 'records'
+
+    if mode not in _SCAN_MODES:
+        raise ValueError('unknown scan mode "{}", expected one of {}'.format(mode, _SCAN_MODES))
+
+    if triangles is None:
+        triangles = find_triangles(tradeable_pairs)
+
+    logging.info('scanning {} triangles'.format(len(triangles)))
+    if mode == 'table':
+        return scan_arbitrage_table(tradeable_pairs, order_book_callbak, triangles=triangles)
+
     results = list()
-    for first, second, third in itertools.permutations([0, 1, 2]):
-        currency_initial = pairs[first][4:]
-        initial_bid = pair_bids[first]
-        initial_ask = pair_asks[first]
-        if currency_initial in pairs[second]:
-            next_pair = pairs[second]
-            next_bid = pair_bids[second]
-            next_ask = pair_asks[second]
-            final_pair = pairs[third]
-            final_bid = pair_bids[third]
-            final_ask = pair_asks[third]
+    for direct_pair, indirect_pair_1, indirect_pair_2 in triangles:
+        logging.info('trying pair {} with {} and {}'.format(direct_pair, indirect_pair_1, indirect_pair_2))
+        direct_bid, direct_ask = order_book_callbak(direct_pair)
+        if direct_bid is None or direct_ask is None:
+            continue
 
-        else:
-            next_pair = pairs[third]
-            next_bid = pair_bids[third]
-            next_ask = pair_asks[third]
-            final_pair = pairs[second]
-            final_bid = pair_bids[second]
-            final_ask = pair_asks[second]
+        indirect_bid_1, indirect_ask_1 = order_book_callbak(indirect_pair_1)
+        if indirect_bid_1 is None or indirect_ask_1 is None:
+            continue
 
-        if next_pair[:4] != currency_initial:
-            currency_next = next_pair[:4]
+        indirect_bid_2, indirect_ask_2 = order_book_callbak(indirect_pair_2)
+        if indirect_bid_2 is None or indirect_ask_2 is None:
+            continue
 
-        else:
-            currency_next = next_pair[4:]
+        pairs = [direct_pair, indirect_pair_1, indirect_pair_2]
+        bids = [(bid['price'], bid['volume']) for bid in (direct_bid, indirect_bid_1, indirect_bid_2)]
+        asks = [(ask['price'], ask['volume']) for ask in (direct_ask, indirect_ask_1, indirect_ask_2)]
+        arbitrage_ratio = evaluate_arbitrage_opportunity(pairs, bids, asks)
+        if mode == 'frames':
+            arbitrage_ratio = [opportunity.to_frames() for opportunity in arbitrage_ratio]
 
-        balance_initial, trade_initial = buy_currency_using_pair(currency_initial, 1, pairs[first], initial_bid,
-                                                                 initial_ask)
-        balance_next, trade_next = sell_currency_using_pair(currency_initial, balance_initial[currency_initial],
-                                                            next_pair, next_bid, next_ask)
-        balance_final, trade_final = sell_currency_using_pair(currency_next, balance_next[currency_next], final_pair,
-                                                              final_bid, final_ask)
-
-        balance1_series = pandas.Series(balance_initial, name='initial')
-        balance2_series = pandas.Series(balance_next, name='next')
-        balance3_series = pandas.Series(balance_final, name='final')
-        balances = pandas.concat([balance1_series, balance2_series, balance3_series], axis=1)
-        trades_df = pandas.DataFrame([trade_initial, trade_next, trade_final])
-        if not skip_capped or trades_df['capped'].count() == 0:
-            results.append((trades_df, balances.sum(axis=1)))
+        results.append(arbitrage_ratio)
 
     return results
 
 
-def scan_arbitrage_opportunities(tradeable_pairs, order_book_callbak):
-    assets = set(tradeable_pairs['base'].tolist()).union(tradeable_pairs['quote'].tolist())
+def build_currency_graph(tradeable_pairs):
+    """
+    Indexes the assets of the tradeable pairs, keeping the pairs whose code is the concatenation of base and quote.
+
+    :param tradeable_pairs: DataFrame with columns pair_code, base and quote
+    :return: (assets, pairs) with pairs as a list of (pair_code, base index, quote index)
+    """
     available_pairs = set(tradeable_pairs['pair_code'].tolist())
-    logging.info('available pairs: {}'.format(available_pairs))
-    logging.info('available assets: {}'.format(assets))
-    results = list()
-    for common_leg in assets:
-        logging.debug('trying currency {}'.format(common_leg))
-        for leg_pair1 in assets:
-            if leg_pair1 == common_leg:
+    legs = [(base, quote) for base, quote in zip(tradeable_pairs['base'].tolist(), tradeable_pairs['quote'].tolist())
+            if base != quote and base + quote in available_pairs]
+    assets = sorted(set(itertools.chain.from_iterable(legs)))
+    positions = {asset: position for position, asset in enumerate(assets)}
+    pairs = [(base + quote, positions[base], positions[quote]) for base, quote in sorted(set(legs))]
+    return assets, pairs
+
+
+def quote_rates(count_assets, pairs, books, fee=0.):
+    """
+    Conversion rates between assets from top of the book quotes, net of fees.
+
+    Selling the base at the bid converts base into quote, buying it at the ask converts quote into base.
+
+    :param count_assets:
+    :param pairs: list of (pair_code, base index, quote index)
+    :param books: dict of (bid, ask) by pair code, missing pairs being ignored
+    :param fee: fee rate charged on the received amount
+    :return: (rates, edges) where rates[i, j] is the amount of asset j received for one unit of asset i and edges
+     maps (i, j) to the pair code used for the conversion
+    """
+    rates = numpy.zeros((count_assets, count_assets))
+    edges = dict()
+    for pair_code, base, quote in pairs:
+        if pair_code not in books:
+            continue
+
+        bid, ask = books[pair_code]
+        for source, target, rate in ((base, quote, bid['price']), (quote, base, 1. / ask['price'])):
+            rate *= 1. - fee
+            if rate > rates[source, target]:
+                rates[source, target] = rate
+                edges[(source, target)] = pair_code
+
+    return rates, edges
+
+
+def find_negative_cycles(rates, max_length, tolerance=1e-12):
+    """
+    Bellman-Ford relaxation over the -log(rate) adjacency matrix, starting from a virtual source linked to every
+    asset. Each iteration relaxes all the edges at once, cycles are read from the predecessors of the improved nodes.
+
+    :param rates: square matrix of conversion rates, zero when there is no conversion
+    :param max_length: maximum number of legs in a cycle
+    :param tolerance: minimum log-return of a cycle
+    :return: list of cycles as lists of asset indices, from the most profitable one
+    """
+    count_assets = rates.shape[0]
+    with numpy.errstate(divide='ignore'):
+        weights = numpy.where(rates > 0., -numpy.log(numpy.where(rates > 0., rates, 1.)), numpy.inf)
+
+    numpy.fill_diagonal(weights, numpy.inf)
+    distances = numpy.zeros(count_assets)
+    predecessors = numpy.full(count_assets, -1)
+    nodes = numpy.arange(count_assets)
+    cycles = dict()
+    for _ in range(count_assets):
+        candidates = distances[:, numpy.newaxis] + weights
+        best = candidates.argmin(axis=0)
+        best_distances = candidates[best, nodes]
+        improved = best_distances < distances - tolerance
+        if not improved.any():
+            break
+
+        distances = numpy.where(improved, best_distances, distances)
+        predecessors = numpy.where(improved, best, predecessors)
+        for node in nodes[improved].tolist():
+            path = [node]
+            visited = {node: 0}
+            current = int(predecessors[node])
+            while current >= 0 and current not in visited and len(path) <= count_assets:
+                visited[current] = len(path)
+                path.append(current)
+                current = int(predecessors[current])
+
+            if current < 0 or current not in visited:
+                continue
+
+            cycle = list(reversed(path[visited[current]:]))
+            if len(cycle) > max_length:
                 continue
 
-            for leg_pair2 in assets:
-                if leg_pair2 == common_leg or leg_pair2 == leg_pair1:
-                    continue
+            start = cycle.index(min(cycle))
+            cycle = tuple(cycle[start:] + cycle[:start])
+            weight = sum(weights[source, target] for source, target in zip(cycle, cycle[1:] + cycle[:1]))
+            if weight < -tolerance:
+                cycles[cycle] = weight
 
-                direct_pair = leg_pair1 + leg_pair2
-                indirect_pair_1 = leg_pair1 + common_leg
-                indirect_pair_2 = leg_pair2 + common_leg
-                if available_pairs.issuperset({direct_pair, indirect_pair_1, indirect_pair_2}):
-                    logging.info('trying pair {} with {} and {}'.format(direct_pair, indirect_pair_1, indirect_pair_2))
-                    direct_bid, direct_ask = order_book_callbak(direct_pair)
-                    if direct_bid is None or direct_ask is None:
-                        continue
+    return [list(cycle) for cycle, weight in sorted(cycles.items(), key=lambda item: item[1])]
 
-                    indirect_bid_1, indirect_ask_1 = order_book_callbak(indirect_pair_1)
-                    if indirect_bid_1 is None or indirect_ask_1 is None:
-                        continue
 
-                    indirect_bid_2, indirect_ask_2 = order_book_callbak(indirect_pair_2)
-                    if indirect_bid_2 is None or indirect_ask_2 is None:
-                        continue
+def calculate_cycle_opportunity(cycle, assets, edges, books, fee=0.):
+    """
+    Trades converting one unit of the first asset of the cycle along its legs.
 
-                    arbitrage_ratio = calculate_arbitrage_opportunity(direct_pair, direct_bid, direct_ask,
-                                                                      indirect_pair_1, indirect_bid_1, indirect_ask_1,
-                                                                      indirect_pair_2, indirect_bid_2, indirect_ask_2)
+    :param cycle: list of asset indices
+    :param assets: list of assets
+    :param edges: pair code by (source index, target index)
+    :param books: dict of (bid, ask) by pair code
+    :param fee: fee rate charged on the received amount
+    :return: (trades, balances)
+    """
+    volume = 1.
+    balances = list()
+    trades = list()
+    for source, target in zip(cycle, cycle[1:] + cycle[:1]):
+        pair_code = edges[(source, target)]
+        bid, ask = books[pair_code]
+        balance, trade = sell_currency_using_pair(assets[source], volume, pair_code, bid, ask)
+        received = balance[assets[target]]
+        balance[assets[target]] = received * (1. - fee)
+        trade['fee'] = received * fee
+        volume = balance[assets[target]]
+        balances.append(pandas.Series(balance))
+        trades.append(trade)
+
+    return pandas.DataFrame(trades), pandas.concat(balances, axis=1).sum(axis=1)
+
+
+def scan_arbitrage_cycles(tradeable_pairs, order_book_callbak, max_length=4, fee=0., graph=None, skip_capped=True):
+    """
+    Detects arbitrage opportunities of any number of legs up to max_length from top of the book quotes.
+
+    :param tradeable_pairs: DataFrame with columns pair_code, base and quote
+    :param order_book_callbak: function returning top of the book (bid, ask) for a pair code
+    :param max_length: maximum number of legs in a cycle
+    :param fee: fee rate charged on each leg
+    :param graph: (assets, pairs) as returned by build_currency_graph, computed from tradeable_pairs if missing
+    :param skip_capped: ignoring opportunities limited by the volume available at the top of the book
+    :return: list of (trades, balances), from the most profitable cycle
+    """
+    if graph is None:
+        graph = build_currency_graph(tradeable_pairs)
+
+    assets, pairs = graph
+    books = dict()
+    for pair_code, _, _ in pairs:
+        bid, ask = order_book_callbak(pair_code)
+        if bid is None or ask is None:
+            continue
+
+        books[pair_code] = ({'price': float(bid['price']), 'volume': float(bid['volume'])},
+                            {'price': float(ask['price']), 'volume': float(ask['volume'])})
+
+    rates, edges = quote_rates(len(assets), pairs, books, fee)
+    cycles = find_negative_cycles(rates, max_length)
+    logging.info('found {} arbitrage cycles'.format(len(cycles)))
+    results = list()
+    for cycle in cycles:
+        trades_df, balances = calculate_cycle_opportunity(cycle, assets, edges, books, fee)
+        if not skip_capped or trades_df['capped'].count() == 0:
+            results.append((trades_df, balances))
 
-                    results.append(arbitrage_ratio)
     return results
@@ -0,0 +1,211 @@
+import json
+import logging
+import socket
+import socketserver
+import time
+from collections import defaultdict
+
+from arbitrage import evaluate_arbitrage_opportunity
+
+_DEFAULT_DEPTH = 10
+
+
+class OrderBook(object):
+    """
+    Level 2 order book of a pair, kept up to date from snapshots and incremental updates.
+    """
+
+    def __init__(self, depth=_DEFAULT_DEPTH):
+        self.depth = depth
+        self.bids = dict()
+        self.asks = dict()
+        self.timestamp = None
+
+    def clear(self):
+        self.bids.clear()
+        self.asks.clear()
+
+    def apply(self, side, levels):
+        """
+        Updates levels of one side of the book, levels beyond depth being dropped.
+
+        :param side: 'bids' or 'asks'
+        :param levels: list of (price, volume, timestamp), a null volume removing the level
+        :return:
+        """
+        book = self.bids if side == 'bids' else self.asks
+        for level in levels:
+            price, volume, timestamp = float(level[0]), float(level[1]), float(level[2])
+            if volume == 0.:
+                book.pop(price, None)
+
+            else:
+                book[price] = volume
+
+            if self.timestamp is None or timestamp > self.timestamp:
+                self.timestamp = timestamp
+
+        if len(book) > self.depth:
+            for price in sorted(book, reverse=(side == 'bids'))[self.depth:]:
+                del book[price]
+
+    def is_ready(self):
+        return len(self.bids) > 0 and len(self.asks) > 0
+
+    def best_bid(self):
+        """
+        :return: (price, volume)
+        """
+        price = max(self.bids)
+        return price, self.bids[price]
+
+    def best_ask(self):
+        """
+        :return: (price, volume)
+        """
+        price = min(self.asks)
+        return price, self.asks[price]
+
+    def levels(self, side):
+        """
+        :param side: 'bids' or 'asks'
+        :return: list of (price, volume) from the best level
+        """
+        book = self.bids if side == 'bids' else self.asks
+        return sorted(book.items(), reverse=(side == 'bids'))
+
+
+class BookStream(object):
+    """
+    Order books maintained from Kraken WebSocket book messages. Each update rescans the arbitrage triangles that
+    include the updated pair only.
+    """
+
+    def __init__(self, triangles, depth=_DEFAULT_DEPTH, pair_codes=None):
+        """
+
+        :param triangles: triangles index as returned by arbitrage.find_triangles
+        :param depth: number of levels kept on each side of the books
+        :param pair_codes: dict mapping pair names of the feed to pair codes
+        """
+        self.books = dict()
+        self.evaluations = 0
+        self._depth = depth
+        self._triangles = list(triangles)
+        self._pair_codes = dict() if pair_codes is None else pair_codes
+        self._triangles_by_pair = defaultdict(list)
+        for position, triangle in enumerate(self._triangles):
+            for pair_code in set(triangle):
+                self._triangles_by_pair[pair_code].append(position)
+
+    def on_message(self, message):
+        """
+        Applies a book snapshot or update: [channel, {'as': levels, 'bs': levels}, channel name, pair] for snapshots
+        and [channel, {'a': levels}, {'b': levels}, channel name, pair] for updates, either side being optional.
+
+        :param message: decoded message, events and heartbeats being ignored
+        :return: (pair_code, opportunities) as returned by scan, None for messages other than books
+        """
+        if not isinstance(message, list) or len(message) < 4:
+            return None
+
+        pair_code = self._pair_codes.get(message[-1], message[-1])
+        if pair_code not in self.books:
+            self.books[pair_code] = OrderBook(self._depth)
+
+        book = self.books[pair_code]
+        for payload in message[1:-2]:
+            if 'as' in payload or 'bs' in payload:
+                book.clear()
+
+            for key, side in (('as', 'asks'), ('bs', 'bids'), ('a', 'asks'), ('b', 'bids')):
+                if key in payload:
+                    book.apply(side, payload[key])
+
+        return pair_code, self.scan(pair_code)
+
+    def scan(self, pair_code):
+        """
+        Evaluates the triangles including the pair from the top of the books.
+
+        :param pair_code:
+        :return: list of (triangle, ArbitrageOpportunity) with a positive balance
+        """
+        results = list()
+        for position in self._triangles_by_pair.get(pair_code, []):
+            triangle = self._triangles[position]
+            books = [self.books.get(triangle_pair) for triangle_pair in triangle]
+            if any(book is None or not book.is_ready() for book in books):
+                continue
+
+            self.evaluations += 1
+            opportunities = evaluate_arbitrage_opportunity(triangle, [book.best_bid() for book in books],
+                                                           [book.best_ask() for book in books])
+            sequences = set()
+            for opportunity in opportunities:
+                # permutations of a triangle come by pairs of identical execution sequences
+                sequence = tuple(trade[1] for trade in opportunity.trades if trade is not None)
+                if sequence in sequences:
+                    continue
+
+                sequences.add(sequence)
+                currency = opportunity.trades[0][1][:4]
+                if opportunity.balance(currency) > 0:
+                    results.append((triangle, opportunity))
+
+        return results
+
+
+def iter_recorded_messages(path):
+    """
+    Messages recorded as one JSON document per line.
+
+    :param path:
+    :return: generator of decoded messages
+    """
+    with open(path) as recorded:
+        for line in recorded:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_socket_messages(host, port):
+    """
+    Messages received as one JSON document per line from a feed server.
+
+    :param host:
+    :param port:
+    :return: generator of decoded messages
+    """
+    with socket.create_connection((host, port)) as connection:
+        with connection.makefile('r') as lines:
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def create_replay_server(messages, host='localhost', port=0, interval=0.):
+    """
+    Server sending the messages to each client, one JSON document per line.
+
+    :param messages: list of messages
+    :param host:
+    :param port: 0 for any free port
+    :param interval: seconds between two messages
+    :return: TCPServer, to be run with serve_forever
+    """
+
+    class ReplayHandler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            logging.info('replaying {} messages to {}'.format(len(messages), self.client_address))
+            for message in messages:
+                self.wfile.write((json.dumps(message) + '\n').encode())
+                if interval > 0.:
+                    time.sleep(interval)
+
+    class ReplayServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    return ReplayServer((host, port), ReplayHandler)
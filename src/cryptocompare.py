@@ -1,65 +1,251 @@
 import itertools
+import math
+from collections import defaultdict
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas
 import logging
 import requests
-import json
+import tenacity
+from requests.adapters import HTTPAdapter
 from datetime import datetime
 
 _BASE_CRYPTO_COMPARE_URL = 'https://min-api.cryptocompare.com/data'
+_DEFAULT_MAX_WORKERS = 8
+_DEFAULT_CALLS_PER_SECOND = 20
+_MAX_FSYMS_LENGTH = 300
+_MAX_TSYMS_LENGTH = 100
+_BACKFILL_CHUNK_POINTS = 2000
+_HISTO_ENDPOINTS = {
+    'minute': ('histominute', 60),
+    'hour': ('histohour', 3600),
+    'day': ('histoday', 86400),
+}
+
+_rate_limiters = dict()
+_rate_limiters_lock = threading.Lock()
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls so that no more than calls_per_second are started, whatever the number of calling threads.
+    """
+
+    def __init__(self, calls_per_second):
+        self._interval = 1. / calls_per_second
+        self._next_call = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            call_time = max(now, self._next_call)
+            self._next_call = call_time + self._interval
+
+        time.sleep(call_time - now)
+
+
+def _host_rate_limiter(url, calls_per_second=_DEFAULT_CALLS_PER_SECOND):
+    """
+    Rate limiter shared by all calls to the host of the given url.
+
+    :param url:
+    :param calls_per_second: used when the limiter is first created
+    :return: RateLimiter
+    """
+    host = urllib.parse.urlsplit(url).netloc
+    with _rate_limiters_lock:
+        if host not in _rate_limiters:
+            _rate_limiters[host] = RateLimiter(calls_per_second)
+
+        return _rate_limiters[host]
+
+
+def _create_session(max_workers):
+    """
+    Session whose connection pool is sized for the number of concurrent workers.
+
+    :param max_workers:
+    :return:
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+@tenacity.retry(wait=tenacity.wait_exponential(multiplier=0.5, max=8),
+                retry=tenacity.retry_if_exception_type(requests.RequestException),
+                stop=tenacity.stop_after_attempt(5),
+                reraise=True
+                )
+def _api_get(session, endpoint, payload):
+    """
+    Rate limited GET request to the CryptoCompare API, retried on connection and HTTP errors.
+
+    :param session:
+    :param endpoint: such as 'price' or 'histoday'
+    :param payload: request parameters
+    :return: decoded JSON response
+    """
+    url = '{}/{}'.format(_BASE_CRYPTO_COMPARE_URL, endpoint)
+    _host_rate_limiter(url).wait()
+    response = session.get(url, params=payload)
+    if response.status_code != requests.codes.ok:
+        logging.warning('failed requesting {}: status {}'.format(url, response.status_code))
+        response.raise_for_status()
+
+    return response.json()
+
+
+def _load_concurrently(load_pair, pairs, max_workers):
+    """
+    Applies load_pair to each pair using a pool of threads.
+
+    :param load_pair: function of (session, from_currency, to_currency)
+    :param pairs: list of (from_currency, to_currency)
+    :param max_workers:
+    :return: dict pair -> result of load_pair
+    """
+    pairs = list(pairs)
+    session = _create_session(max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda pair: load_pair(session, *pair), pairs)
+        return dict(zip(pairs, results))
 
 
-def load_crypto_compare_data(currencies, reference_currencies, exchange, time_scale):
+def load_crypto_compare_data(currencies, reference_currencies, exchange, time_scale,
+                             max_workers=_DEFAULT_MAX_WORKERS, store=None):
     """
 
     :param currencies: list of currency pairs to retrieve
     :param reference_currencies: for quoting each currency in terms of reference currencies
     :param exchange: exchange as referenced by CryptoCompare
     :param time_scale: one of ('day', 'hour', 'minute', 'spot')
+    :param max_workers: number of concurrent requests
+    :param store: optional PriceStore, historical prices are then only loaded past the last stored timestamp
     :return: DataFrame of historical prices
     """
     cross_product = itertools.product(set(reference_currencies).union(set(currencies)), reference_currencies)
     pairs = [pair for pair in cross_product if pair[0] != pair[1]]
+    since = None
+    if store is not None and time_scale != 'spot':
+        since = {pair: store.last_timestamp(pair, exchange, time_scale) for pair in pairs}
+
     if time_scale == 'spot':
-        prices = load_pairs_spot(pairs, exchange)
+        prices = load_pairs_spot(pairs, exchange, max_workers=max_workers)
 
     elif time_scale == 'minute':
-        prices = load_pairs_histo_minute(pairs, exchange)
+        prices = load_pairs_histo_minute(pairs, exchange, max_workers=max_workers, since=since)
 
     elif time_scale == 'hour':
-        prices = load_pairs_histo_hourly(pairs, exchange)
+        prices = load_pairs_histo_hourly(pairs, exchange, max_workers=max_workers, since=since)
 
     elif time_scale == 'day':
-        prices = load_pairs_histo_daily(pairs, exchange)
+        prices = load_pairs_histo_daily(pairs, exchange, max_workers=max_workers, since=since)
 
     else:
         raise NotImplementedError('unavailable time scale: "{}"'.format(time_scale))
 
+    if since is not None:
+        store.append(prices, exchange, time_scale)
+        prices = store.load(pairs, exchange, time_scale)
+
     return prices.pivot_table(index='date', columns='currency', values='price').reset_index()
 
 
-def load_pairs_spot(pairs, exchange):
+def _chunk_symbols(symbols, max_length):
+    """
+    Splits symbols into lists whose comma-separated representation does not exceed max_length characters.
+
+    :param symbols:
+    :param max_length:
+    :return: list of tuples of symbols
+    """
+    chunks = list()
+    chunk = list()
+    chunk_length = 0
+    for symbol in symbols:
+        if chunk and chunk_length + 1 + len(symbol) > max_length:
+            chunks.append(tuple(chunk))
+            chunk = list()
+
+        chunk_length = len(symbol) if not chunk else chunk_length + 1 + len(symbol)
+        chunk.append(symbol)
+
+    if chunk:
+        chunks.append(tuple(chunk))
+
+    return chunks
+
+
+def _group_spot_pairs(pairs):
     """
+    Groups pairs into multi-symbol requests: source currencies quoted against the same target currencies share
+    their requests.
+
+    :param pairs: list of (from_currency, to_currency)
+    :return: list of (from_currencies, to_currencies)
+    """
+    targets_by_source = defaultdict(set)
+    for from_currency, to_currency in pairs:
+        targets_by_source[from_currency].add(to_currency)
+
+    sources_by_targets = defaultdict(list)
+    for from_currency, to_currencies in targets_by_source.items():
+        sources_by_targets[tuple(sorted(to_currencies))].append(from_currency)
+
+    groups = list()
+    for to_currencies, from_currencies in sorted(sources_by_targets.items()):
+        for from_chunk in _chunk_symbols(sorted(from_currencies), _MAX_FSYMS_LENGTH):
+            for to_chunk in _chunk_symbols(to_currencies, _MAX_TSYMS_LENGTH):
+                groups.append((from_chunk, to_chunk))
+
+    return groups
+
+
+def load_pairs_spot(pairs, exchange, max_workers=_DEFAULT_MAX_WORKERS):
+    """
+    Spot prices, requested in batches of source and target currencies.
 
     :param pairs:
     :param exchange: exchange as referenced by CryptoCompare
+    :param max_workers: number of concurrent requests
     :return:
     """
     logging.debug('loading spot data for pairs: {}'.format(str(pairs)))
-    session = requests.Session()
-    spot_prices = dict()
-    for from_currency, to_currency in pairs:
-        payload = {'fsym': from_currency,
-                   'tsyms': to_currency,
+
+    def load_group(session, from_currencies, to_currencies):
+        payload = {'fsyms': ','.join(from_currencies),
+                   'tsyms': ','.join(to_currencies),
                    'e': exchange
                    }
-        results = session.get('{}/price'.format(_BASE_CRYPTO_COMPARE_URL), params=payload)
-        json_result = results.json()
+        json_result = _api_get(session, 'pricemulti', payload)
         if 'Message' in json_result:
             json_message = json_result['Message']
             message = 'Error occurred while loading prices from exchange {}: {} ({}/{})'
-            raise Exception(message.format(exchange, json_message, from_currency, to_currency))
+            raise Exception(message.format(exchange, json_message, payload['fsyms'], payload['tsyms']))
+
+        return json_result
+
+    groups = _load_concurrently(load_group, _group_spot_pairs(pairs), max_workers)
+    quotes = dict()
+    for group_quotes in groups.values():
+        for from_currency, to_quotes in group_quotes.items():
+            for to_currency, price in to_quotes.items():
+                quotes[(from_currency, to_currency)] = price
+
+    spot_prices = dict()
+    for from_currency, to_currency in pairs:
+        if (from_currency, to_currency) not in quotes:
+            message = 'Error occurred while loading prices from exchange {}: missing quote ({}/{})'
+            raise Exception(message.format(exchange, from_currency, to_currency))
 
-        spot_prices[(from_currency, to_currency)] = json_result[to_currency]
+        spot_prices[(from_currency, to_currency)] = quotes[(from_currency, to_currency)]
 
     now = datetime.now()
     timestamps = list()
@@ -74,115 +260,158 @@ def load_pairs_spot(pairs, exchange):
     return spot_df
 
 
-def load_pairs_histo_minute(pairs, exchange):
+def _tail_limit(last_timestamp, interval, limit):
     """
+    Number of data points needed for covering the time elapsed since last_timestamp, last point included.
 
-    :param pairs:
-    :param exchange: exchange as referenced by CryptoCompare
+    :param last_timestamp: datetime of the last known data point
+    :param interval: seconds between data points
+    :param limit: maximum number of data points
     :return:
     """
-    logging.debug('loading minute data for pairs: {}'.format(str(pairs)))
-    session = requests.Session()
-    output = dict()
-    for from_currency, to_currency in pairs:
-        payload = {'fsym': from_currency,
-                   'tsym': to_currency,
-                   'e': exchange,
-                   'limit': 1000
-                   }
-        results = session.get('{}/histominute'.format(_BASE_CRYPTO_COMPARE_URL), params=payload)
-        output[(from_currency, to_currency)] = json.loads(results.text)['Data']
+    elapsed = time.time() - last_timestamp.timestamp()
+    return int(min(limit, max(1, math.ceil(elapsed / interval))))
 
-    output = {
-        key: [
-            {'time': datetime.fromtimestamp(price_data['time']), 'close': price_data['close']}
-            for price_data in values] for key, values in output.items()
-    }
 
-    data = list()
-    for source, target in output:
-        for hist_data in output[(source, target)]:
-            entry = dict()
-            entry['currency'] = '{}/{}'.format(source, target)
-            entry['date'] = hist_data['time']
-            entry['price'] = hist_data['close']
-            data.append(entry)
+def _histo_frame(output):
+    """
+    Long-format prices from histo results.
+
+    :param output: dict (from_currency, to_currency) -> list of histo data points
+    :return: DataFrame ('currency', 'date', 'price')
+    """
+    currencies = list()
+    dates = list()
+    prices = list()
+    for (source, target), values in output.items():
+        currency = '{}/{}'.format(source, target)
+        for price_data in values:
+            currencies.append(currency)
+            dates.append(datetime.fromtimestamp(price_data['time']))
+            prices.append(price_data['close'])
 
-    minute_df = pandas.DataFrame(data)
-    return minute_df
+    return pandas.DataFrame({'currency': currencies, 'date': dates, 'price': prices},
+                            columns=['currency', 'date', 'price'])
 
 
-def load_pairs_histo_hourly(pairs, exchange):
+def _load_pairs_histo(pairs, exchange, endpoint, limit, interval, max_workers, since=None):
     """
 
     :param pairs:
     :param exchange: exchange as referenced by CryptoCompare
-    :return:
+    :param endpoint: one of ('histominute', 'histohour', 'histoday')
+    :param limit: number of data points
+    :param interval: seconds between data points
+    :param max_workers: number of concurrent requests
+    :param since: dict pair -> datetime of the last known data point, only the tail is loaded for those pairs
+    :return: DataFrame ('currency', 'date', 'price')
     """
-    logging.debug('loading hourly data for pairs: {}'.format(str(pairs)))
-    session = requests.Session()
-    output = dict()
-    for from_currency, to_currency in pairs:
+    if since is None:
+        since = dict()
+
+    def load_pair(session, from_currency, to_currency):
+        pair_limit = limit
+        if since.get((from_currency, to_currency)) is not None:
+            pair_limit = _tail_limit(since[(from_currency, to_currency)], interval, limit)
+
         payload = {'fsym': from_currency,
                    'tsym': to_currency,
                    'e': exchange,
-                   'limit': 1000
+                   'limit': pair_limit
                    }
-        results = session.get('{}/histohour'.format(_BASE_CRYPTO_COMPARE_URL), params=payload)
-        output[(from_currency, to_currency)] = json.loads(results.text)['Data']
+        return _api_get(session, endpoint, payload)['Data']
 
-    output = {
-        key: [
-            {'time': datetime.fromtimestamp(price_data['time']), 'close': price_data['close']}
-            for price_data in values] for key, values in output.items()
-    }
+    output = _load_concurrently(load_pair, pairs, max_workers)
+    return _histo_frame(output)
 
-    data = list()
-    for source, target in output:
-        for hist_data in output[(source, target)]:
-            entry = dict()
-            entry['currency'] = '{}/{}'.format(source, target)
-            entry['date'] = hist_data['time']
-            entry['price'] = hist_data['close']
-            data.append(entry)
 
-    hourly_df = pandas.DataFrame(data)
-    return hourly_df
+def load_pairs_histo_minute(pairs, exchange, max_workers=_DEFAULT_MAX_WORKERS, since=None):
+    """
 
+    :param pairs:
+    :param exchange: exchange as referenced by CryptoCompare
+    :param max_workers: number of concurrent requests
+    :param since: dict pair -> datetime of the last known data point, only the tail is loaded for those pairs
+    :return:
+    """
+    logging.debug('loading minute data for pairs: {}'.format(str(pairs)))
+    return _load_pairs_histo(pairs, exchange, 'histominute', 1000, 60, max_workers, since=since)
 
-def load_pairs_histo_daily(pairs, exchange):
+
+def load_pairs_histo_hourly(pairs, exchange, max_workers=_DEFAULT_MAX_WORKERS, since=None):
+    """
+
+    :param pairs:
+    :param exchange: exchange as referenced by CryptoCompare
+    :param max_workers: number of concurrent requests
+    :param since: dict pair -> datetime of the last known data point, only the tail is loaded for those pairs
+    :return:
+    """
+    logging.debug('loading hourly data for pairs: {}'.format(str(pairs)))
+    return _load_pairs_histo(pairs, exchange, 'histohour', 1000, 3600, max_workers, since=since)
+
+
+def load_pairs_histo_daily(pairs, exchange, max_workers=_DEFAULT_MAX_WORKERS, since=None):
     """
 
     :param pairs:
     :param exchange: exchange as referenced by CryptoCompare
+    :param max_workers: number of concurrent requests
+    :param since: dict pair -> datetime of the last known data point, only the tail is loaded for those pairs
     :return:
     """
     logging.debug('loading daily data for pairs: {}'.format(str(pairs)))
-    session = requests.Session()
-    output = dict()
-    for from_currency, to_currency in pairs:
-        payload = {'fsym': from_currency,
-                   'tsym': to_currency,
+    return _load_pairs_histo(pairs, exchange, 'histoday', 400, 86400, max_workers, since=since)
+
+
+def backfill_pairs_histo(pairs, exchange, time_scale, start_date, store, max_workers=_DEFAULT_MAX_WORKERS,
+                         chunk_points=_BACKFILL_CHUNK_POINTS):
+    """
+    Loads history back to start_date into the store.
+
+    History is split into chunks of chunk_points data points aligned on a fixed time grid, each chunk being one
+    request using the toTs parameter. Chunks are requested concurrently and completed ones are kept in the store, so
+    that an interrupted backfill resumes without requesting them again.
+
+    :param pairs: list of (from_currency, to_currency)
+    :param exchange: exchange as referenced by CryptoCompare
+    :param time_scale: one of ('day', 'hour', 'minute')
+    :param start_date: datetime
+    :param store: PriceStore
+    :param max_workers: number of concurrent requests
+    :param chunk_points: number of data points by request, at most 2000
+    :return: number of chunks requested
+    """
+    if time_scale not in _HISTO_ENDPOINTS:
+        raise NotImplementedError('unavailable time scale: "{}"'.format(time_scale))
+
+    endpoint, interval = _HISTO_ENDPOINTS[time_scale]
+    span = chunk_points * interval
+    now = time.time()
+    first_chunk_start = int(start_date.timestamp()) // span * span
+    chunks = [(pair, chunk_start) for pair in pairs for chunk_start in range(first_chunk_start, int(now), span)
+              if not store.has_chunk(pair, exchange, time_scale, chunk_start)]
+    logging.info('backfilling {} chunks of {} data for {} pairs'.format(len(chunks), time_scale, len(pairs)))
+
+    def load_chunk(session, pair, chunk_start):
+        payload = {'fsym': pair[0],
+                   'tsym': pair[1],
                    'e': exchange,
-                   'limit': 400
+                   'limit': chunk_points - 1,
+                   'toTs': chunk_start + span - interval
                    }
-        results = session.get('{}/histoday'.format(_BASE_CRYPTO_COMPARE_URL), params=payload)
-        output[(from_currency, to_currency)] = json.loads(results.text)['Data']
-
-    output = {
-        key: [
-            {'time': datetime.fromtimestamp(price_data['time']), 'close': price_data['close']}
-            for price_data in values] for key, values in output.items()
-    }
-
-    data = list()
-    for source, target in output:
-        for hist_data in output[(source, target)]:
-            entry = dict()
-            entry['currency'] = '{}/{}'.format(source, target)
-            entry['date'] = hist_data['time']
-            entry['price'] = hist_data['close']
-            data.append(entry)
-
-    daily_df = pandas.DataFrame(data)
-    return daily_df
+        prices = _histo_frame({pair: _api_get(session, endpoint, payload)['Data']})
+        if chunk_start + span <= now:
+            store.save_chunk(pair, exchange, time_scale, chunk_start, prices[['date', 'price']])
+
+        return prices
+
+    loaded = _load_concurrently(load_chunk, chunks, max_workers)
+
+    # merging all completed chunks, including those from interrupted runs, and the current partial one
+    pair_prices = [store.load_chunks(pair, exchange, time_scale).assign(currency='/'.join(pair)) for pair in pairs]
+    pair_prices = [prices for prices in pair_prices + list(loaded.values()) if not prices.empty]
+    if len(pair_prices) > 0:
+        store.append(pandas.concat(pair_prices, ignore_index=True), exchange, time_scale)
+
+    return len(chunks)
@@ -0,0 +1,159 @@
+import json
+import os
+import shutil
+from decimal import Decimal
+
+import numpy
+import pandas
+
+_SCHEMA_FILE = 'schema.json'
+_DATE_COLUMN = 'date'
+_KIND_DATETIME = 'datetime'
+_KIND_DECIMAL = 'decimal'
+_KIND_NUMERIC = 'numeric'
+_KIND_TEXT = 'text'
+
+
+def _is_number(value):
+    return isinstance(value, (Decimal, int, float, numpy.number)) and not isinstance(value, (bool, numpy.bool_))
+
+
+def _column_values(series, decimal=False):
+    """
+    Typed array for a column.
+
+    :param series:
+    :param decimal: True for storing values as decimals, such as numbers held as text by exchange APIs
+    :return: (numpy array, kind of column, null mask for text columns or None)
+    """
+    if numpy.issubdtype(series.dtype, numpy.datetime64):
+        return series.values.astype('datetime64[ns]'), _KIND_DATETIME, None
+
+    if series.dtype != object:
+        return series.values, _KIND_NUMERIC, None
+
+    nulls = series.isnull().values
+    if decimal or (not nulls.all() and series[~nulls].map(_is_number).all()):
+        # Decimal amounts are stored as double precision floats
+        values = series.map(lambda value: numpy.nan if pandas.isnull(value) else float(value))
+        return values.values.astype(float), _KIND_DECIMAL, None
+
+    values = numpy.array(['' if null else str(value) for value, null in zip(series, nulls)], dtype=str)
+    return values, _KIND_TEXT, nulls if nulls.any() else None
+
+
+def save_dataset(data, path, decimal_columns=None):
+    """
+    Saves a DataFrame as a dataset, replacing any dataset at the same location.
+
+    A dataset is a directory holding one NumPy .npy file per column and a JSON schema. Rows are sorted by date, so
+    that load_dataset finds a date range by binary search on the memory-mapped date column.
+
+    :param data: DataFrame, sorted by its 'date' column if any
+    :param path: dataset directory
+    :param decimal_columns: columns stored as decimals even when holding numbers as text, object columns being
+     otherwise stored as decimals only when holding numbers
+    :return:
+    """
+    if _DATE_COLUMN in data.columns:
+        data = data.sort_values(_DATE_COLUMN, kind='mergesort')
+
+    temp_path = path + '.tmp'
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    schema = {'rows': len(data), 'columns': list()}
+    for position, column in enumerate(data.columns):
+        values, kind, nulls = _column_values(data[column], decimal=column in (decimal_columns or list()))
+        file_name = '{}.npy'.format(position)
+        numpy.save(os.sep.join([temp_path, file_name]), values, allow_pickle=False)
+        column_info = {'name': column, 'kind': kind, 'file': file_name}
+        if nulls is not None:
+            column_info['nulls'] = '{}-nulls.npy'.format(position)
+            numpy.save(os.sep.join([temp_path, column_info['nulls']]), nulls, allow_pickle=False)
+
+        schema['columns'].append(column_info)
+
+    with open(os.sep.join([temp_path, _SCHEMA_FILE]), 'w') as schema_file:
+        json.dump(schema, schema_file, indent=2)
+
+    old_path = path + '.old'
+    if os.path.isdir(path):
+        shutil.rmtree(old_path, ignore_errors=True)
+        os.replace(path, old_path)
+
+    os.replace(temp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def dataset_exists(path):
+    """
+
+    :param path: dataset directory
+    :return: True if a dataset has been saved at this location
+    """
+    return os.path.isfile(os.sep.join([path, _SCHEMA_FILE]))
+
+
+def dataset_columns(path):
+    """
+
+    :param path: dataset directory
+    :return: list of column names
+    """
+    with open(os.sep.join([path, _SCHEMA_FILE]), 'r') as schema_file:
+        schema = json.load(schema_file)
+
+    return [column_info['name'] for column_info in schema['columns']]
+
+
+def load_dataset(path, columns=None, start=None, end=None):
+    """
+    Loads a dataset, reading only the requested columns and date range.
+
+    :param path: dataset directory
+    :param columns: list of columns to load, all columns by default
+    :param start: rows are loaded from the last one dated at or before start, so that values can be carried forward
+    :param end: rows dated after end are skipped
+    :return: DataFrame, decimal columns being loaded as floats
+    """
+    with open(os.sep.join([path, _SCHEMA_FILE]), 'r') as schema_file:
+        schema = json.load(schema_file)
+
+    columns_info = {column_info['name']: column_info for column_info in schema['columns']}
+    if columns is None:
+        columns = [column_info['name'] for column_info in schema['columns']]
+
+    missing_columns = set(columns).difference(columns_info)
+    if missing_columns:
+        raise KeyError('columns not found in dataset {}: {}'.format(path, sorted(missing_columns)))
+
+    def column_array(column):
+        return numpy.load(os.sep.join([path, columns_info[column]['file']]), mmap_mode='r')
+
+    first_row = 0
+    last_row = schema['rows']
+    if start is not None or end is not None:
+        if _DATE_COLUMN not in columns_info:
+            raise KeyError('no "{}" column for selecting dates in dataset {}'.format(_DATE_COLUMN, path))
+
+        dates = column_array(_DATE_COLUMN)
+        if start is not None:
+            start_row = numpy.searchsorted(dates, pandas.Timestamp(start).to_datetime64(), side='right') - 1
+            first_row = max(start_row, 0)
+
+        if end is not None:
+            last_row = numpy.searchsorted(dates, pandas.Timestamp(end).to_datetime64(), side='right')
+
+    data = dict()
+    for column in columns:
+        values = column_array(column)[first_row:last_row]
+        if columns_info[column]['kind'] == _KIND_TEXT:
+            data[column] = values.astype(object)
+            if 'nulls' in columns_info[column]:
+                nulls = numpy.load(os.sep.join([path, columns_info[column]['nulls']]), mmap_mode='r')
+                data[column][nulls[first_row:last_row]] = None
+
+        else:
+            data[column] = numpy.array(values)
+
+    return pandas.DataFrame(data, columns=columns)
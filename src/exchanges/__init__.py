@@ -0,0 +1,69 @@
+import importlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas
+
+_LEDGER_FIELDS = ['date', 'asset', 'amount', 'fee', 'exchange']
+
+_ADAPTERS = {
+    'bittrex': 'exchanges.bittrex',
+    'kraken': 'exchanges.kraken',
+}
+
+
+def register_exchange(name, module_name):
+    """
+    Registers an exchange adapter: a module providing retrieve_data(api_key, secret_key, store=None) returning
+    (flows, trades, currencies), flows and trades being DataFrame ('date', 'asset', 'amount', 'fee', 'exchange').
+
+    :param name: exchange name, as used in the config file
+    :param module_name: full name of the adapter module
+    :return:
+    """
+    _ADAPTERS[name] = module_name
+
+
+def registered_exchanges():
+    return sorted(_ADAPTERS)
+
+
+def get_exchange(name):
+    """
+
+    :param name: exchange name, as used in the config file
+    :return: adapter module
+    """
+    if name not in _ADAPTERS:
+        raise ValueError('unknown exchange "{}", expected one of {}'.format(name, registered_exchanges()))
+
+    return importlib.import_module(_ADAPTERS[name])
+
+
+def retrieve_ledgers(exchanges_config, store=None, max_workers=None):
+    """
+    Retrieves flows and trades of all configured exchanges in parallel.
+
+    :param exchanges_config: dict mapping exchange names to their 'key' and 'secret', as the "exchanges" section of
+     the config file
+    :param store: optional LedgerStore shared by all exchanges
+    :param max_workers: number of exchanges loaded at once, all of them by default
+    :return: (flows: DataFrame ('date', 'asset', 'amount', 'fee', 'exchange'), trades: DataFrame ('date', 'asset',
+    'amount', 'fee', 'exchange'), currencies: set of currency codes)
+    """
+    names = sorted(exchanges_config)
+    adapters = [get_exchange(name) for name in names]
+    if len(adapters) == 0:
+        return pandas.DataFrame(columns=_LEDGER_FIELDS), pandas.DataFrame(columns=_LEDGER_FIELDS), set()
+
+    def retrieve(name, adapter):
+        logging.info('retrieving ledger from {}'.format(name))
+        return adapter.retrieve_data(exchanges_config[name]['key'], exchanges_config[name]['secret'], store=store)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(adapters)) as executor:
+        results = list(executor.map(retrieve, names, adapters))
+
+    flows = pandas.concat([exchange_flows[_LEDGER_FIELDS] for exchange_flows, _, _ in results], ignore_index=True)
+    trades = pandas.concat([exchange_trades[_LEDGER_FIELDS] for _, exchange_trades, _ in results], ignore_index=True)
+    currencies = set().union(*[exchange_currencies for _, _, exchange_currencies in results])
+    return flows, trades, currencies
@@ -2,10 +2,14 @@ import hmac
 import time
 import hashlib
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from decimal import Decimal
 from requests import Request
+from requests.adapters import HTTPAdapter
+import numpy
 import pandas
 from datetime import datetime
 
@@ -17,115 +21,157 @@ _REQUEST_ORDER_HISTORY = '/account/getorderhistory'
 _REQUEST_WITHDRAWAL_HISTORY = '/account/getwithdrawalhistory'
 _REQUEST_DEPOSIT_HISTORY = '/account/getdeposithistory'
 
-_requests_session = None
-_api_key = None
-_secret_key = None
+_LEDGER_FIELDS = ['date', 'asset', 'amount', 'fee', 'exchange']
+_HISTORIES_COUNT = 3
 
+_client = None
 
-def retrieve_data(api_key, secret_key):
+
+def retrieve_data(api_key, secret_key, store=None):
     """
 
     :param api_key:
     :param secret_key:
+    :param store: optional LedgerStore, only entries past its high-water mark are then parsed and stored
     :return: (flows: DataFrame ('date', 'asset', 'amount', 'fee', 'exchange'), trades: DataFrame ('date', 'asset',
     'amount', 'fee', 'exchange'), currencies: set of currency codes)
     """
-    connect(api_key, secret_key)
-    deposits = get_deposit_history()
-    withdrawals = get_withdrawal_history()
-    order_history = get_order_history()
-
-    orders_parsed = parse_trades(order_history)
-    orders_currencies = set()
-    if not orders_parsed.empty:
-        orders_currencies = set(orders_parsed['asset'].tolist())
-
-    flows_parsed = parse_flows(withdrawals, deposits)
-    flows_currencies = set()
-    if not flows_parsed.empty:
-        flows_currencies = set(flows_parsed['asset'].tolist())
+    client = BittrexClient(api_key, secret_key)
+    withdrawals, deposits, order_history = get_histories(client=client)
+    if store is not None:
+        ledger = sync_ledger(store, withdrawals, deposits, order_history)
+        flows = ledger[ledger['type'] != 'trade'][_LEDGER_FIELDS]
+        trades = ledger[ledger['type'] == 'trade'][_LEDGER_FIELDS]
+        return flows, trades, set(ledger['asset'].tolist())
 
-    currencies = flows_currencies.union(orders_currencies)
     flows = parse_flows(withdrawals, deposits)
     trades = parse_trades(order_history)
-
+    currencies = set(flows['asset'].tolist()).union(trades['asset'].tolist())
     return flows, trades, currencies
 
 
+class BittrexClient(object):
+    """
+    Thread-safe API client sharing one pooled session and generating strictly increasing nonces.
+    """
+
+    def __init__(self, api_key, secret_key, max_workers=_HISTORIES_COUNT):
+        self._api_key = api_key
+        self._secret_key = secret_key
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self._session.mount('https://', adapter)
+        self._nonce_lock = threading.Lock()
+        self._last_nonce = 0
+
+    def nonce(self):
+        """
+        Milliseconds timestamp, incremented when needed so that no two calls share a nonce.
+
+        :return:
+        """
+        with self._nonce_lock:
+            self._last_nonce = max(self._last_nonce + 1, int(time.time() * 1000))
+            return self._last_nonce
+
+    def api_call(self, method, options=None):
+        """
+
+        :param method:
+        :param options:
+        :return: result of the call, decoded with Decimal numbers
+        """
+        if not options:
+            options = {}
+
+        params = {'apikey': self._api_key, 'nonce': str(self.nonce())}
+        params.update(options)
+        request = Request('GET', _BASE_URL + method, params=params)
+        prepared_request = request.prepare()
+        signature = hmac.new(self._secret_key.encode(), prepared_request.url.encode(), digestmod=hashlib.sha512)
+        prepared_request.headers.update({'apisign': signature.hexdigest()})
+        logging.info('headers: {}'.format(prepared_request.headers))
+        response = self._session.send(prepared_request)
+        json_data = response.json(parse_float=Decimal)
+        if not json_data['success']:
+            logging.error('{}'.format(json_data))
+            raise Exception('failed to retrieve data: {}'.format(json_data['message']))
+
+        return json_data['result']
+
+
 def connect(api_key, secret_key):
     """
+    Sets up the client used by the module functions when no client is given.
 
     :param api_key:
     :param secret_key:
-    :return:
+    :return: BittrexClient
     """
-    global _requests_session
-    global _api_key
-    global _secret_key
-    _api_key = api_key
-    _secret_key = secret_key
-    _requests_session = requests.session()
+    global _client
+    _client = BittrexClient(api_key, secret_key)
+    return _client
 
 
-def _api_call(method, options=None):
+def _api_call(method, options=None, client=None):
     """
 
     :param method:
     :param options:
+    :param client: BittrexClient, defaults to the connected one
     :return:
     """
-    if _requests_session is None:
+    if client is None:
+        client = _client
+
+    if client is None:
         raise Exception('not initialized: call connect(api_key, secret_key) first')
 
-    if not options:
-        options = {}
+    return client.api_call(method, options)
 
-    nonce = str(int(time.time() * 1000))
-    params = {'apikey': _api_key, 'nonce': nonce}
-    params.update(options)
-    request = Request('GET', _BASE_URL + method, params=params)
-    prepared_request = request.prepare()
-    signature = hmac.new(_secret_key.encode(), prepared_request.url.encode(), digestmod=hashlib.sha512)
-    prepared_request.headers.update({'apisign': signature.hexdigest()})
-    logging.info('headers: {}'.format(prepared_request.headers))
-    response = _requests_session.send(prepared_request)
-    if not response.json()['success']:
-        logging.error('{}'.format(response.json()))
-        raise Exception('failed to retrieve data: {}'.format(response.json()['message']))
 
-    return response.json(parse_float=Decimal)['result']
+def get_balances(client=None):
+    """
+
+    :return:
+    """
+    return _api_call(_REQUEST_ACCOUNT_BALANCES, client=client)
 
 
-def get_balances():
+def get_order_history(client=None):
     """
 
     :return:
     """
-    return _api_call(_REQUEST_ACCOUNT_BALANCES)
+    return _api_call(_REQUEST_ORDER_HISTORY, client=client)
 
 
-def get_order_history():
+def get_deposit_history(client=None):
     """
 
     :return:
     """
-    return _api_call(_REQUEST_ORDER_HISTORY)
+    return _api_call(_REQUEST_DEPOSIT_HISTORY, client=client)
 
 
-def get_deposit_history():
+def get_withdrawal_history(client=None):
     """
 
     :return:
     """
-    return _api_call(_REQUEST_DEPOSIT_HISTORY)
+    return _api_call(_REQUEST_WITHDRAWAL_HISTORY, client=client)
 
 
-def get_withdrawal_history():
+def get_histories(client=None):
     """
+    Withdrawal, deposit and order histories, requested concurrently.
 
-    :return:
+    :param client: BittrexClient, defaults to the connected one
+    :return: (withdrawals, deposits, order_history)
     """
-    return _api_call(_REQUEST_WITHDRAWAL_HISTORY)
+    requests_histories = [get_withdrawal_history, get_deposit_history, get_order_history]
+    with ThreadPoolExecutor(max_workers=_HISTORIES_COUNT) as executor:
+        return tuple(executor.map(lambda get_history: get_history(client=client), requests_histories))
 
 
 def parse_flows(withdrawals, deposits):
@@ -155,6 +201,9 @@ def parse_flows(withdrawals, deposits):
         movements.append(item)
 
     flows = pandas.DataFrame(movements)
+    if flows.empty:
+        return pandas.DataFrame(columns=['date', 'asset', 'amount', 'fee', 'exchange'])
+
     flows['fee'] = 0
     return flows[['date', 'asset', 'amount', 'fee', 'exchange']]
 
@@ -174,69 +223,95 @@ def to_decimal(value):
 
 def parse_trades(order_history):
     """
+    Each order gives two legs, selling the first currency of the market and buying the second one (reversed for
+    sell orders), all fees being charged on the first leg.
+
+    Example:
+    {
+    'OrderUuid': '17fd64d1-f4bd-4fb6-adb9-42ec68b8697d',
+    'Exchange': 'BTC-XRP',
+    'TimeStamp': '2017-07-08T20:38:58.317',
+    'OrderType': 'LIMIT_BUY',
+    'Quantity': Decimal('667.03644955'),
+    'QuantityRemaining': Decimal('0E-8'),
+    'Commission': Decimal('0.00004921'),
+    'Price': Decimal('0.01968424'),
+    ...
+    }
+
+    --->  1. SELL 0.01968424 BTC
+          2. BUY 667.03644955 XRP
 
     :param order_history:
     :return: DataFrame ('date', 'asset', 'amount', 'fee', 'exchange')
     """
-    parsed = list()
-    logging.debug('processing orders:\n{}'.format(order_history))
-    for order in order_history:
-
-        traded_qty = (to_decimal(order['Quantity']) - to_decimal(order['QuantityRemaining']))
-
-        # Example:
-        # {
-        # 'OrderUuid': '17fd64d1-f4bd-4fb6-adb9-42ec68b8697d',
-        # 'Exchange': 'BTC-XRP',
-        # 'TimeStamp': '2017-07-08T20:38:58.317',
-        # 'OrderType': 'LIMIT_BUY',
-        # 'Limit': Decimal('0.00002950'),
-        # 'Quantity': Decimal('667.03644955'),
-        # 'QuantityRemaining': Decimal('0E-8'),
-        # 'Commission': Decimal('0.00004921'),
-        # 'Price': Decimal('0.01968424'),
-        # 'PricePerUnit': Decimal('0.00002950'),
-        # 'IsConditional': False,
-        # 'Condition': None,
-        # 'ConditionTarget': None,
-        # 'ImmediateOrCancel': False
-        # }
-        #
-        # --->  1. SELL 0.01968424 BTC
-        #       2. BUY 667.03644955 XRP
-
-        pair = order['Exchange'].split('-')
-
-        first_leg_asset = pair[0]
-        first_leg_qty = order['Price'] * -1
-
-        second_leg_asset = pair[1]
-        second_leg_qty = traded_qty
-
-        sign = 1
-        if 'SELL' in order['OrderType']:
-            sign = -1
-
-        item_first = {
-            'date': datetime.strptime(order['TimeStamp'], '%Y-%m-%dT%H:%M:%S.%f'),
-            'asset': first_leg_asset,
-            'amount': first_leg_qty * sign,
-            'fee': to_decimal(order['Commission']),  # all fees for first leg
-            'exchange': 'bittrex'
-        }
-        item_second = {
-            'date': datetime.strptime(order['TimeStamp'], '%Y-%m-%dT%H:%M:%S.%f'),
-            'asset': second_leg_asset,
-            'amount': second_leg_qty * sign,
-            'fee': 0.,  # all fees for first leg
-            'exchange': 'bittrex'
-        }
+    logging.debug('processing {} orders'.format(len(order_history)))
+    if len(order_history) == 0:
+        return pandas.DataFrame(columns=['date', 'asset', 'amount', 'fee', 'exchange'])
 
-        parsed.append(item_first)
-        parsed.append(item_second)
+    orders = pandas.DataFrame.from_records(order_history, columns=['Exchange', 'TimeStamp', 'OrderType', 'Quantity',
+                                                                   'QuantityRemaining', 'Commission', 'Price'])
+    dates = pandas.to_datetime(orders['TimeStamp'], format='%Y-%m-%dT%H:%M:%S.%f').values
 
-    result = pandas.DataFrame(parsed)
-    if result.empty:
-        return pandas.DataFrame(columns=['date', 'asset', 'amount', 'fee', 'exchange'])
+    # markets and order types take few distinct values, parsed once each
+    market_names, market_positions = numpy.unique(orders['Exchange'].values, return_inverse=True)
+    markets = numpy.array([market.split('-')[:2] for market in market_names], dtype=object)[market_positions]
+    order_types, order_type_positions = numpy.unique(orders['OrderType'].values, return_inverse=True)
+    signs = numpy.array([-1 if 'SELL' in order_type else 1 for order_type in order_types],
+                        dtype=object)[order_type_positions]
+
+    decimals = numpy.frompyfunc(to_decimal, 1, 1)
+    prices = orders['Price'].values.astype(object)
+    traded = decimals(orders['Quantity'].values) - decimals(orders['QuantityRemaining'].values)
+
+    # one row per order and one column per leg, flattened order by order
+    amounts = numpy.column_stack([prices * -1 * signs, traded * signs])
+    fees = numpy.column_stack([decimals(orders['Commission'].values), numpy.full(len(orders), 0., dtype=object)])
+    return pandas.DataFrame({'date': numpy.repeat(dates, 2), 'asset': markets.ravel(), 'amount': amounts.ravel(),
+                             'fee': fees.ravel(), 'exchange': 'bittrex'},
+                            columns=['date', 'asset', 'amount', 'fee', 'exchange'])
+
+
+def parse_ledger(withdrawals, deposits, order_history):
+    """
+    Flows and trades as a single ledger, entries being identified by their Bittrex ids.
+
+    :param withdrawals:
+    :param deposits:
+    :param order_history:
+    :return: DataFrame ('entry_id', 'date', 'asset', 'amount', 'fee', 'exchange', 'type')
+    """
+    flows = parse_flows(withdrawals, deposits)
+    withdrawal_ids = ['withdrawal-{}'.format(withdrawal.get('PaymentUuid', withdrawal.get('Id')))
+                      for withdrawal in withdrawals]
+    deposit_ids = ['deposit-{}'.format(deposit['Id']) for deposit in deposits]
+    flows.insert(0, 'entry_id', withdrawal_ids + deposit_ids)
+    flows['type'] = ['withdrawal'] * len(withdrawals) + ['deposit'] * len(deposits)
+
+    trades = parse_trades(order_history)
+    # one entry for each leg of an order
+    trades.insert(0, 'entry_id', [order['OrderUuid'] for order in order_history for leg in range(2)])
+    trades['type'] = 'trade'
+    return pandas.concat([flows, trades], ignore_index=True)
+
+
+def sync_ledger(store, withdrawals, deposits, order_history):
+    """
+    Merges entries past the high-water mark of the store into it.
 
-    return result[['date', 'asset', 'amount', 'fee', 'exchange']]
+    The Bittrex history calls have no starting date, so the full histories are downloaded and filtered here.
+
+    :param store: LedgerStore
+    :param withdrawals:
+    :param deposits:
+    :param order_history:
+    :return: DataFrame ('entry_id', 'date', 'asset', 'amount', 'fee', 'exchange', 'type') of all stored entries
+    """
+    ledger = parse_ledger(withdrawals, deposits, order_history)
+    high_water_mark = store.high_water_mark('bittrex')
+    if high_water_mark is not None:
+        ledger = ledger[ledger['date'] >= high_water_mark]
+
+    logging.info('found {} ledger entries since {}'.format(len(ledger), high_water_mark))
+    store.append('bittrex', ledger)
+    return store.load('bittrex')
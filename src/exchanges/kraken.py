@@ -2,6 +2,8 @@ import urllib.parse
 import logging
 from datetime import datetime
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import hashlib
 import hmac
@@ -11,14 +13,21 @@ import requests
 import pandas
 import tenacity
 from decimal import Decimal
+from requests.adapters import HTTPAdapter
+
+from orderbook import BookSide
 
 _DOMAIN = 'api.kraken.com'
 _API_VERSION = '0'
 _BASE_URL = 'https://{}'.format(_DOMAIN)
+_PUBLIC_CALLS_PER_SECOND = 1
+_DEFAULT_MAX_WORKERS = 4
+# call counter of a starter tier account: maximum value and decrease per second
+_DEFAULT_COUNTER_LIMIT = 15
+_DEFAULT_COUNTER_DECAY = 0.33
+_PRIVATE_CALL_COSTS = {'Ledgers': 2, 'QueryLedgers': 2, 'TradesHistory': 2, 'QueryTrades': 2}
 
-_api_key = None
-_secret_key = None
-_requests_session = None
+_client = None
 
 
 def _translate_currency(kraken_code):
@@ -45,27 +54,23 @@ def _translate_currency(kraken_code):
         return kraken_code
 
 
-def retrieve_data(api_key, secret_key):
+def retrieve_data(api_key, secret_key, store=None):
     """
 
     :param api_key:
     :param secret_key:
+    :param store: optional LedgerStore, only entries past its high-water mark are then downloaded
     :return: (flows: DataFrame ('date', 'asset', 'amount', 'fee', 'exchange'), trades: DataFrame ('date', 'asset',
     'amount', 'fee', 'exchange'), currencies: set(currency codes))
     """
-    connect(api_key, secret_key)
+    client = KrakenClient(api_key, secret_key)
 
-    ledger_entries = get_ledgers_info()
+    if store is None:
+        ledger = load_ledger(client=client)
 
-    records = list()
-    for entry_id, entry in ledger_entries.items():
-        record = merge_dicts(entry, {'ledger_id': entry_id})
-        record['date'] = datetime.fromtimestamp(record['time'])
-        record['asset'] = _translate_currency(record['asset'])
-        record['exchange'] = 'kraken'
-        records.append(record)
+    else:
+        ledger = sync_ledger(store, client=client)
 
-    ledger = pandas.DataFrame(records)
     ledger = ledger[['date', 'asset', 'amount', 'fee', 'exchange', 'type']]
     flows = ledger[(ledger['type'] == 'deposit') | (ledger['type'] == 'withdrawal')].drop('type', axis=1)
     trades = ledger[ledger['type'] == 'trade'].drop('type', axis=1)
@@ -73,78 +78,161 @@ def retrieve_data(api_key, secret_key):
     return flows, trades, currencies
 
 
-def connect(api_key=None, secret_key=None):
+class TokenBucket(object):
+    """
+    Tokens refilled at a constant rate up to a capacity, as Kraken's call counter: each call adds its cost to the
+    counter, which decreases over time and must stay below its limit.
     """
 
-    :param api_key:
-    :param secret_key:
-    :return:
+    def __init__(self, capacity, rate, clock=time.monotonic, sleep=time.sleep):
+        self._capacity = capacity
+        self._rate = rate
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, cost=1):
+        """
+        Takes cost tokens, waiting for them to be refilled when the bucket runs out. Tokens are reserved under the
+        lock so that concurrent callers wait in turn.
+
+        :param cost:
+        :return: seconds waited
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= cost
+            delay = max(0., -self._tokens / self._rate)
+
+        if delay > 0.:
+            self._sleep(delay)
+
+        return delay
+
+
+class KrakenClient(object):
+    """
+    Thread-safe API client sharing one pooled session, generating strictly increasing nonces and limiting the rates
+    of public calls and of private calls according to the call counter.
+
+    Concurrent private calls may reach the server out of nonce order: the API key then needs a nonce window.
     """
-    global _requests_session
-    global _api_key
-    global _secret_key
-    _api_key = api_key
-    _secret_key = secret_key
-    _requests_session = requests.session()
-    logging.info('connected with keys ({}, {})'.format(_api_key, _secret_key))
-
-
-@tenacity.retry(wait=tenacity.wait_fixed(3) + tenacity.wait_random(0, 3),
-                retry=tenacity.retry_if_exception_type(requests.HTTPError),
-                stop=tenacity.stop_after_attempt(5)
-                )
-def _api_call(url_path, options, headers=None):
-    if _requests_session is None:
-        raise Exception('not initialized: call connect(api_key, secret_key) first')
 
-    url = _BASE_URL + url_path
+    def __init__(self, api_key=None, secret_key=None, max_workers=_DEFAULT_MAX_WORKERS,
+                 counter_limit=_DEFAULT_COUNTER_LIMIT, counter_decay=_DEFAULT_COUNTER_DECAY,
+                 public_calls_per_second=_PUBLIC_CALLS_PER_SECOND):
+        self._api_key = api_key
+        self._secret_key = secret_key
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self._session.mount('https://', adapter)
+        self._public_limiter = TokenBucket(public_calls_per_second, public_calls_per_second)
+        self._private_limiter = TokenBucket(counter_limit, counter_decay)
+        self._nonce_lock = threading.Lock()
+        self._last_nonce = 0
+
+    def nonce(self):
+        """
+        Milliseconds timestamp, incremented when needed so that no two calls share a nonce.
+
+        :return:
+        """
+        with self._nonce_lock:
+            self._last_nonce = max(self._last_nonce + 1, int(1000 * time.time()))
+            return self._last_nonce
+
+    def _post(self, url_path, options, headers=None):
+        url = _BASE_URL + url_path
+
+        if headers is None:
+            headers = {}
+
+        response = self._session.post(url, data=options, headers=headers)
+        if response.status_code != requests.codes.ok:
+            logging.error('failed requesting data: status {}'.format(response.status_code))
+            response.raise_for_status()
+
+        logging.debug('response: "{}"'.format(response.text))
+        json_data = response.json(parse_float=Decimal)
+        if 'result' not in json_data:
+            logging.error('request "{}" failed (post data: {}, headers: {})'.format(url, options, headers))
+            raise Exception('request failed: {}'.format(json_data))
+
+        return json_data
+
+    @tenacity.retry(wait=tenacity.wait_fixed(3) + tenacity.wait_random(0, 3),
+                    retry=tenacity.retry_if_exception_type(requests.HTTPError),
+                    stop=tenacity.stop_after_attempt(5)
+                    )
+    def api_call_public(self, method, options=None):
+        if options is None:
+            options = {}
+
+        url_path = '/' + '/'.join([_API_VERSION, 'public', method])
+        self._public_limiter.acquire()
+        return self._post(url_path, options)
+
+    @tenacity.retry(wait=tenacity.wait_fixed(3) + tenacity.wait_random(0, 3),
+                    retry=tenacity.retry_if_exception_type(requests.HTTPError),
+                    stop=tenacity.stop_after_attempt(5)
+                    )
+    def api_call_private(self, method, options=None):
+        # signed again with a new nonce on each attempt
+        options = dict() if options is None else dict(options)
+        url_path = '/' + '/'.join([_API_VERSION, 'private', method])
+
+        self._private_limiter.acquire(_PRIVATE_CALL_COSTS.get(method, 1))
+        nonce = self.nonce()
+        options['nonce'] = nonce
+        post_data = urllib.parse.urlencode(options)
+        encoded = (str(nonce) + post_data).encode()
+        message = url_path.encode() + hashlib.sha256(encoded).digest()
+        signature = hmac.new(base64.b64decode(self._secret_key), message, hashlib.sha512)
+        headers = {
+            'API-Key': self._api_key,
+            'API-Sign': base64.b64encode(signature.digest()).decode()
+        }
+
+        return self._post(url_path, options, headers)
 
-    if headers is None:
-        headers = {}
 
-    response = _requests_session.post(url, data=options, headers=headers)
-    if response.status_code != requests.codes.ok:
-        logging.error('failed requesting data: status {}'.format(response.status_code))
-        response.raise_for_status()
+def connect(api_key=None, secret_key=None):
+    """
+    Sets up the client used by the module functions when no client is given.
+
+    :param api_key:
+    :param secret_key:
+    :return: KrakenClient
+    """
+    global _client
+    _client = KrakenClient(api_key, secret_key)
+    logging.info('connected with keys ({}, {})'.format(api_key, secret_key))
+    return _client
 
-    logging.debug('response: "{}"'.format(response.text))
-    json_data = response.json(parse_float=Decimal)
-    if 'result' not in json_data:
-        logging.error('request "{}" failed (post data: {}, headers: {})'.format(url, options, headers))
-        raise Exception('request failed: {}'.format(json_data))
 
-    return json_data
+def _get_client(client):
+    if client is not None:
+        return client
 
+    if _client is None:
+        raise Exception('not initialized: call connect(api_key, secret_key) first')
 
-def api_call_public(method, options=None):
-    if options is None:
-        options = {}
+    return _client
 
-    url_path = '/' + '/'.join([_API_VERSION, 'public', method])
-    return _api_call(url_path, options)
 
+def api_call_public(method, options=None, client=None):
+    return _get_client(client).api_call_public(method, options)
 
-def api_call_private(method, options=None):
-    if options is None:
-        options = {}
-
-    url_path = '/' + '/'.join([_API_VERSION, 'private', method])
-
-    nonce = int(1000 * time.time())
-    options['nonce'] = nonce
-    post_data = urllib.parse.urlencode(options)
-    encoded = (str(nonce) + post_data).encode()
-    message = url_path.encode() + hashlib.sha256(encoded).digest()
-    signature = hmac.new(base64.b64decode(_secret_key), message, hashlib.sha512)
-    headers = {
-        'API-Key': _api_key,
-        'API-Sign': base64.b64encode(signature.digest()).decode()
-    }
 
-    return _api_call(url_path, options, headers)
+def api_call_private(method, options=None, client=None):
+    return _get_client(client).api_call_private(method, options)
 
 
-def get_tradeable_pairs():
+def get_tradeable_pairs(client=None):
     """
     Creates a DataFrame of pairs data:
     altname  base   lot  lot_decimals  lot_multiplier  margin_call     margin_stop pair_code  pair_decimals quote
@@ -156,7 +244,7 @@ def get_tradeable_pairs():
 
     :return:
     """
-    asset_pairs = api_call_public('AssetPairs')['result']
+    asset_pairs = api_call_public('AssetPairs', client=client)['result']
     records = list()
     for pair_code, pair_data in asset_pairs.items():
         record = merge_dicts(pair_data, {'pair_code': pair_code})
@@ -172,17 +260,25 @@ def get_tradeable_pairs():
     return pandas.DataFrame(records)
 
 
-def get_order_book(pair, depth=5):
+def get_order_book(pair, depth=5, compact=False, client=None):
     """
     Order book for a given pair.
 
     :param pair:
     :param depth:
-    :return:
+    :param compact: returning BookSide arrays instead of DataFrames
+    :param client: KrakenClient, defaults to the connected one
+    :return: (bid, ask), (None, None) when a side is empty
     """
-    order_book = api_call_public('Depth', options={'pair': pair, 'count': depth})['result'][pair]
+    order_book = api_call_public('Depth', options={'pair': pair, 'count': depth}, client=client)['result'][pair]
     bid_side = order_book['bids']
     ask_side = order_book['asks']
+    if compact:
+        if len(bid_side) == 0 or len(ask_side) == 0:
+            return None, None
+
+        return BookSide.from_levels(bid_side), BookSide.from_levels(ask_side)
+
     bid_records = list()
     for count, row_data in enumerate(bid_side):
         price, volume, timestamp = row_data
@@ -208,8 +304,29 @@ def get_order_book(pair, depth=5):
     return bid_df, ask_df
 
 
-def get_balances():
-    return api_call_private('Balance')['result']
+def get_order_books(pairs, depth=5, max_workers=_DEFAULT_MAX_WORKERS, compact=False, client=None):
+    """
+    Snapshot of the order books of several pairs, each pair being requested once. Requests are run concurrently,
+    the client keeping them within the public API rate limit.
+
+    :param pairs:
+    :param depth:
+    :param max_workers:
+    :param compact: returning BookSide arrays instead of DataFrames
+    :param client: KrakenClient, defaults to the connected one
+    :return: dict pair -> (bid, ask) as returned by get_order_book
+    """
+    pairs = sorted(set(pairs))
+
+    def load_pair(pair):
+        return get_order_book(pair, depth=depth, compact=compact, client=client)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(pairs, executor.map(load_pair, pairs)))
+
+
+def get_balances(client=None):
+    return api_call_private('Balance', client=client)['result']
 
 
 def merge_dicts(dict1, *dicts):
@@ -220,18 +337,103 @@ def merge_dicts(dict1, *dicts):
     return dict1_copy
 
 
-def get_ledgers_info(options=None):
+_LEDGER_COLUMNS = ['ledger_id', 'date', 'asset', 'amount', 'fee', 'exchange', 'type']
+
+
+def iter_ledgers_info(options=None, client=None):
+    """
+    Ledger entries, page by page as returned by the API.
+
+    :param options: additional request options
+    :param client: KrakenClient, defaults to the connected one
+    :return: generator of dict ledger_id -> ledger entry
+    """
     if options is None:
         options = dict()
 
-    ledgers_info = api_call_private('Ledgers')['result']
-    current_entries = ledgers_info['ledger']
-    remaining = ledgers_info['count'] - len(current_entries)
-    while remaining > 0:
-        options.update({'ofs': len(current_entries)})
-        ledgers_info = api_call_private('Ledgers', options=options)['result']
+    count_entries = 0
+    while True:
+        page_options = merge_dicts(options, {'ofs': count_entries})
+        ledgers_info = api_call_private('Ledgers', options=page_options, client=client)['result']
         entries = ledgers_info['ledger']
+        if len(entries) == 0:
+            break
+
+        yield entries
+        count_entries += len(entries)
+        if count_entries >= ledgers_info['count']:
+            break
+
+
+def _parse_ledger_entry(entry_id, entry):
+    """
+
+    :param entry_id:
+    :param entry: ledger entry as returned by the API
+    :return: dict of ledger fields
+    """
+    return {
+        'ledger_id': entry_id,
+        'date': datetime.fromtimestamp(entry['time']),
+        'asset': _translate_currency(entry['asset']),
+        'amount': entry['amount'],
+        'fee': entry['fee'],
+        'exchange': 'kraken',
+        'type': entry['type'],
+    }
+
+
+def iter_ledger_frames(options=None, client=None):
+    """
+    Parsed ledger entries, one DataFrame per page, available as soon as each page is downloaded.
+
+    :param options: additional request options
+    :param client: KrakenClient, defaults to the connected one
+    :return: generator of DataFrame ('ledger_id', 'date', 'asset', 'amount', 'fee', 'exchange', 'type')
+    """
+    for entries in iter_ledgers_info(options, client=client):
+        records = [_parse_ledger_entry(entry_id, entry) for entry_id, entry in entries.items()]
+        yield pandas.DataFrame(records, columns=_LEDGER_COLUMNS)
+
+
+def load_ledger(options=None, client=None):
+    """
+    Ledger built page by page, only keeping the parsed columns of each page.
+
+    :param options: additional request options
+    :param client: KrakenClient, defaults to the connected one
+    :return: DataFrame ('ledger_id', 'date', 'asset', 'amount', 'fee', 'exchange', 'type')
+    """
+    frames = list(iter_ledger_frames(options, client=client))
+    if len(frames) == 0:
+        return pandas.DataFrame(columns=_LEDGER_COLUMNS)
+
+    return pandas.concat(frames, ignore_index=True)
+
+
+def get_ledgers_info(options=None, client=None):
+    current_entries = dict()
+    for entries in iter_ledgers_info(options, client=client):
         current_entries.update(entries)
-        remaining = ledgers_info['count'] - len(current_entries)
 
     return current_entries
+
+
+def sync_ledger(store, client=None):
+    """
+    Downloads ledger entries past the high-water mark of the store and merges them into it.
+
+    :param store: LedgerStore
+    :param client: KrakenClient, defaults to the connected one
+    :return: DataFrame ('entry_id', 'date', 'asset', 'amount', 'fee', 'exchange', 'type') of all stored entries
+    """
+    options = dict()
+    high_water_mark = store.high_water_mark('kraken')
+    if high_water_mark is not None:
+        # start is exclusive: entries sharing the latest second are downloaded again and deduplicated
+        options['start'] = int(high_water_mark.timestamp()) - 1
+
+    entries = load_ledger(options, client=client).rename(columns={'ledger_id': 'entry_id'})
+    logging.info('downloaded {} ledger entries since {}'.format(len(entries), high_water_mark))
+    store.append('kraken', entries)
+    return store.load('kraken')
@@ -1,11 +1,18 @@
+import hashlib
+import json
 import logging
+from difflib import SequenceMatcher
+
 import httplib2
+import pandas
 from apiclient import discovery
 from gspread.utils import rowcol_to_a1
 from oauth2client.service_account import ServiceAccountCredentials
 
 _GOOGLE_DRIVE_SCOPE = 'https://www.googleapis.com/auth/drive'
 _GOOGLE_DRIVE_FILE_SCOPE = 'https://www.googleapis.com/auth/drive.file'
+_MAX_CELLS_PER_UPDATE = 50000
+_HASHES_TAB_FORMAT = '{}-hashes'
 
 
 def file_by_id(svc_drive, file_id):
@@ -82,3 +89,278 @@ def save_sheet(svc_sheet, spreadsheet_id, tab_name, header, records):
             cell.value = row_data[field]
 
     worksheet.update_cells(cells)
+
+
+def sheet_values(frame, header):
+    """
+    Converts a DataFrame to the rows of values sent to the Sheets API, dates being formatted as text and missing
+    values left blank.
+
+    :param frame:
+    :param header: columns to be saved
+    :return: list of rows, the first one being the header
+    """
+    columns = list()
+    for field in header:
+        column = frame[field]
+        if pandas.api.types.is_datetime64_any_dtype(column):
+            column = column.dt.strftime('%Y-%m-%d %H:%M:%S')
+
+        columns.append(column.astype(object).where(column.notnull(), ''))
+
+    values = pandas.concat(columns, axis=1).values.tolist() if len(columns) > 0 else list()
+    return [list(header)] + values
+
+
+def sheet_range(tab_name, first_row, first_column, last_row, last_column):
+    """
+    A1 notation of a range, rows and columns starting from 1.
+    """
+    return "'{}'!{}:{}".format(tab_name.replace("'", "''"), rowcol_to_a1(first_row, first_column),
+                               rowcol_to_a1(last_row, last_column))
+
+
+def tab_ids(svc_sheets, spreadsheet_id):
+    """
+
+    :param svc_sheets: Sheets service as returned by setup_services
+    :param spreadsheet_id:
+    :return: dict mapping tab names to sheet ids
+    """
+    spreadsheet = svc_sheets.spreadsheets().get(spreadsheetId=spreadsheet_id, fields='sheets.properties').execute()
+    return {sheet['properties']['title']: sheet['properties']['sheetId'] for sheet in spreadsheet['sheets']}
+
+
+def resize_tab(svc_sheets, spreadsheet_id, tab_name, count_rows, count_columns, hidden=False, sheet_ids=None):
+    """
+    Sets the size of a tab, adding it if missing.
+
+    :param svc_sheets: Sheets service as returned by setup_services
+    :param spreadsheet_id:
+    :param tab_name:
+    :param count_rows:
+    :param count_columns:
+    :param hidden: whether the tab is hidden when added
+    :param sheet_ids: tab names mapped to sheet ids as returned by tab_ids, queried by default
+    :return: sheet id of the tab
+    """
+    if sheet_ids is None:
+        sheet_ids = tab_ids(svc_sheets, spreadsheet_id)
+
+    grid_properties = {'rowCount': count_rows, 'columnCount': count_columns}
+    if tab_name not in sheet_ids:
+        request = {'addSheet': {'properties': {'title': tab_name, 'gridProperties': grid_properties,
+                                               'hidden': hidden}}}
+        response = svc_sheets.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id,
+                                                         body={'requests': [request]}).execute()
+        return response['replies'][0]['addSheet']['properties']['sheetId']
+
+    request = {'updateSheetProperties': {'properties': {'sheetId': sheet_ids[tab_name],
+                                                        'gridProperties': grid_properties},
+                                         'fields': 'gridProperties(rowCount,columnCount)'}}
+    svc_sheets.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={'requests': [request]}).execute()
+    return sheet_ids[tab_name]
+
+
+def update_values(svc_sheets, spreadsheet_id, tab_name, first_row, values, max_cells=_MAX_CELLS_PER_UPDATE):
+    """
+    Writes rows of values from a given row, in as few values.batchUpdate calls as allowed by max_cells.
+
+    :param svc_sheets: Sheets service as returned by setup_services
+    :param spreadsheet_id:
+    :param tab_name:
+    :param first_row: row of the first values, starting from 1
+    :param values: list of rows
+    :param max_cells: maximum number of cells sent per call
+    :return: number of calls
+    """
+    return update_blocks(svc_sheets, spreadsheet_id, [(tab_name, first_row, values)], max_cells=max_cells)
+
+
+def update_blocks(svc_sheets, spreadsheet_id, blocks, max_cells=_MAX_CELLS_PER_UPDATE,
+                  value_input_option='USER_ENTERED'):
+    """
+    Writes blocks of rows, possibly to several tabs, in as few values.batchUpdate calls as allowed by max_cells.
+
+    :param svc_sheets: Sheets service as returned by setup_services
+    :param spreadsheet_id:
+    :param blocks: list of (tab name, row of the first values starting from 1, list of rows)
+    :param max_cells: maximum number of cells sent per call
+    :param value_input_option: 'USER_ENTERED' for values parsed as if typed in, 'RAW' for values stored as is
+    :return: number of calls
+    """
+    calls_data = [list()]
+    count_cells = 0
+    for tab_name, first_row, values in blocks:
+        if len(values) == 0:
+            continue
+
+        count_columns = max(len(row) for row in values)
+        chunk_rows = max(1, max_cells // max(1, count_columns))
+        for start in range(0, len(values), chunk_rows):
+            chunk = values[start:start + chunk_rows]
+            if count_cells + len(chunk) * count_columns > max_cells and len(calls_data[-1]) > 0:
+                calls_data.append(list())
+                count_cells = 0
+
+            range_text = sheet_range(tab_name, first_row + start, 1, first_row + start + len(chunk) - 1,
+                                     count_columns)
+            calls_data[-1].append({'range': range_text, 'values': chunk})
+            count_cells += len(chunk) * count_columns
+
+    count_calls = 0
+    for data in calls_data:
+        if len(data) == 0:
+            continue
+
+        logging.info('updating ranges {}'.format(', '.join(item['range'] for item in data)))
+        body = {'valueInputOption': value_input_option, 'data': data}
+        svc_sheets.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
+        count_calls += 1
+
+    return count_calls
+
+
+def save_frame(svc_sheets, spreadsheet_id, tab_name, frame, header=None, max_cells=_MAX_CELLS_PER_UPDATE):
+    """
+    Saves a DataFrame to a tab, resized to the header and rows.
+
+    :param svc_sheets: Sheets service as returned by setup_services
+    :param spreadsheet_id:
+    :param tab_name:
+    :param frame:
+    :param header: columns to be saved, all of them by default
+    :param max_cells: maximum number of cells sent per call
+    :return:
+    """
+    if frame.empty:
+        return
+
+    if header is None:
+        header = frame.columns.tolist()
+
+    values = sheet_values(frame, header)
+    resize_tab(svc_sheets, spreadsheet_id, tab_name, len(values), len(header))
+    update_values(svc_sheets, spreadsheet_id, tab_name, 1, values, max_cells=max_cells)
+
+
+def row_hash(row):
+    """
+    Content hash of a row of values.
+    """
+    return hashlib.md5(json.dumps(row, default=str).encode()).hexdigest()
+
+
+def diff_rows(stored_keys, stored_hashes, keys, hashes):
+    """
+    Row insertions and deletions turning the stored rows into the new ones, matched by key, as well as the new rows
+    to be written. Rows are counted from 0, the first one being the header.
+
+    :param stored_keys:
+    :param stored_hashes:
+    :param keys:
+    :param hashes:
+    :return: (list of ('insert' or 'delete', position in stored rows, count of rows) from the bottom up, positions of
+     new rows to be written) or None when the header changed
+    """
+    if len(stored_hashes) == 0 or stored_hashes[0] != hashes[0]:
+        return None
+
+    matcher = SequenceMatcher(None, stored_keys[1:], keys[1:], autojunk=False)
+    changes = list()
+    written = list()
+    for tag, start, end, new_start, new_end in matcher.get_opcodes():
+        if tag == 'equal':
+            written.extend(1 + new_start + count for count in range(end - start)
+                           if stored_hashes[1 + start + count] != hashes[1 + new_start + count])
+            continue
+
+        count_stored = end - start
+        count_new = new_end - new_start
+        if count_new > count_stored:
+            changes.append(('insert', 1 + end, count_new - count_stored))
+
+        elif count_stored > count_new:
+            changes.append(('delete', 1 + start + count_new, count_stored - count_new))
+
+        written.extend(range(1 + new_start, 1 + new_end))
+
+    return list(reversed(changes)), written
+
+
+def sync_frame(svc_sheets, spreadsheet_id, tab_name, frame, header=None, max_cells=_MAX_CELLS_PER_UPDATE):
+    """
+    Saves a DataFrame to a tab, only sending the rows that changed since the last sync. Rows are matched by their
+    first column and compared with the content hashes held in a hidden tab, the whole tab being rewritten when
+    these hashes are missing or the header changed.
+
+    :param svc_sheets: Sheets service as returned by setup_services
+    :param spreadsheet_id:
+    :param tab_name:
+    :param frame:
+    :param header: columns to be saved, all of them by default
+    :param max_cells: maximum number of cells sent per call
+    :return: number of rows written
+    """
+    if frame.empty:
+        return 0
+
+    if header is None:
+        header = frame.columns.tolist()
+
+    values = sheet_values(frame, header)
+    keys = [str(row[0]) for row in values]
+    hashes = [row_hash(row) for row in values]
+    hashes_tab_name = _HASHES_TAB_FORMAT.format(tab_name)
+    sheet_ids = tab_ids(svc_sheets, spreadsheet_id)
+    diff = None
+    if tab_name in sheet_ids and hashes_tab_name in sheet_ids:
+        range_text = "'{}'!A:B".format(hashes_tab_name.replace("'", "''"))
+        stored = svc_sheets.spreadsheets().values().get(spreadsheetId=spreadsheet_id,
+                                                        range=range_text).execute().get('values', list())
+        stored = [row for row in stored if len(row) == 2]
+        diff = diff_rows([row[0] for row in stored], [row[1] for row in stored], keys, hashes)
+
+    if diff is None:
+        logging.info('rewriting {} rows of tab {}'.format(len(values), tab_name))
+        resize_tab(svc_sheets, spreadsheet_id, tab_name, len(values), len(header), sheet_ids=sheet_ids)
+        resize_tab(svc_sheets, spreadsheet_id, hashes_tab_name, len(values), 2, hidden=True, sheet_ids=sheet_ids)
+        update_blocks(svc_sheets, spreadsheet_id, [(tab_name, 1, values)], max_cells=max_cells)
+        update_blocks(svc_sheets, spreadsheet_id, [(hashes_tab_name, 1, [list(item) for item in zip(keys, hashes)])],
+                      max_cells=max_cells, value_input_option='RAW')
+        return len(values)
+
+    changes, written = diff
+    requests = list()
+    for sheet_id in (sheet_ids[tab_name], sheet_ids[hashes_tab_name]):
+        for change, position, count in changes:
+            dimension_range = {'sheetId': sheet_id, 'dimension': 'ROWS', 'startIndex': position,
+                               'endIndex': position + count}
+            if change == 'insert' and position == len(stored):
+                requests.append({'appendDimension': {'sheetId': sheet_id, 'dimension': 'ROWS', 'length': count}})
+
+            elif change == 'insert':
+                requests.append({'insertDimension': {'range': dimension_range, 'inheritFromBefore': position > 1}})
+
+            else:
+                requests.append({'deleteDimension': {'range': dimension_range}})
+
+    if len(requests) > 0:
+        svc_sheets.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={'requests': requests}).execute()
+
+    blocks = list()
+    for position in written:
+        if len(blocks) > 0 and blocks[-1][1] + len(blocks[-1][2]) == position + 1:
+            blocks[-1][2].append(values[position])
+
+        else:
+            blocks.append((tab_name, position + 1, [values[position]]))
+
+    hashes_blocks = [(hashes_tab_name, first_row, [[keys[first_row - 1 + count], hashes[first_row - 1 + count]]
+                                                   for count in range(len(rows))])
+                     for _, first_row, rows in blocks]
+    logging.info('updating {} of {} rows of tab {}'.format(len(written), len(values), tab_name))
+    update_blocks(svc_sheets, spreadsheet_id, blocks, max_cells=max_cells)
+    # keys are kept as text, not parsed into dates formatted according to the spreadsheet locale
+    update_blocks(svc_sheets, spreadsheet_id, hashes_blocks, max_cells=max_cells, value_input_option='RAW')
+    return len(written)
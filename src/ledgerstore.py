@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+import pandas
+
+from datastore import save_dataset, load_dataset, dataset_exists
+
+_INDEX_FILE = 'index.json'
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+LEDGER_COLUMNS = ['entry_id', 'date', 'asset', 'amount', 'fee', 'exchange', 'type']
+# exchange APIs may return amounts as text
+_DECIMAL_COLUMNS = ['amount', 'fee']
+
+
+class LedgerStore(object):
+    """
+    Local copy of exchange ledgers, one dataset per exchange.
+
+    Entries are identified by their exchange entry id and asset, trades having one entry per traded asset. An index
+    file records the date of the latest entry held for each exchange, used as high-water mark when syncing.
+    """
+
+    def __init__(self, root_path):
+        self._root_path = root_path
+        os.makedirs(root_path, exist_ok=True)
+        self._index_path = os.sep.join([root_path, _INDEX_FILE])
+        self._index = dict()
+        self._lock = threading.Lock()
+        if os.path.isfile(self._index_path):
+            with open(self._index_path, 'r') as index_file:
+                self._index = json.load(index_file)
+
+    def _dataset_path(self, exchange):
+        return os.sep.join([self._root_path, exchange])
+
+    def _save_index(self):
+        with open(self._index_path, 'w') as index_file:
+            json.dump(self._index, index_file, indent=2, sort_keys=True)
+
+    def high_water_mark(self, exchange):
+        """
+
+        :param exchange:
+        :return: datetime of the latest entry held, None if nothing is stored yet
+        """
+        high_water_mark = self._index.get(exchange)
+        if high_water_mark is None:
+            return None
+
+        return datetime.strptime(high_water_mark, _TIMESTAMP_FORMAT)
+
+    def load(self, exchange):
+        """
+
+        :param exchange:
+        :return: DataFrame ('entry_id', 'date', 'asset', 'amount', 'fee', 'exchange', 'type') sorted by date
+        """
+        dataset_path = self._dataset_path(exchange)
+        if not dataset_exists(dataset_path):
+            return pandas.DataFrame(columns=LEDGER_COLUMNS)
+
+        return load_dataset(dataset_path)
+
+    def append(self, exchange, entries):
+        """
+        Merges entries into the stored ledger, newer versions of an entry replacing stored ones. Safe to call for
+        several exchanges at once.
+
+        :param exchange:
+        :param entries: DataFrame ('entry_id', 'date', 'asset', 'amount', 'fee', 'exchange', 'type')
+        :return: number of entries held
+        """
+        with self._lock:
+            stored = self.load(exchange)
+            ledgers = [ledger[LEDGER_COLUMNS] for ledger in (stored, entries) if not ledger.empty]
+            if len(ledgers) == 0:
+                return 0
+
+            merged = pandas.concat(ledgers).drop_duplicates(subset=['entry_id', 'asset'], keep='last')
+            logging.info('storing {} ledger entries for {} ({} new)'.format(len(merged), exchange,
+                                                                            len(merged) - len(stored)))
+            save_dataset(merged, self._dataset_path(exchange), decimal_columns=_DECIMAL_COLUMNS)
+            self._index[exchange] = pandas.Timestamp(merged['date'].max()).strftime(_TIMESTAMP_FORMAT)
+            self._save_index()
+            return len(merged)
@@ -0,0 +1,83 @@
+from datetime import datetime
+
+import numpy
+import pandas
+
+_COLUMNS = ('price', 'volume', 'timestamp')
+
+
+class BookSide(object):
+    """
+    One side of an order book as arrays of prices, volumes and timestamps, from the best level.
+    """
+    __slots__ = ('price', 'volume', 'timestamp')
+
+    def __init__(self, prices, volumes, timestamps):
+        self.price = numpy.asarray(prices, dtype=float)
+        self.volume = numpy.asarray(volumes, dtype=float)
+        self.timestamp = numpy.asarray(timestamps, dtype=float)
+
+    @classmethod
+    def from_levels(cls, levels):
+        """
+        :param levels: list of (price, volume, timestamp), as numbers or strings
+        :return: BookSide
+        """
+        values = numpy.array(levels, dtype=float).reshape(-1, 3)
+        return cls(values[:, 0], values[:, 1], values[:, 2])
+
+    def __len__(self):
+        return self.price.shape[0]
+
+    def __getitem__(self, column):
+        if column not in _COLUMNS:
+            raise KeyError(column)
+
+        return getattr(self, column)
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    def level(self, position):
+        """
+        :param position: 0 for the best level
+        :return: dict with keys price, volume and timestamp
+        """
+        return {'price': float(self.price[position]), 'volume': float(self.volume[position]),
+                'timestamp': float(self.timestamp[position])}
+
+    def best(self):
+        return self.level(0)
+
+    def cumulative_volumes(self):
+        """
+        :return: volume available down to each level
+        """
+        return numpy.cumsum(self.volume)
+
+    def cumulative_notionals(self):
+        """
+        :return: amount of quote currency traded down to each level
+        """
+        return numpy.cumsum(self.price * self.volume)
+
+    def depth_for(self, volume):
+        """
+        Number of levels needed to trade a volume, len(self) + 1 when the volume exceeds the book.
+
+        :param volume:
+        :return:
+        """
+        return int(numpy.searchsorted(self.cumulative_volumes(), volume)) + 1
+
+    def to_frame(self):
+        """
+        :return: DataFrame indexed by level with columns timestamp, price and volume, as returned by
+         kraken.get_order_book but with float prices and volumes
+        """
+        frame = pandas.DataFrame({'timestamp': [datetime.fromtimestamp(timestamp) for timestamp in self.timestamp],
+                                  'price': self.price, 'volume': self.volume},
+                                 columns=['timestamp', 'price', 'volume'])
+        frame.index.name = 'level'
+        return frame
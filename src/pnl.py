@@ -1,6 +1,65 @@
 import logging
 import math
 
+import numpy
+
+
+def replay_fills(fill_qtys, fill_prices, fees=None, quantity=0., cost=0., realized_pnl=0.):
+    """
+    Replays a sequence of fills in one pass, using the same weighted average cost method as
+    AverageCostProfitAndLoss.add_fill.
+
+    The cost follows the linear recurrence cost = ratio * previous_cost + opening_qty * fill_price, with
+    ratio = 1 + closing_qty / previous_qty on partial closes and 0 where the position opens from flat, closes or flips.
+    It is solved by a prefix scan composing these affine steps, which only multiplies ratios between 0 and 1 and
+    stays stable over any number of partial closes.
+
+    :param fill_qtys: array of signed fill quantities
+    :param fill_prices: array of fill prices
+    :param fees: array of fees (ignored, as in the scalar path)
+    :param quantity: initial quantity
+    :param cost: initial cost
+    :param realized_pnl: initial realized P&L
+    :return: tuple of arrays (quantities, costs, realized_pnls) after each fill
+    """
+    fill_qtys = numpy.asarray(fill_qtys, dtype=float)
+    fill_prices = numpy.asarray(fill_prices, dtype=float)
+    if fill_qtys.shape != fill_prices.shape:
+        raise ValueError('quantities and prices must have the same shape')
+
+    all_qtys = numpy.cumsum(numpy.concatenate(([quantity], fill_qtys)))
+    previous_qtys = all_qtys[:-1]
+    quantities = all_qtys[1:]
+
+    flat = previous_qtys == 0
+    closing = ~flat & (numpy.copysign(1, previous_qtys) != numpy.copysign(1, fill_qtys))
+    closing_qtys = numpy.where(closing,
+                               numpy.minimum(numpy.abs(previous_qtys), numpy.abs(fill_qtys))
+                               * numpy.copysign(1, fill_qtys), 0.)
+    opening_qtys = fill_qtys - closing_qtys
+    # position opened from flat, closed or flipped: previous cost is fully released
+    reset = flat | (closing & (numpy.abs(fill_qtys) >= numpy.abs(previous_qtys)))
+    safe_previous_qtys = numpy.where(flat, 1., previous_qtys)
+    ratios = numpy.where(reset, 0., numpy.where(closing, 1. + closing_qtys / safe_previous_qtys, 1.))
+    increments = opening_qtys * fill_prices
+
+    # initial state acts as a first step from nothing
+    ratios = numpy.concatenate(([0.], ratios))
+    costs = numpy.concatenate(([cost], increments))
+    shift = 1
+    while shift < costs.shape[0]:
+        # composing each step with the one shift steps before it
+        composed_costs = ratios[shift:] * costs[:-shift] + costs[shift:]
+        ratios[shift:] = ratios[shift:] * ratios[:-shift]
+        costs[shift:] = composed_costs
+        shift *= 2
+
+    previous_costs = costs[:-1]
+    costs = costs[1:]
+    realized = numpy.where(closing, closing_qtys * (previous_costs / safe_previous_qtys - fill_prices), 0.)
+    realized_pnls = realized_pnl + numpy.cumsum(realized)
+    return quantities, costs, realized_pnls
+
 
 class AverageCostProfitAndLoss(object):
     """
@@ -63,3 +122,22 @@ class AverageCostProfitAndLoss(object):
             self._quantity = old_qty + fill_qty
             self._cost = old_cost + (opening_qty * fill_price) + (closing_qty * old_cost / old_qty)
             self._realized_pnl = old_realized + closing_qty * (old_cost / old_qty - fill_price)
+
+    def add_fills(self, fill_qtys, fill_prices, fees=None):
+        """
+        Adding a batch of fills to the record updates the P&L values.
+
+        :param fill_qtys: array of signed fill quantities
+        :param fill_prices: array of fill prices
+        :param fees: array of fees that apply on the trades
+        :return: tuple of arrays (quantities, costs, realized_pnls) after each fill
+        """
+        logging.debug('adding %d fills', len(fill_qtys))
+        quantities, costs, realized_pnls = replay_fills(fill_qtys, fill_prices, fees, quantity=self._quantity,
+                                                        cost=self._cost, realized_pnl=self._realized_pnl)
+        if len(quantities) > 0:
+            self._quantity = float(quantities[-1])
+            self._cost = float(costs[-1])
+            self._realized_pnl = float(realized_pnls[-1])
+
+        return quantities, costs, realized_pnls
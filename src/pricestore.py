@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+from datetime import datetime
+
+import pandas
+
+from datastore import save_dataset, load_dataset, dataset_exists
+
+_INDEX_FILE = 'index.json'
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+class PriceStore(object):
+    """
+    Local history of prices, one dataset per pair, exchange and time scale.
+
+    An index file records the last timestamp held for each of them so that only the missing tail needs fetching.
+    """
+
+    def __init__(self, root_path):
+        self._root_path = root_path
+        os.makedirs(root_path, exist_ok=True)
+        self._index_path = os.sep.join([root_path, _INDEX_FILE])
+        self._index = dict()
+        if os.path.isfile(self._index_path):
+            with open(self._index_path, 'r') as index_file:
+                self._index = json.load(index_file)
+
+    @staticmethod
+    def _key(pair, exchange, time_scale):
+        return '/'.join([exchange, time_scale, '-'.join(pair)])
+
+    def _dataset_path(self, pair, exchange, time_scale):
+        return os.sep.join([self._root_path, exchange, time_scale, '-'.join(pair)])
+
+    def _chunks_path(self, pair, exchange, time_scale):
+        return os.sep.join([self._root_path, exchange, time_scale, '-'.join(pair) + '.chunks'])
+
+    def _chunk_path(self, pair, exchange, time_scale, chunk_start):
+        return os.sep.join([self._chunks_path(pair, exchange, time_scale), str(chunk_start)])
+
+    def _save_index(self):
+        with open(self._index_path, 'w') as index_file:
+            json.dump(self._index, index_file, indent=2, sort_keys=True)
+
+    def last_timestamp(self, pair, exchange, time_scale):
+        """
+
+        :param pair: (from_currency, to_currency)
+        :param exchange: exchange as referenced by CryptoCompare
+        :param time_scale:
+        :return: datetime of the last price held, None if the pair is not stored yet
+        """
+        last_timestamp = self._index.get(self._key(pair, exchange, time_scale))
+        if last_timestamp is None:
+            return None
+
+        return datetime.strptime(last_timestamp, _TIMESTAMP_FORMAT)
+
+    def load_pair(self, pair, exchange, time_scale):
+        """
+
+        :param pair: (from_currency, to_currency)
+        :param exchange: exchange as referenced by CryptoCompare
+        :param time_scale:
+        :return: DataFrame ('date', 'price') sorted by date
+        """
+        dataset_path = self._dataset_path(pair, exchange, time_scale)
+        if not dataset_exists(dataset_path):
+            return pandas.DataFrame(columns=['date', 'price'])
+
+        return load_dataset(dataset_path)
+
+    def save_pair(self, pair, exchange, time_scale, prices):
+        """
+        Replaces the history held for a pair.
+
+        :param pair: (from_currency, to_currency)
+        :param exchange: exchange as referenced by CryptoCompare
+        :param time_scale:
+        :param prices: DataFrame ('date', 'price')
+        :return:
+        """
+        dataset_path = self._dataset_path(pair, exchange, time_scale)
+        os.makedirs(os.path.dirname(dataset_path), exist_ok=True)
+        prices = prices.sort_values('date').reset_index(drop=True)
+        save_dataset(prices, dataset_path)
+        if not prices.empty:
+            last_timestamp = prices['date'].iloc[-1].strftime(_TIMESTAMP_FORMAT)
+            self._index[self._key(pair, exchange, time_scale)] = last_timestamp
+            self._save_index()
+
+    def append(self, prices, exchange, time_scale):
+        """
+        Merges prices into the store, newer values replacing stored ones for the same date.
+
+        :param prices: DataFrame ('currency', 'date', 'price') with currency formatted as 'FROM/TO'
+        :param exchange: exchange as referenced by CryptoCompare
+        :param time_scale:
+        :return:
+        """
+        for currency, new_prices in prices.groupby('currency'):
+            pair = tuple(currency.split('/'))
+            stored = self.load_pair(pair, exchange, time_scale)
+            merged = pandas.concat([frame for frame in (stored, new_prices[['date', 'price']]) if not frame.empty])
+            merged = merged.drop_duplicates(subset='date', keep='last')
+            logging.debug('storing {} prices for {}'.format(len(merged), currency))
+            self.save_pair(pair, exchange, time_scale, merged)
+
+    def load(self, pairs, exchange, time_scale):
+        """
+
+        :param pairs: list of (from_currency, to_currency)
+        :param exchange: exchange as referenced by CryptoCompare
+        :param time_scale:
+        :return: DataFrame ('currency', 'date', 'price')
+        """
+        pair_prices = list()
+        for pair in pairs:
+            prices = self.load_pair(pair, exchange, time_scale)
+            if not prices.empty:
+                prices.insert(0, 'currency', '/'.join(pair))
+                pair_prices.append(prices)
+
+        if len(pair_prices) == 0:
+            return pandas.DataFrame(columns=['currency', 'date', 'price'])
+
+        return pandas.concat(pair_prices, ignore_index=True)
+
+    def has_chunk(self, pair, exchange, time_scale, chunk_start):
+        """
+
+        :param pair: (from_currency, to_currency)
+        :param exchange: exchange as referenced by CryptoCompare
+        :param time_scale:
+        :param chunk_start: POSIX timestamp at which the chunk starts
+        :return: True if the chunk has been fully loaded
+        """
+        return dataset_exists(self._chunk_path(pair, exchange, time_scale, chunk_start))
+
+    def save_chunk(self, pair, exchange, time_scale, chunk_start, prices):
+        """
+        Saves a completed chunk of history, the dataset only appearing once fully written.
+
+        :param pair: (from_currency, to_currency)
+        :param exchange: exchange as referenced by CryptoCompare
+        :param time_scale:
+        :param chunk_start: POSIX timestamp at which the chunk starts
+        :param prices: DataFrame ('date', 'price')
+        :return:
+        """
+        chunk_path = self._chunk_path(pair, exchange, time_scale, chunk_start)
+        os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+        save_dataset(prices, chunk_path)
+
+    def load_chunks(self, pair, exchange, time_scale):
+        """
+
+        :param pair: (from_currency, to_currency)
+        :param exchange: exchange as referenced by CryptoCompare
+        :param time_scale:
+        :return: DataFrame ('date', 'price') of all completed chunks
+        """
+        chunks_path = self._chunks_path(pair, exchange, time_scale)
+        chunks = list()
+        if os.path.isdir(chunks_path):
+            for chunk_name in sorted(os.listdir(chunks_path)):
+                chunk_path = os.sep.join([chunks_path, chunk_name])
+                if chunk_name.isdigit() and dataset_exists(chunk_path):
+                    chunks.append(load_dataset(chunk_path))
+
+        if len(chunks) == 0:
+            return pandas.DataFrame(columns=['date', 'price'])
+
+        return pandas.concat(chunks, ignore_index=True)
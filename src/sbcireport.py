@@ -1,8 +1,8 @@
 import pandas
-from collections import defaultdict
+import numpy
 import logging
 
-from pnl import AverageCostProfitAndLoss
+from pnl import replay_fills
 
 
 def _select_prices(reporting_currency, prices):
@@ -62,10 +62,30 @@ def extend_balances(reporting_currency, balances, prices):
     return extended_balances, prices_selection
 
 
+def _replay_order(trade_dates, price_dates):
+    """
+    Positions of trades in the order they are replayed: trades sharing a timestamp are replayed as a block, once per
+    occurrence of that timestamp in the price index merged with the trades index.
+
+    :param trade_dates: sorted array of trade timestamps
+    :param price_dates: price timestamps before merging trade timestamps
+    :return: array of positions into trade_dates
+    """
+    group_dates, group_starts, group_sizes = numpy.unique(trade_dates, return_index=True, return_counts=True)
+    group_replays = group_sizes + numpy.isin(group_dates, price_dates)
+    block_sizes = group_sizes * group_replays
+    block_starts = numpy.cumsum(block_sizes) - block_sizes
+    offsets = numpy.arange(block_sizes.sum()) - numpy.repeat(block_starts, block_sizes)
+    return numpy.repeat(group_starts, block_sizes) + offsets % numpy.repeat(group_sizes, block_sizes)
+
+
 def compute_trades_pnl(reporting_currency, prices, trades):
     """
     Trades P&L by asset expressed in the reporting currency.
 
+    Fills are replayed by asset using the batch average cost engine, then positions are marked against prices on the
+    remaining timestamps.
+
     :param reporting_currency:
     :param prices:
     :param trades:
@@ -74,78 +94,66 @@ def compute_trades_pnl(reporting_currency, prices, trades):
     logging.debug('loaded orders:\n{}'.format(trades))
     if trades.empty:
         result = pandas.DataFrame({'asset': [], 'date': [], 'realized_pnl': [], 'total_pnl': [], 'unrealized_pnl': []})
+        result_filtered = result[['date', 'asset', 'total_pnl']]
+        pnl_by_currency = result_filtered.pivot_table(index='date', columns='asset', values='total_pnl')
+        return pnl_by_currency.ffill()
 
-    else:
-        trades = trades.set_index('date')
-        prices_selection = _select_prices(reporting_currency, prices)
-        prices_selection[reporting_currency] = 1
-        prices_selection = _include_indices(prices_selection, trades).ffill()
-        pnl_tracker = defaultdict(AverageCostProfitAndLoss)
-        pnl_data = list()
-        for timestamp, price_row in prices_selection.iterrows():
-            if timestamp in trades.index:
-                current_trades = trades.loc[timestamp]
-                for trade_ts, trade_row in current_trades.iterrows():
-                    fees = trade_row['fee']
-                    asset = trade_row['asset']
-                    fill_qty = float(trade_row['amount'])
-                    fill_price = price_row[asset]
-                    pnl_tracker[asset].add_fill(fill_qty, fill_price, fees)
-                    pnl_asset_data = {
-                        'date': trade_ts,
-                        'asset': asset,
-                        'unrealized_pnl': pnl_tracker[asset].get_unrealized_pnl(fill_price),
-                        'realized_pnl': pnl_tracker[asset].realized_pnl,
-                        'total_pnl': pnl_tracker[asset].get_total_pnl(fill_price),
-                    }
-                    pnl_data.append(pnl_asset_data)
-                    logging.info('*trade* added pnl data: {}'.format(pnl_asset_data))
-
-            else:
-                for asset in pnl_tracker:
-                    pnl_asset_data = {
-                        'date': timestamp,
-                        'asset': asset,
-                        'unrealized_pnl': pnl_tracker[asset].get_unrealized_pnl(price_row[asset]),
-                        'realized_pnl': pnl_tracker[asset].realized_pnl,
-                        'total_pnl': pnl_tracker[asset].get_total_pnl(price_row[asset]),
-                    }
-                    pnl_data.append(pnl_asset_data)
-                    logging.info('added pnl data: {}'.format(pnl_asset_data))
-
-        result = pandas.DataFrame(pnl_data)
-
-    result_filtered = result[['date', 'asset', 'total_pnl']]
-    pnl_by_currency = result_filtered.pivot_table(index='date', columns='asset', values='total_pnl')
+    trades = trades.sort_values('date', kind='mergesort')
+    prices_selection = _select_prices(reporting_currency, prices)
+    prices_selection[reporting_currency] = 1
+    price_dates = prices_selection.index.values
+    prices_selection = _include_indices(prices_selection, trades.set_index('date')).ffill()
+    prices_selection = prices_selection[~prices_selection.index.duplicated(keep='first')]
+    timestamps = prices_selection.index
+
+    replayed = trades.iloc[_replay_order(trades['date'].values, price_dates)]
+    price_rows = timestamps.get_indexer(replayed['date'])
+    price_columns = prices_selection.columns.get_indexer(replayed['asset'])
+    if (price_columns < 0).any():
+        missing_assets = set(replayed['asset'][price_columns < 0])
+        raise KeyError('missing prices for assets: {}'.format(missing_assets))
+
+    replayed = replayed.assign(price=prices_selection.values[price_rows, price_columns].astype(float))
+    is_trade_timestamp = timestamps.isin(replayed['date'])
+    pnl_data = dict()
+    for asset, fills in replayed.groupby('asset'):
+        fill_dates = fills['date'].values
+        fill_prices = fills['price'].values
+        quantities, costs, realized_pnls = replay_fills(fills['amount'].astype(float).values, fill_prices)
+
+        # positions held before each timestamp marked at current price, outside of trade timestamps
+        count_fills = numpy.searchsorted(fill_dates, timestamps.values, side='left')
+        latest = numpy.maximum(count_fills - 1, 0)
+        current_prices = prices_selection[asset].values.astype(float)
+        marked_pnl = realized_pnls[latest] + quantities[latest] * current_prices - costs[latest]
+        marked_pnl[(count_fills == 0) | is_trade_timestamp] = numpy.nan
+
+        # fills marked at fill price, averaged by timestamp
+        fills_pnl = pandas.Series(realized_pnls + quantities * fill_prices - costs, index=fill_dates)
+        fills_pnl = fills_pnl.groupby(level=0).mean()
+        marked_pnl[timestamps.get_indexer(fills_pnl.index)] = fills_pnl.values
+        pnl_data[asset] = marked_pnl
+
+    pnl_by_currency = pandas.DataFrame(pnl_data, index=timestamps)
+    pnl_by_currency = pnl_by_currency.dropna(how='all').dropna(axis=1, how='all').sort_index(axis=1)
+    pnl_by_currency.index.name = 'date'
+    pnl_by_currency.columns.name = 'asset'
     return pnl_by_currency.ffill()
 
 
 def breakdown_flows(balances_by_asset, balances):
     """
+    Tags each balance row with the flow segment it belongs to, a segment starting at a flow date and ending before
+    the next one.
 
-    :param balances_by_asset:
-    :param balances:
-    :return:
+    :param balances_by_asset: balances indexed by flow date
+    :param balances: DataFrame containing a 'date' column
+    :return: Series of segment ids aligned with balances, -1 for rows preceding the first flow
     """
     logging.info('flows:\n{}'.format(balances_by_asset))
-    flow_dates = balances_by_asset.reset_index()['date']
-    timespans = pandas.DataFrame({'start': flow_dates, 'end': flow_dates.shift(-1)}, columns=['start', 'end'])
-    balances_segments = list()
-    for index, timespan in timespans.iterrows():
-        start_date = timespan['start']
-        end_date = timespan['end']
-        logging.info('{} --> {}'.format(start_date, end_date))
-        if end_date == pandas.NaT:
-            timespan_filter = (balances['date'] >= start_date)
-
-        else:
-            timespan_filter = ((balances['date'] >= start_date)
-                               & (balances['date'] < end_date))
-
-        current_balances_by_asset = balances[timespan_filter]
-        balances_segments.append(current_balances_by_asset['Portfolio P&L'])
-
-    return balances_segments
+    flow_dates = balances_by_asset.index.sort_values().values
+    segment_ids = numpy.searchsorted(flow_dates, balances['date'].values, side='right') - 1
+    return pandas.Series(segment_ids, index=balances.index, name='segment')
 
 
 def compute_pnl(reporting_currency, flows, prices, trades):
@@ -165,18 +173,17 @@ def compute_pnl(reporting_currency, flows, prices, trades):
     balances_in_reporting_currency.reset_index(inplace=True)
 
     segments = breakdown_flows(balances_by_asset, balances_in_reporting_currency)
-    # linking segments and normalizing
-    previous_level = 1
-    normalized = pandas.Series()
-    for segment in segments:
-        if not segment.empty:
-            trades_pnl = compute_trades_pnl(reporting_currency, prices, trades)
-            logging.info('trades pnl for segment:\n{}'.format(trades_pnl))
-            logging.info('processing segment:\n{}'.format(segment))
-            current_normalized = segment * previous_level / segment.iloc[0]
-            normalized = normalized.append(current_normalized)
-            logging.info('normalized segment:\n{}'.format(current_normalized))
-            previous_level = current_normalized.iloc[-1]
+    # trades pnl does not depend on the segment: computed once for all segments
+    trades_pnl = compute_trades_pnl(reporting_currency, prices, trades)
+    logging.info('trades pnl:\n{}'.format(trades_pnl))
+    # linking segments and normalizing: each segment starts at the level where the previous one ended
+    in_segment = segments >= 0
+    portfolio_pnl = balances_in_reporting_currency.loc[in_segment, 'Portfolio P&L']
+    by_segment = portfolio_pnl.groupby(segments[in_segment])
+    segment_growth = by_segment.last() / by_segment.first()
+    segment_levels = segment_growth.cumprod().shift(1).fillna(1)
+    normalized = portfolio_pnl / by_segment.transform('first') * segments[in_segment].map(segment_levels)
+    logging.info('normalized segments:\n{}'.format(normalized))
 
     balances_in_reporting_currency['Portfolio P&L'] = normalized
     balances_in_reporting_currency['Portfolio P&L'].ffill(inplace=True)
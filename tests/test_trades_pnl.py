@@ -1,6 +1,9 @@
 import unittest
+import random
 
-from pnl import AverageCostProfitAndLoss
+import numpy
+
+from pnl import AverageCostProfitAndLoss, replay_fills
 
 
 class TestProfitAndLoss(unittest.TestCase):
@@ -163,5 +166,75 @@ class TestProfitAndLoss(unittest.TestCase):
         self.assertAlmostEqual(pos.realized_pnl, 1.989400 + 203. * (38.7950 - 38.8443))
         self.assertAlmostEqual(pos.get_unrealized_pnl(38.8443), 0.)
 
+    def test_batch_flip(self):
+        pos = AverageCostProfitAndLoss()
+        quantities, costs, realized_pnls = pos.add_fills([-100, -25, 50, 100, -25], [5.0, 5.5, 4., 4.75, 4.50])
+        self.assertSequenceEqual(quantities.tolist(), [-100, -125, -75, 25, 0])
+        self.assertAlmostEqual(-382.5, costs[2])
+        self.assertAlmostEqual(118.75, costs[3])
+        self.assertAlmostEqual(0., costs[4])
+        self.assertAlmostEqual(55.0, realized_pnls[2])
+        self.assertAlmostEqual(81.25, realized_pnls[3])
+        self.assertAlmostEqual(75., realized_pnls[4])
+        self.assertEqual(0, pos.quantity)
+        self.assertAlmostEqual(75., pos.realized_pnl)
+
+    def test_batch_stack(self):
+        pos = AverageCostProfitAndLoss()
+        pos.add_fill(1, 80.0)
+        pos.add_fills([-3, -2, 3], [102.0, 98.0, 90.0])
+        pos.add_fill(-2, 100.0)
+        self.assertEqual(-3, pos.quantity)
+        self.assertAlmostEqual(-300., pos.cost)
+        self.assertAlmostEqual(52., pos.realized_pnl)
+        self.assertAlmostEqual(49., pos.get_total_pnl(101.))
+
+    def test_batch_empty(self):
+        pos = AverageCostProfitAndLoss(10, 50., 3.)
+        quantities, costs, realized_pnls = pos.add_fills([], [])
+        self.assertEqual(0, len(quantities))
+        self.assertEqual(10, pos.quantity)
+        self.assertAlmostEqual(50., pos.cost)
+        self.assertAlmostEqual(3., pos.realized_pnl)
+
+    def test_batch_matches_scalar(self):
+        generator = random.Random(42)
+        fill_qtys = [generator.choice([-1, 1]) * generator.randint(1, 50) for _ in range(2000)]
+        fill_prices = [generator.uniform(50., 150.) for _ in range(2000)]
+        pos = AverageCostProfitAndLoss()
+        expected = list()
+        for fill_qty, fill_price in zip(fill_qtys, fill_prices):
+            pos.add_fill(fill_qty, fill_price)
+            expected.append((pos.quantity, pos.cost, pos.realized_pnl))
+
+        quantities, costs, realized_pnls = replay_fills(fill_qtys, fill_prices)
+        for count, (quantity, cost, realized_pnl) in enumerate(expected):
+            self.assertEqual(quantity, quantities[count])
+            self.assertAlmostEqual(cost, costs[count], places=6)
+            self.assertAlmostEqual(realized_pnl, realized_pnls[count], places=6)
+
+    def test_batch_many_partial_closes(self):
+        fill_qtys = [100]
+        fill_prices = [10.]
+        for count in range(200):
+            fill_qtys += [-99, 99]
+            fill_prices += [11., 10. + count * 0.01]
+
+        pos = AverageCostProfitAndLoss()
+        expected = list()
+        for fill_qty, fill_price in zip(fill_qtys, fill_prices):
+            pos.add_fill(fill_qty, fill_price)
+            expected.append((pos.quantity, pos.cost, pos.realized_pnl))
+
+        with numpy.errstate(all='raise'):
+            quantities, costs, realized_pnls = replay_fills(fill_qtys, fill_prices)
+
+        self.assertAlmostEqual(costs[-1], 1198.99, places=2)
+        self.assertAlmostEqual(realized_pnls[-1], 297.99, places=2)
+        for count, (quantity, cost, realized_pnl) in enumerate(expected):
+            self.assertEqual(quantity, quantities[count])
+            self.assertAlmostEqual(cost, costs[count], places=6)
+            self.assertAlmostEqual(realized_pnl, realized_pnls[count], places=6)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,11 +1,19 @@
 import unittest
 import logging
 import os
+import itertools
+
+import numpy
 import pandas
 
 from decimal import Decimal
 
-from arbitrage import calculate_arbitrage_opportunity
+from arbitrage import calculate_arbitrage_opportunity, find_triangles, scan_arbitrage_opportunities
+from arbitrage import scan_arbitrage_cycles, evaluate_arbitrage_opportunity, ArbitrageOpportunity
+from arbitrage import buy_currency_using_pair, sell_currency_using_pair
+from arbitrage import triangle_legs, evaluate_triangles
+from arbitrage import scan_arbitrage_depth
+from orderbook import BookSide
 
 
 def load_book_data(pair_code):
@@ -18,6 +26,102 @@ def load_book_data(pair_code):
     return pandas.read_pickle(bid_path), pandas.read_pickle(ask_path)
 
 
+def load_tradeable_pairs():
+    pair_codes = ['XETHXXBT', 'XETHZCAD', 'XXBTZCAD', 'XXRPXXBT', 'XXRPZCAD', 'XETHZJPY', 'XXBTZJPY', 'XXRPZJPY']
+    return pandas.DataFrame({'pair_code': pair_codes,
+                             'base': [pair_code[:4] for pair_code in pair_codes],
+                             'quote': [pair_code[4:] for pair_code in pair_codes]})
+
+
+def brute_force_triangles(tradeable_pairs):
+    assets = set(tradeable_pairs['base'].tolist()).union(tradeable_pairs['quote'].tolist())
+    available_pairs = set(tradeable_pairs['pair_code'].tolist())
+    triangles = set()
+    for common_leg, leg_pair1, leg_pair2 in itertools.permutations(assets, 3):
+        triangle = (leg_pair1 + leg_pair2, leg_pair1 + common_leg, leg_pair2 + common_leg)
+        if available_pairs.issuperset(triangle):
+            triangles.add(triangle)
+
+    return triangles
+
+
+def legacy_arbitrage_opportunity(pairs, pair_bids, pair_asks, skip_capped=True):
+    # previous implementation of calculate_arbitrage_opportunity, building frames for each permutation
+    results = list()
+    for first, second, third in itertools.permutations([0, 1, 2]):
+        currency_initial = pairs[first][4:]
+        if currency_initial in pairs[second]:
+            next_index, final_index = second, third
+
+        else:
+            next_index, final_index = third, second
+
+        next_pair = pairs[next_index]
+        if next_pair[:4] != currency_initial:
+            currency_next = next_pair[:4]
+
+        else:
+            currency_next = next_pair[4:]
+
+        balance_initial, trade_initial = buy_currency_using_pair(currency_initial, 1, pairs[first], pair_bids[first],
+                                                                 pair_asks[first])
+        balance_next, trade_next = sell_currency_using_pair(currency_initial, balance_initial[currency_initial],
+                                                            next_pair, pair_bids[next_index], pair_asks[next_index])
+        balance_final, trade_final = sell_currency_using_pair(currency_next, balance_next[currency_next],
+                                                              pairs[final_index], pair_bids[final_index],
+                                                              pair_asks[final_index])
+        balances = pandas.concat([pandas.Series(balance_initial, name='initial'),
+                                  pandas.Series(balance_next, name='next'),
+                                  pandas.Series(balance_final, name='final')], axis=1)
+        trades_df = pandas.DataFrame([trade_initial, trade_next, trade_final])
+        if not skip_capped or trades_df['capped'].count() == 0:
+            results.append((trades_df, balances.sum(axis=1)))
+
+    return results
+
+
+def depth_books():
+    # AAAA -> BBBB -> CCCC -> AAAA is profitable on the first levels only
+    pair_codes = ['AAAABBBB', 'BBBBCCCC', 'AAAACCCC']
+    tradeable_pairs = pandas.DataFrame({'pair_code': pair_codes,
+                                        'base': [pair_code[:4] for pair_code in pair_codes],
+                                        'quote': [pair_code[4:] for pair_code in pair_codes]})
+    levels = {'AAAABBBB': ([(2.0, 1.), (1.9, 5.), (1.5, 100.)], [(2.1, 1.), (2.2, 5.), (2.5, 100.)]),
+              'BBBBCCCC': ([(3.0, 2.), (2.9, 10.), (2.5, 100.)], [(3.1, 2.), (3.2, 10.), (3.5, 100.)]),
+              'AAAACCCC': ([(5.3, 1.), (5.2, 3.), (4.5, 100.)], [(5.5, 1.), (5.6, 3.), (6.5, 100.)])}
+    books = {pair_code: tuple(pandas.DataFrame(side, columns=['price', 'volume']) for side in sides)
+             for pair_code, sides in levels.items()}
+    return tradeable_pairs, lambda pair_code: books[pair_code]
+
+
+def walk_book(levels, amount, sells_base):
+    received = 0.
+    for price, volume in levels:
+        if sells_base:
+            traded = min(amount, volume)
+            received += traded * price
+            amount -= traded
+
+        else:
+            traded = min(amount, volume * price)
+            received += traded / price
+            amount -= traded
+
+    return received
+
+
+def cycle_books(bid_price, ask_price):
+    # AAAA -> BBBB -> CCCC -> DDDD -> AAAA selling each base at the bid
+    pair_codes = ['AAAABBBB', 'BBBBCCCC', 'CCCCDDDD', 'DDDDAAAA', 'AAAACCCC']
+    tradeable_pairs = pandas.DataFrame({'pair_code': pair_codes,
+                                        'base': [pair_code[:4] for pair_code in pair_codes],
+                                        'quote': [pair_code[4:] for pair_code in pair_codes]})
+    books = {pair_code: (pandas.Series({'price': bid_price, 'volume': 100.}),
+                         pandas.Series({'price': ask_price, 'volume': 100.})) for pair_code in pair_codes}
+    books['AAAACCCC'] = (pandas.Series({'price': 0.9, 'volume': 100.}), pandas.Series({'price': 1.2, 'volume': 100.}))
+    return tradeable_pairs, lambda pair_code: books[pair_code]
+
+
 class TestBittrexAPI(unittest.TestCase):
     """
     Testing P&L calculation from Bittrex.
@@ -36,6 +140,203 @@ class TestBittrexAPI(unittest.TestCase):
         self.assertAlmostEqual(balances['XETH'], -4.261700e-06, places=10)
         self.assertEqual(trades[trades['pair'] == 'XXBTZCAD'].iloc[0]['price'], Decimal("2902.99400"))
 
+    def test_parity(self):
+        for triangle in find_triangles(load_tradeable_pairs()):
+            books = [load_book_data(pair_code) for pair_code in triangle]
+            bids = [bid for bid, ask in books]
+            asks = [ask for bid, ask in books]
+            for skip_capped in (True, False):
+                expected = legacy_arbitrage_opportunity(triangle, bids, asks, skip_capped=skip_capped)
+                opportunities = calculate_arbitrage_opportunity(triangle[0], bids[0], asks[0], triangle[1], bids[1],
+                                                                asks[1], triangle[2], bids[2], asks[2],
+                                                                skip_capped=skip_capped)
+                self.assertEqual(len(opportunities), len(expected))
+                for (trades, balances), (expected_trades, expected_balances) in zip(opportunities, expected):
+                    pandas.testing.assert_frame_equal(trades, expected_trades)
+                    pandas.testing.assert_series_equal(balances, expected_balances)
+
+    def test_parity_floats(self):
+        generator = numpy.random.RandomState(0)
+        triangle = ('XETHXXBT', 'XETHZCAD', 'XXBTZCAD')
+        for _ in range(20):
+            mids = [0.09, 290., 2900.] * generator.uniform(0.98, 1.02, 3)
+            bids = [pandas.Series({'price': mid * 0.999, 'volume': volume})
+                    for mid, volume in zip(mids, generator.uniform(0.01, 50., 3))]
+            asks = [pandas.Series({'price': mid * 1.001, 'volume': volume})
+                    for mid, volume in zip(mids, generator.uniform(0.01, 50., 3))]
+            expected = legacy_arbitrage_opportunity(triangle, bids, asks, skip_capped=False)
+            opportunities = evaluate_arbitrage_opportunity(triangle, [(bid['price'], bid['volume']) for bid in bids],
+                                                           [(ask['price'], ask['volume']) for ask in asks],
+                                                           skip_capped=False)
+            self.assertEqual(len(opportunities), len(expected))
+            for opportunity, (expected_trades, expected_balances) in zip(opportunities, expected):
+                self.assertEqual(opportunity.capped, expected_trades['capped'].count() > 0)
+                for currency, amount in expected_balances.items():
+                    self.assertAlmostEqual(opportunity.balance(currency), amount, places=12)
+
+                trades, balances = opportunity.to_frames()
+                pandas.testing.assert_frame_equal(trades, expected_trades)
+                pandas.testing.assert_series_equal(balances, expected_balances)
+
+    def test_evaluate_triangles(self):
+        generator = numpy.random.RandomState(1)
+        tradeable_pairs = load_tradeable_pairs()
+        pair_codes = tradeable_pairs['pair_code'].tolist()
+        triangles = find_triangles(tradeable_pairs)
+        legs, sells_base = triangle_legs(pair_codes, triangles)
+        self.assertEqual(legs.shape, (6 * len(triangles), 3))
+        mids = numpy.array([0.09, 290., 2900., 0.00008, 0.25, 25000., 250000., 20.])
+        for _ in range(10):
+            bid_prices = mids * generator.uniform(0.98, 1.0, len(mids))
+            ask_prices = mids * generator.uniform(1.0, 1.02, len(mids))
+            bid_volumes = generator.uniform(0.01, 1000., len(mids))
+            ask_volumes = generator.uniform(0.01, 1000., len(mids))
+            balances, capped = evaluate_triangles(bid_prices, bid_volumes, ask_prices, ask_volumes, legs, sells_base)
+            for count, triangle in enumerate(triangles):
+                positions = [pair_codes.index(pair_code) for pair_code in triangle]
+                opportunities = evaluate_arbitrage_opportunity(
+                    triangle, [(bid_prices[position], bid_volumes[position]) for position in positions],
+                    [(ask_prices[position], ask_volumes[position]) for position in positions], skip_capped=False)
+                for permutation, opportunity in enumerate(opportunities):
+                    row = 6 * count + permutation
+                    trades = opportunity.trades
+                    self.assertEqual([trade[1] for trade in trades], [pair_codes[leg] for leg in legs[row]])
+                    self.assertEqual(capped[row], opportunity.capped)
+                    currency_initial = trades[0][1][4:]
+                    currency_next = ({trades[1][1][:4], trades[1][1][4:]} - {currency_initial}).pop()
+                    currencies = [trades[0][1][:4], currency_initial, currency_next]
+                    for currency, balance in zip(currencies, balances[row]):
+                        self.assertAlmostEqual(opportunity.balance(currency), balance, places=9)
+
+    def test_scan_table(self):
+        tradeable_pairs = load_tradeable_pairs()
+        table = scan_arbitrage_opportunities(tradeable_pairs, load_book_data, mode='table')
+        self.assertEqual(table.shape[0], 12)
+        self.assertTrue(table['return'].is_monotonic_decreasing)
+        row = table[(table['pair_1'] == 'XETHZCAD') & (table['pair_2'] == 'XXBTZCAD')].iloc[0]
+        self.assertFalse(row['capped'])
+        self.assertEqual(row['currency'], 'XETH')
+        self.assertAlmostEqual(row['balance'], -4.261700e-06, places=10)
+
+    def test_scan_modes(self):
+        tradeable_pairs = load_tradeable_pairs()
+        records = scan_arbitrage_opportunities(tradeable_pairs, load_book_data, mode='records')
+        self.assertIsInstance(records[0][0], ArbitrageOpportunity)
+        legacy = scan_arbitrage_opportunities(tradeable_pairs, load_book_data, as_frames=False)
+        self.assertSequenceEqual([len(opportunities) for opportunities in legacy],
+                                 [len(opportunities) for opportunities in records])
+        self.assertRaises(ValueError, scan_arbitrage_opportunities, tradeable_pairs, load_book_data, mode='tabel')
+
+    def test_depth_sizing(self):
+        tradeable_pairs, order_book_callback = depth_books()
+        table, sizings = scan_arbitrage_depth(tradeable_pairs, order_book_callback)
+        self.assertEqual(table.shape[0], 3)
+        best = sizings[0]
+        self.assertEqual(best.pairs, ('AAAABBBB', 'BBBBCCCC', 'AAAACCCC'))
+        self.assertEqual(table.iloc[0]['currency'], 'AAAA')
+        self.assertAlmostEqual(table.iloc[0]['balance'], best.profit)
+
+        # brute force over the amount of AAAA sold
+        books = [order_book_callback(pair_code) for pair_code in best.pairs]
+        sides = [list(zip(bids['price'], bids['volume'])) if sells_base else list(zip(asks['price'], asks['volume']))
+                 for (bids, asks), sells_base in zip(books, best.sells_base)]
+        profits = list()
+        for volume in numpy.linspace(0., 20., 20001):
+            amount = volume
+            for levels, sells_base in zip(sides, best.sells_base):
+                amount = walk_book(levels, amount, sells_base)
+
+            profits.append(amount - volume)
+
+        self.assertGreaterEqual(best.profit, max(profits) - 1e-12)
+        self.assertAlmostEqual(best.profit, max(profits), places=4)
+        self.assertAlmostEqual(best.volume, numpy.linspace(0., 20., 20001)[numpy.argmax(profits)], delta=0.01)
+        # walking two levels of the AAAACCCC asks
+        self.assertTrue(5.5 < best.prices[2] < 5.6)
+
+        trades, balances = best.to_frames()
+        self.assertAlmostEqual(balances['AAAA'], best.profit, places=10)
+        self.assertAlmostEqual(balances['BBBB'], 0., places=10)
+        self.assertAlmostEqual(balances['CCCC'], 0., places=10)
+        self.assertEqual(trades['direction'].tolist(), ['buy', 'buy', 'sell'])
+        self.assertEqual(trades['capped'].count(), 0)
+        self.assertAlmostEqual(trades['price'].iloc[0], best.amounts[1] / best.amounts[0])
+
+    def test_depth_sizing_compact_books(self):
+        tradeable_pairs, order_book_callback = depth_books()
+
+        def compact_order_book_callback(pair_code):
+            return tuple(BookSide(side['price'], side['volume'], numpy.zeros(side.shape[0]))
+                         for side in order_book_callback(pair_code))
+
+        table, sizings = scan_arbitrage_depth(tradeable_pairs, order_book_callback)
+        compact_table, compact_sizings = scan_arbitrage_depth(tradeable_pairs, compact_order_book_callback)
+        pandas.testing.assert_frame_equal(compact_table, table)
+
+    def test_depth_sizing_losing(self):
+        tradeable_pairs, order_book_callback = depth_books()
+        table, sizings = scan_arbitrage_depth(tradeable_pairs, order_book_callback, fee=0.05)
+        self.assertTrue((table['volume'] == 0.).all())
+        self.assertTrue((table['balance'] == 0.).all())
+
+    def test_find_triangles(self):
+        triangles = find_triangles(load_tradeable_pairs())
+        self.assertEqual(len(triangles), 4)
+        self.assertIn(('XETHXXBT', 'XETHZCAD', 'XXBTZCAD'), triangles)
+        self.assertIn(('XXRPXXBT', 'XXRPZJPY', 'XXBTZJPY'), triangles)
+
+    def test_find_triangles_synthetic(self):
+        generator = numpy.random.RandomState(0)
+        assets = ['A{:03d}'.format(count) for count in range(40)]
+        pairs = set(tuple(generator.choice(assets, 2, replace=False)) for _ in range(200))
+        tradeable_pairs = pandas.DataFrame([{'pair_code': base + quote, 'base': base, 'quote': quote}
+                                            for base, quote in pairs])
+        triangles = find_triangles(tradeable_pairs)
+        self.assertEqual(len(triangles), len(set(triangles)))
+        self.assertEqual(set(triangles), brute_force_triangles(tradeable_pairs))
+
+    def test_scan(self):
+        def order_book_callback(pair_code):
+            return load_book_data(pair_code)
+
+        tradeable_pairs = load_tradeable_pairs()
+        triangles = find_triangles(tradeable_pairs)
+        results = scan_arbitrage_opportunities(tradeable_pairs, order_book_callback, triangles=triangles)
+        self.assertEqual(len(results), 4)
+        index = triangles.index(('XETHXXBT', 'XETHZCAD', 'XXBTZCAD'))
+        trades, balances = results[index][0]
+        self.assertAlmostEqual(balances['XETH'], -4.261700e-06, places=10)
+
+    def test_cycles(self):
+        tradeable_pairs, order_book_callback = cycle_books(1.01, 1.02)
+        results = scan_arbitrage_cycles(tradeable_pairs, order_book_callback, max_length=4)
+        self.assertEqual(len(results), 1)
+        trades, balances = results[0]
+        self.assertEqual(trades['pair'].tolist(), ['AAAABBBB', 'BBBBCCCC', 'CCCCDDDD', 'DDDDAAAA'])
+        self.assertAlmostEqual(balances['AAAA'], 1.01 ** 4 - 1., places=10)
+        self.assertAlmostEqual(balances['BBBB'], 0., places=10)
+        self.assertAlmostEqual(balances['DDDD'], 0., places=10)
+
+    def test_cycles_max_length(self):
+        tradeable_pairs, order_book_callback = cycle_books(1.01, 1.02)
+        self.assertEqual(scan_arbitrage_cycles(tradeable_pairs, order_book_callback, max_length=3), [])
+
+    def test_cycles_fees(self):
+        tradeable_pairs, order_book_callback = cycle_books(1.01, 1.02)
+        self.assertEqual(scan_arbitrage_cycles(tradeable_pairs, order_book_callback, fee=0.01), [])
+        results = scan_arbitrage_cycles(tradeable_pairs, order_book_callback, fee=0.001)
+        trades, balances = results[0]
+        self.assertAlmostEqual(balances['AAAA'], (1.01 * 0.999) ** 4 - 1., places=10)
+        self.assertAlmostEqual(trades['fee'].iloc[0], 1.01 * 0.001, places=10)
+
+    def test_cycles_fixtures(self):
+        def order_book_callback(pair_code):
+            return load_book_data(pair_code)
+
+        # the fixture triangles are all losing
+        results = scan_arbitrage_cycles(load_tradeable_pairs(), order_book_callback, max_length=3, skip_capped=False)
+        self.assertEqual(results, [])
+
     def tearDown(self):
         pass
 
@@ -2,10 +2,72 @@ import unittest
 import logging
 import os
 import json
+import tempfile
+import threading
+from unittest import mock
 
+from datetime import datetime, timedelta
 from decimal import Decimal
 
-from exchanges.bittrex import parse_trades, parse_flows
+import pandas
+
+from exchanges import bittrex
+from exchanges.bittrex import parse_trades, parse_flows, sync_ledger
+from ledgerstore import LedgerStore
+
+
+def _parse_trades_by_row(order_history):
+    """
+    Reference order by order parsing of trades.
+    """
+    parsed = list()
+    for order in order_history:
+        pair = order['Exchange'].split('-')
+        sign = -1 if 'SELL' in order['OrderType'] else 1
+        date = datetime.strptime(order['TimeStamp'], '%Y-%m-%dT%H:%M:%S.%f')
+        parsed.append({'date': date, 'asset': pair[0], 'amount': order['Price'] * -1 * sign,
+                       'fee': Decimal(order['Commission']), 'exchange': 'bittrex'})
+        traded_qty = order['Quantity'] - order['QuantityRemaining']
+        parsed.append({'date': date, 'asset': pair[1], 'amount': traded_qty * sign,
+                       'fee': 0., 'exchange': 'bittrex'})
+
+    return pandas.DataFrame(parsed)[['date', 'asset', 'amount', 'fee', 'exchange']]
+
+
+class FakeResponse(object):
+
+    def __init__(self, result):
+        self._text = json.dumps({'success': True, 'message': '', 'result': result})
+        self.decodes = 0
+
+    def json(self, parse_float=None):
+        self.decodes += 1
+        return json.loads(self._text, parse_float=parse_float)
+
+
+class FakeSession(object):
+    """
+    Serves the recorded histories, each request waiting for the others to be sent.
+    """
+
+    def __init__(self, histories, barrier):
+        self._histories = histories
+        self._barrier = barrier
+        self._lock = threading.Lock()
+        self.responses = list()
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def send(self, prepared_request):
+        # only passes once all the histories are being fetched at the same time
+        self._barrier.wait()
+        method = prepared_request.path_url.split('?')[0].replace('/api/v1.1', '')
+        response = FakeResponse(self._histories[method])
+        with self._lock:
+            self.responses.append(response)
+
+        return response
 
 
 class TestBittrexAPI(unittest.TestCase):
@@ -34,6 +96,69 @@ class TestBittrexAPI(unittest.TestCase):
         self.assertAlmostEqual(float(trades[trades['asset'] == 'BTC']['amount'].sum()), 0.01968424)
         self.assertAlmostEqual(float(flows[flows['asset'] == 'NEOS']['amount'].sum()), 0.09736144)
 
+    def test_parsing_parity(self):
+        orders = list(self._example_order_hist)
+        start = datetime(2017, 7, 1, 12, 30)
+        for count in range(50):
+            order = dict(self._example_order_hist[count % 2])
+            order['Exchange'] = ['BTC-XRP', 'ETH-NEO', 'USDT-BTC'][count % 3]
+            order['OrderType'] = ['LIMIT_BUY', 'LIMIT_SELL'][count % 2]
+            order['TimeStamp'] = (start + timedelta(seconds=count * 3607.25)).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
+            order['Quantity'] = Decimal('12.50000000') * (count + 1)
+            order['QuantityRemaining'] = Decimal('0E-8') if count % 4 else Decimal('2.25000000')
+            order['Commission'] = Decimal('0.00001234') * count
+            order['Price'] = Decimal('0.00000000') if count == 7 else Decimal('0.01968424') * (count + 1)
+            orders.append(order)
+
+        trades = parse_trades(orders)
+        expected = _parse_trades_by_row(orders)
+        pandas.testing.assert_frame_equal(trades, expected)
+        for column in ('amount', 'fee'):
+            self.assertSequenceEqual([(type(value), str(value)) for value in trades[column]],
+                                     [(type(value), str(value)) for value in expected[column]])
+
+        self.assertTrue(parse_trades([]).empty)
+
+    def test_retrieve_data(self):
+        with open(os.sep.join(['tests-data', 'bittrex-withdrawals.json'])) as withdrawals_file, \
+                open(os.sep.join(['tests-data', 'bittrex-deposits.json'])) as deposits_file, \
+                open(os.sep.join(['tests-data', 'bittrex-getorderhist.json'])) as orders_file:
+            histories = {'/account/getwithdrawalhistory': json.load(withdrawals_file),
+                         '/account/getdeposithistory': json.load(deposits_file),
+                         '/account/getorderhistory': json.load(orders_file)}
+
+        session = FakeSession(histories, threading.Barrier(3, timeout=10))
+        with mock.patch('exchanges.bittrex.requests.Session', lambda: session), \
+                mock.patch('exchanges.bittrex.parse_flows', wraps=bittrex.parse_flows) as parse_flows_mock, \
+                mock.patch('exchanges.bittrex.parse_trades', wraps=bittrex.parse_trades) as parse_trades_mock:
+            flows, trades, currencies = bittrex.retrieve_data('key', 'secret')
+
+        self.assertEqual([response.decodes for response in session.responses], [1, 1, 1])
+        self.assertEqual(parse_flows_mock.call_count, 1)
+        self.assertEqual(parse_trades_mock.call_count, 1)
+        self.assertEqual(flows['amount'].tolist(), parse_flows(self._example_withdrawals,
+                                                               self._example_deposits)['amount'].tolist())
+        self.assertIsInstance(trades['amount'].iloc[0], Decimal)
+        self.assertEqual(currencies, set(flows['asset']).union(trades['asset']))
+
+    def test_sync_ledger(self):
+        with tempfile.TemporaryDirectory() as store_path:
+            store = LedgerStore(store_path)
+            older_orders = self._example_order_hist[1:]
+            ledger = sync_ledger(store, [], self._example_deposits, older_orders)
+            self.assertEqual(len(ledger), len(self._example_deposits) + 2 * len(older_orders))
+            high_water_mark = store.high_water_mark('bittrex')
+            self.assertEqual(high_water_mark, ledger['date'].max())
+
+            # syncing again the full history only adds the new entries
+            ledger = sync_ledger(LedgerStore(store_path), self._example_withdrawals, self._example_deposits,
+                                 self._example_order_hist)
+            count_entries = len(self._example_withdrawals) + len(self._example_deposits)
+            count_entries += 2 * len(self._example_order_hist)
+            self.assertEqual(len(ledger), count_entries)
+            self.assertEqual(len(ledger.drop_duplicates(subset=['entry_id', 'asset'])), count_entries)
+            self.assertAlmostEqual(ledger[ledger['asset'] == 'NEOS']['amount'].sum(), 0.09736144)
+
     def tearDown(self):
         self._example_balances_file.close()
         self._example_order_hist_file.close()
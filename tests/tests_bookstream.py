@@ -0,0 +1,108 @@
+import unittest
+import logging
+import os
+import threading
+
+import pandas
+
+from arbitrage import find_triangles
+from bookstream import BookStream, OrderBook, iter_recorded_messages, iter_socket_messages, create_replay_server
+
+_PAIR_CODES = {'ETH/XBT': 'XETHXXBT', 'ETH/CAD': 'XETHZCAD', 'XBT/CAD': 'XXBTZCAD', 'XRP/XBT': 'XXRPXXBT',
+               'XRP/CAD': 'XXRPZCAD'}
+
+
+def load_triangles():
+    pair_codes = sorted(_PAIR_CODES.values())
+    tradeable_pairs = pandas.DataFrame({'pair_code': pair_codes,
+                                        'base': [pair_code[:4] for pair_code in pair_codes],
+                                        'quote': [pair_code[4:] for pair_code in pair_codes]})
+    return find_triangles(tradeable_pairs)
+
+
+def load_messages():
+    return list(iter_recorded_messages(os.sep.join(['tests-data', 'kraken-book-feed.jsonl'])))
+
+
+class TestBookStream(unittest.TestCase):
+    """
+    Testing order books maintained from a recorded feed.
+    """
+
+    def setUp(self):
+        self._messages = load_messages()
+        self._stream = BookStream(load_triangles(), depth=3, pair_codes=_PAIR_CODES)
+
+    def test_order_book(self):
+        book = OrderBook(depth=2)
+        book.apply('bids', [['10.0', '1.0', '1.0'], ['9.0', '2.0', '1.0'], ['8.0', '3.0', '1.0']])
+        book.apply('asks', [['11.0', '1.0', '2.0']])
+        self.assertEqual(book.levels('bids'), [(10., 1.), (9., 2.)])
+        book.apply('bids', [['10.0', '0.0', '3.0'], ['9.5', '4.0', '3.0']])
+        self.assertEqual(book.best_bid(), (9.5, 4.))
+        self.assertEqual(book.best_ask(), (11., 1.))
+        self.assertEqual(book.timestamp, 3.)
+
+    def test_snapshots(self):
+        results = [self._stream.on_message(message) for message in self._messages[:7]]
+        self.assertIsNone(results[0])
+        self.assertIsNone(results[6])
+        self.assertEqual(sorted(self._stream.books), sorted(_PAIR_CODES.values()))
+        self.assertEqual(self._stream.books['XETHZCAD'].best_bid(), (265., 50.))
+        # no opportunity in the snapshots, each triangle being evaluated once complete
+        self.assertEqual([result[1] for result in results[1:6]], [[]] * 5)
+        self.assertEqual(self._stream.evaluations, 2)
+
+    def test_updates(self):
+        for message in self._messages[:7]:
+            self._stream.on_message(message)
+
+        # XXBTZCAD belongs to both triangles
+        pair_code, opportunities = self._stream.on_message(self._messages[7])
+        self.assertEqual(pair_code, 'XXBTZCAD')
+        self.assertEqual(self._stream.evaluations, 4)
+        self.assertEqual(self._stream.books['XXBTZCAD'].best_bid(), (2901., 5.))
+        self.assertEqual(self._stream.books['XXBTZCAD'].levels('bids')[-1], (2899., 20.))
+
+        # crossing ETH/CAD bid above the implied ask through XBT
+        pair_code, opportunities = self._stream.on_message(self._messages[8])
+        self.assertEqual(self._stream.evaluations, 5)
+        self.assertEqual(len(opportunities), 1)
+        triangle, opportunity = opportunities[0]
+        self.assertEqual(triangle, ('XETHXXBT', 'XETHZCAD', 'XXBTZCAD'))
+        self.assertEqual([trade[1] for trade in opportunity.trades], ['XETHZCAD', 'XXBTZCAD', 'XETHXXBT'])
+        self.assertGreater(opportunity.balance('XETH'), 0.)
+
+        # level removed, ask update crossing the other way
+        pair_code, opportunities = self._stream.on_message(self._messages[9])
+        self.assertEqual(self._stream.books['XETHZCAD'].best_bid(), (265., 50.))
+        self.assertEqual(self._stream.books['XETHZCAD'].best_ask(), (265.5, 30.))
+        # same cycle starting from XETH and from XXBT
+        self.assertEqual(len(opportunities), 2)
+        self.assertEqual(set(opportunity.trades[0][1] for triangle, opportunity in opportunities),
+                         {'XETHXXBT', 'XXBTZCAD'})
+
+    def test_replay_server(self):
+        server = create_replay_server(self._messages)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        try:
+            host, port = server.server_address
+            messages = list(iter_socket_messages(host, port))
+
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(messages, self._messages)
+        results = [self._stream.on_message(message) for message in messages]
+        self.assertEqual(len(results[8][1]), 1)
+
+    def tearDown(self):
+        pass
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    unittest.main()
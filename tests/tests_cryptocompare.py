@@ -0,0 +1,210 @@
+import unittest
+import logging
+import json
+import os
+import shutil
+import threading
+import time
+import tempfile
+import urllib.parse
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from unittest import mock
+from datetime import datetime
+
+import pandas
+
+import cryptocompare
+from pricestore import PriceStore
+
+
+class StubCryptoCompareServer(ThreadingMixIn, HTTPServer):
+    """
+    Local HTTP server answering CryptoCompare requests with deterministic prices.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubCryptoCompareHandler)
+        self.requests_log = list()
+        self.failures = dict()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://{}:{}/data'.format(*self.server_address)
+
+
+_INTERVALS = {'histominute': 60, 'histohour': 3600, 'histoday': 86400}
+
+
+def stub_price(from_currency, to_currency, timestamp=0):
+    return float(len(from_currency) * 100 + len(to_currency) * 10) + timestamp / 1e9
+
+
+class StubCryptoCompareHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        endpoint = url.path.split('/')[-1]
+        params = dict(urllib.parse.parse_qsl(url.query))
+        with self.server.lock:
+            self.server.requests_log.append((endpoint, params))
+            key = (endpoint, params.get('fsym', params.get('fsyms')))
+            failing = self.server.failures.get(key, 0)
+            if failing > 0:
+                self.server.failures[key] = failing - 1
+
+        if failing > 0:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        if endpoint == 'pricemulti':
+            body = {from_currency: {to_currency: stub_price(from_currency, to_currency)
+                                    for to_currency in params['tsyms'].split(',')}
+                    for from_currency in params['fsyms'].split(',')}
+
+        else:
+            limit = int(params['limit'])
+            interval = _INTERVALS[endpoint]
+            last_timestamp = int(params.get('toTs', time.time())) // interval * interval
+            timestamps = [last_timestamp - interval * (limit - count) for count in range(limit + 1)]
+            body = {'Data': [{'time': timestamp, 'close': stub_price(params['fsym'], params['tsym'], timestamp)}
+                             for timestamp in timestamps]}
+
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestCryptoCompareLoader(unittest.TestCase):
+    """
+    Testing concurrent prices loading against a local stub server.
+    """
+
+    def setUp(self):
+        self._server = StubCryptoCompareServer()
+        self._server_thread = threading.Thread(target=self._server.serve_forever)
+        self._server_thread.start()
+        self._url_patch = mock.patch('cryptocompare._BASE_CRYPTO_COMPARE_URL', self._server.url)
+        self._url_patch.start()
+        self._pairs = [('XRP', 'BTC'), ('LTC', 'BTC'), ('ETH', 'BTC'), ('XRP', 'USD'), ('LTC', 'USD'), ('ETH', 'USD'),
+                       ('STRAT', 'EUR'), ('NEOS', 'EUR')]
+
+    def test_histo_daily(self):
+        prices = cryptocompare.load_pairs_histo_daily(self._pairs, 'CCCAGG', max_workers=4)
+        self.assertSequenceEqual(prices.columns.tolist(), ('currency', 'date', 'price'))
+        self.assertEqual(len(prices), 401 * len(self._pairs))
+        self.assertEqual(len(self._server.requests_log), len(self._pairs))
+        strat_prices = prices[prices['currency'] == 'STRAT/EUR']
+        first_timestamp = strat_prices['date'].iloc[0].to_pydatetime().timestamp()
+        self.assertAlmostEqual(strat_prices['price'].iloc[0], stub_price('STRAT', 'EUR', first_timestamp))
+
+    def test_retries(self):
+        self._server.failures[('histohour', 'LTC')] = 2
+        prices = cryptocompare.load_pairs_histo_hourly(self._pairs, 'CCCAGG', max_workers=4)
+        self.assertEqual(len(prices), 1001 * len(self._pairs))
+        self.assertEqual(len(self._server.requests_log), len(self._pairs) + 2)
+
+    def test_spot(self):
+        prices = cryptocompare.load_pairs_spot(self._pairs, 'CCCAGG')
+        self.assertSequenceEqual(sorted(prices['currency'].tolist()),
+                                 sorted('/'.join(pair) for pair in self._pairs))
+        xrp_usd = prices[prices['currency'] == 'XRP/USD']['price'].iloc[0]
+        self.assertAlmostEqual(xrp_usd, stub_price('XRP', 'USD'))
+        # (ETH, LTC, XRP) x (BTC, USD) and (NEOS, STRAT) x (EUR)
+        self.assertEqual(len(self._server.requests_log), 2)
+
+    def test_spot_cross_product(self):
+        currencies = ['LTC', 'XRP', 'START', 'NEOS', 'STRAT', 'DASH', 'ZEC', 'XMR']
+        reference_currencies = ['USD', 'EUR', 'BTC', 'ETH']
+        prices = cryptocompare.load_crypto_compare_data(currencies, reference_currencies, 'CCCAGG', time_scale='spot')
+        self.assertEqual(len(prices.columns), 1 + len(currencies) * len(reference_currencies) + 4 * 3)
+        # one request for the currencies and one for each reference currency
+        self.assertEqual(len(self._server.requests_log), 1 + len(reference_currencies))
+        for endpoint, params in self._server.requests_log:
+            self.assertEqual(endpoint, 'pricemulti')
+
+    def test_cross_product(self):
+        prices = cryptocompare.load_crypto_compare_data(['XRP', 'LTC'], ['BTC', 'USD'], 'CCCAGG', time_scale='day')
+        self.assertSequenceEqual(sorted(prices.columns.tolist()),
+                                 ['BTC/USD', 'LTC/BTC', 'LTC/USD', 'USD/BTC', 'XRP/BTC', 'XRP/USD', 'date'])
+        self.assertEqual(len(prices), 401)
+
+    def test_incremental_store(self):
+        with tempfile.TemporaryDirectory() as store_path:
+            store = PriceStore(store_path)
+            prices = cryptocompare.load_crypto_compare_data(['XRP'], ['BTC'], 'CCCAGG', time_scale='hour',
+                                                            store=store)
+            self.assertEqual(len(prices), 1001)
+            self.assertSequenceEqual([params['limit'] for endpoint, params in self._server.requests_log],
+                                     ['1000'])
+            last_timestamp = store.last_timestamp(('XRP', 'BTC'), 'CCCAGG', 'hour')
+            self.assertEqual(last_timestamp, prices['date'].iloc[-1])
+
+            # only the latest points are requested again
+            del self._server.requests_log[:]
+            store = PriceStore(store_path)
+            prices = cryptocompare.load_crypto_compare_data(['XRP'], ['BTC'], 'CCCAGG', time_scale='hour',
+                                                            store=store)
+            self.assertIn(len(prices), (1001, 1002))
+            for endpoint, params in self._server.requests_log:
+                self.assertLessEqual(int(params['limit']), 2)
+
+    def test_store_extends_history(self):
+        with tempfile.TemporaryDirectory() as store_path:
+            store = PriceStore(store_path)
+            old_prices = cryptocompare.load_pairs_histo_daily([('XRP', 'BTC')], 'CCCAGG')
+            old_prices['date'] = old_prices['date'] - pandas.Timedelta(days=1000)
+            store.append(old_prices, 'CCCAGG', 'day')
+            store.append(cryptocompare.load_pairs_histo_daily([('XRP', 'BTC')], 'CCCAGG'), 'CCCAGG', 'day')
+            stored = store.load([('XRP', 'BTC')], 'CCCAGG', 'day')
+            self.assertEqual(len(stored), 2 * 401)
+            self.assertTrue(stored['date'].is_monotonic_increasing)
+
+    def test_backfill_resumes(self):
+        with tempfile.TemporaryDirectory() as store_path:
+            store = PriceStore(store_path)
+            pairs = [('XRP', 'BTC'), ('LTC', 'BTC')]
+            start_date = datetime.fromtimestamp(time.time() - 3 * 86400)
+            count_chunks = cryptocompare.backfill_pairs_histo(pairs, 'CCCAGG', 'hour', start_date, store,
+                                                              chunk_points=24)
+            # three completed days and the current one for each pair
+            self.assertEqual(count_chunks, 8)
+            self.assertEqual(len(self._server.requests_log), 8)
+            stored = store.load(pairs, 'CCCAGG', 'hour')
+            for currency, prices in stored.groupby('currency'):
+                self.assertLessEqual(prices['date'].iloc[0], start_date)
+                self.assertTrue((prices['date'].diff().dropna() == pandas.Timedelta(hours=1)).all())
+
+            # only the current day is requested again
+            del self._server.requests_log[:]
+            count_chunks = cryptocompare.backfill_pairs_histo(pairs, 'CCCAGG', 'hour', start_date, store,
+                                                              chunk_points=24)
+            self.assertEqual(count_chunks, 2)
+
+            # a chunk missing after an interruption is requested again
+            del self._server.requests_log[:]
+            chunks_path = os.sep.join([store_path, 'CCCAGG', 'hour', 'XRP-BTC.chunks'])
+            shutil.rmtree(os.sep.join([chunks_path, sorted(os.listdir(chunks_path))[0]]))
+            count_chunks = cryptocompare.backfill_pairs_histo(pairs, 'CCCAGG', 'hour', start_date, store,
+                                                              chunk_points=24)
+            self.assertEqual(count_chunks, 3)
+            self.assertEqual(len(store.load([('XRP', 'BTC')], 'CCCAGG', 'hour')), len(stored) // 2)
+
+    def tearDown(self):
+        self._url_patch.stop()
+        self._server.shutdown()
+        self._server.server_close()
+        self._server_thread.join()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    unittest.main()
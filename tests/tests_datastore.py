@@ -0,0 +1,100 @@
+import unittest
+import logging
+import os
+import tempfile
+from datetime import datetime
+from decimal import Decimal
+
+import pandas
+
+from datastore import save_dataset, load_dataset, dataset_exists
+
+
+class TestDatastore(unittest.TestCase):
+    """
+    Testing round trips through the columnar datasets.
+    """
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._test_prices = pandas.read_pickle(os.path.abspath(os.sep.join(['tests-data', 'test-prices.pkl'])))
+        self._test_flows = pandas.read_pickle(os.path.abspath(os.sep.join(['tests-data', 'test-flows.pkl'])))
+        self._test_trades = pandas.read_pickle(os.path.abspath(os.sep.join(['tests-data', 'test-trades.pkl'])))
+
+    def _round_trip(self, name, data, decimal_columns=None, **kwargs):
+        dataset_path = os.sep.join([self._temp_dir.name, name])
+        save_dataset(data, dataset_path, decimal_columns=decimal_columns)
+        return load_dataset(dataset_path, **kwargs)
+
+    def test_ledger(self):
+        for name, ledger in (('flows', self._test_flows), ('trades', self._test_trades)):
+            loaded = self._round_trip(name, ledger, decimal_columns=['amount', 'fee'])
+            expected = ledger.sort_values('date', kind='mergesort').reset_index(drop=True)
+            self.assertSequenceEqual(loaded.columns.tolist(), expected.columns.tolist())
+            self.assertSequenceEqual(loaded['date'].tolist(), expected['date'].tolist())
+            self.assertSequenceEqual(loaded['asset'].tolist(), expected['asset'].tolist())
+            self.assertSequenceEqual(loaded['exchange'].tolist(), expected['exchange'].tolist())
+            self.assertSequenceEqual(loaded['amount'].tolist(), expected['amount'].astype(float).tolist())
+            self.assertSequenceEqual(loaded['fee'].tolist(), expected['fee'].astype(float).tolist())
+
+    def test_prices(self):
+        loaded = self._round_trip('prices', self._test_prices)
+        pandas.testing.assert_frame_equal(loaded, self._test_prices.reset_index(drop=True), check_names=False)
+
+    def test_select_columns_and_dates(self):
+        dataset_path = os.sep.join([self._temp_dir.name, 'prices'])
+        save_dataset(self._test_prices, dataset_path)
+        loaded = load_dataset(dataset_path, columns=['date', 'XRP/USD'], start=datetime(2017, 7, 1, 12),
+                              end=datetime(2017, 7, 10))
+        self.assertSequenceEqual(loaded.columns.tolist(), ['date', 'XRP/USD'])
+        # last price before start is kept for carrying it forward
+        self.assertEqual(loaded['date'].iloc[0], self._test_prices[self._test_prices['date'] <= datetime(2017, 7, 1, 12)]['date'].max())
+        self.assertLessEqual(loaded['date'].iloc[-1], datetime(2017, 7, 10))
+        expected = self._test_prices.set_index('date').loc[loaded['date'], 'XRP/USD']
+        self.assertSequenceEqual(loaded['XRP/USD'].tolist(), expected.tolist())
+
+    def test_decimal_and_empty(self):
+        data = pandas.DataFrame({'date': [datetime(2017, 7, 2), datetime(2017, 7, 1)],
+                                 'amount': [Decimal('0.12345678'), Decimal('-2.5')],
+                                 'asset': ['XRP', 'BTC']})
+        loaded = self._round_trip('decimals', data)
+        self.assertSequenceEqual(loaded['amount'].tolist(), [-2.5, 0.12345678])
+        self.assertSequenceEqual(loaded['asset'].tolist(), ['BTC', 'XRP'])
+        empty = self._round_trip('empty', pandas.DataFrame(columns=['date', 'asset', 'amount', 'fee', 'exchange']))
+        self.assertTrue(empty.empty)
+        self.assertSequenceEqual(empty.columns.tolist(), ['date', 'asset', 'amount', 'fee', 'exchange'])
+
+    def test_text_and_nulls(self):
+        data = pandas.DataFrame({'date': [datetime(2017, 7, 1), datetime(2017, 7, 2), datetime(2017, 7, 3)],
+                                 'ledger_id': ['0012', None, '0100'], 'refid': ['abc', None, 'def'],
+                                 'amount': ['1.50', '-0.25', None], 'fee': [Decimal('0.01'), None, 2]})
+        loaded = self._round_trip('text', data)
+        self.assertSequenceEqual(loaded['ledger_id'].tolist(), ['0012', None, '0100'])
+        self.assertSequenceEqual(loaded['refid'].tolist(), ['abc', None, 'def'])
+        # numbers held as text stay text unless declared as decimals
+        self.assertSequenceEqual(loaded['amount'].tolist(), ['1.50', '-0.25', None])
+        self.assertSequenceEqual(loaded['fee'].tolist()[::2], [0.01, 2.])
+        self.assertTrue(pandas.isnull(loaded['fee'].iloc[1]))
+
+        dataset_path = os.sep.join([self._temp_dir.name, 'declared'])
+        save_dataset(data, dataset_path, decimal_columns=['amount'])
+        loaded = load_dataset(dataset_path, start=datetime(2017, 7, 2))
+        self.assertSequenceEqual(loaded['amount'].tolist()[:1], [-0.25])
+        self.assertTrue(pandas.isnull(loaded['amount'].iloc[1]))
+        self.assertSequenceEqual(loaded['refid'].tolist(), [None, 'def'])
+
+    def test_replace(self):
+        dataset_path = os.sep.join([self._temp_dir.name, 'flows'])
+        self.assertFalse(dataset_exists(dataset_path))
+        save_dataset(self._test_flows, dataset_path)
+        save_dataset(self._test_flows.head(2), dataset_path)
+        self.assertTrue(dataset_exists(dataset_path))
+        self.assertEqual(len(load_dataset(dataset_path)), 2)
+        self.assertSequenceEqual(os.listdir(self._temp_dir.name), ['flows'])
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import logging
+import threading
+from datetime import datetime
+from unittest import mock
+
+import pandas
+
+import exchanges
+
+
+def _fake_retrieve_data(exchange, assets, barrier):
+
+    def retrieve_data(api_key, secret_key, store=None):
+        # only passes once every exchange is being loaded at the same time
+        barrier.wait()
+        ledger = pandas.DataFrame({'date': [datetime(2017, 7, 1 + count) for count in range(len(assets))],
+                                   'asset': assets, 'amount': [1.] * len(assets), 'fee': [0.] * len(assets),
+                                   'exchange': exchange}, columns=['date', 'asset', 'amount', 'fee', 'exchange'])
+        return ledger.iloc[:1], ledger.iloc[1:], set(assets)
+
+    return retrieve_data
+
+
+class TestExchanges(unittest.TestCase):
+    """
+    Testing the exchanges registry.
+    """
+
+    def test_get_exchange(self):
+        self.assertSequenceEqual(exchanges.registered_exchanges(), ['bittrex', 'kraken'])
+        self.assertEqual(exchanges.get_exchange('kraken').__name__, 'exchanges.kraken')
+        self.assertRaises(ValueError, exchanges.get_exchange, 'mtgox')
+
+    def test_retrieve_ledgers(self):
+        barrier = threading.Barrier(2, timeout=10)
+        config = {'kraken': {'key': 'k1', 'secret': 's1'}, 'bittrex': {'key': 'k2', 'secret': 's2'}}
+        with mock.patch('exchanges.kraken.retrieve_data', _fake_retrieve_data('kraken', ['EUR', 'ETH'], barrier)), \
+                mock.patch('exchanges.bittrex.retrieve_data', _fake_retrieve_data('bittrex', ['BTC', 'XRP', 'ETH'],
+                                                                                  barrier)):
+            flows, trades, currencies = exchanges.retrieve_ledgers(config)
+
+        self.assertSequenceEqual(flows.columns.tolist(), ['date', 'asset', 'amount', 'fee', 'exchange'])
+        self.assertSequenceEqual(flows['exchange'].tolist(), ['bittrex', 'kraken'])
+        self.assertSequenceEqual(trades['exchange'].tolist(), ['bittrex', 'bittrex', 'kraken'])
+        self.assertSequenceEqual(trades['asset'].tolist(), ['XRP', 'ETH', 'ETH'])
+        self.assertSetEqual(currencies, {'EUR', 'ETH', 'BTC', 'XRP'})
+
+    def test_retrieve_ledgers_unknown(self):
+        self.assertRaises(ValueError, exchanges.retrieve_ledgers, {'mtgox': {'key': 'k', 'secret': 's'}})
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    unittest.main()
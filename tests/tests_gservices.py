@@ -0,0 +1,196 @@
+import unittest
+import logging
+from datetime import datetime, timedelta
+
+import pandas
+
+from gservices import save_frame, sheet_values, sync_frame, update_values
+
+
+def _formatted(value):
+    try:
+        date = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+    except (TypeError, ValueError):
+        return value
+
+    return '{}/{}/{} {}:{:02d}:{:02d}'.format(date.month, date.day, date.year, date.hour, date.minute, date.second)
+
+
+class FakeRequest(object):
+
+    def __init__(self, response):
+        self._response = response
+
+    def execute(self):
+        return self._response
+
+
+class FakeSheetsService(object):
+    """
+    Sheets v4 service keeping the tabs of a single spreadsheet in memory.
+    """
+
+    def __init__(self, tabs=None):
+        self.tabs = dict() if tabs is None else tabs
+        self.sheet_ids = {tab_name: position for position, tab_name in enumerate(sorted(self.tabs))}
+        self.sizes = {tab_name: (len(rows), 1) for tab_name, rows in self.tabs.items()}
+        self.hidden = set()
+        self.input_options = dict()
+        self.requests = list()
+        self.value_updates = list()
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return FakeValues(self)
+
+    def get(self, spreadsheetId, fields=None):
+        sheets = [{'properties': {'title': tab_name, 'sheetId': sheet_id}}
+                  for tab_name, sheet_id in sorted(self.sheet_ids.items())]
+        return FakeRequest({'sheets': sheets})
+
+    def _tab_name(self, sheet_id):
+        return [tab_name for tab_name in self.sheet_ids if self.sheet_ids[tab_name] == sheet_id][0]
+
+    def batchUpdate(self, spreadsheetId, body):
+        replies = list()
+        for request in body['requests']:
+            self.requests.append(request)
+            if 'addSheet' in request:
+                properties = request['addSheet']['properties']
+                self.tabs[properties['title']] = list()
+                self.sheet_ids[properties['title']] = len(self.sheet_ids)
+                grid = properties['gridProperties']
+                self.sizes[properties['title']] = (grid['rowCount'], grid['columnCount'])
+                if properties.get('hidden'):
+                    self.hidden.add(properties['title'])
+
+                replies.append({'addSheet': {'properties': {'title': properties['title'],
+                                                            'sheetId': self.sheet_ids[properties['title']]}}})
+
+            elif 'updateSheetProperties' in request:
+                properties = request['updateSheetProperties']['properties']
+                tab_name = self._tab_name(properties['sheetId'])
+                grid = properties['gridProperties']
+                self.sizes[tab_name] = (grid['rowCount'], grid['columnCount'])
+                del self.tabs[tab_name][grid['rowCount']:]
+                replies.append(dict())
+
+            elif 'appendDimension' in request:
+                tab_name = self._tab_name(request['appendDimension']['sheetId'])
+                self.tabs[tab_name].extend([None] * request['appendDimension']['length'])
+                replies.append(dict())
+
+            else:
+                dimension_range = list(request.values())[0]['range']
+                tab_name = self._tab_name(dimension_range['sheetId'])
+                start, end = dimension_range['startIndex'], dimension_range['endIndex']
+                if 'insertDimension' in request:
+                    self.tabs[tab_name][start:start] = [None] * (end - start)
+
+                else:
+                    del self.tabs[tab_name][start:end]
+
+                replies.append(dict())
+
+        return FakeRequest({'replies': replies})
+
+
+class FakeValues(object):
+
+    def __init__(self, service):
+        self._service = service
+
+    def get(self, spreadsheetId, range):
+        tab_name = range.split('!')[0].strip("'")
+        rows = [row for row in self._service.tabs[tab_name] if row is not None]
+        if self._service.input_options.get(tab_name) == 'USER_ENTERED':
+            # dates typed in come back formatted according to the spreadsheet locale
+            rows = [[_formatted(value) for value in row] for row in rows]
+
+        return FakeRequest({'values': rows})
+
+    def batchUpdate(self, spreadsheetId, body):
+        self._service.value_updates.append(body)
+        for data in body['data']:
+            tab_name, cells = data['range'].split('!')
+            self._service.input_options[tab_name.strip("'")] = body['valueInputOption']
+            rows = self._service.tabs[tab_name.strip("'")]
+            first_row = int(cells.split(':')[0][1:])
+            for count, row in enumerate(data['values']):
+                position = first_row - 1 + count
+                rows.extend([None] * (position + 1 - len(rows)))
+                rows[position] = list(row)
+
+        return FakeRequest({'totalUpdatedRows': sum(len(data['values']) for data in body['data'])})
+
+
+class TestGoogleServices(unittest.TestCase):
+    """
+    Testing sheets updates.
+    """
+
+    def setUp(self):
+        self._prices = pandas.DataFrame({'date': [datetime(2017, 7, 2), datetime(2017, 7, 1, 12)],
+                                         'BTC/USD': [2500.5, None], 'ETH/USD': [280., 275.25]},
+                                        columns=['date', 'BTC/USD', 'ETH/USD'])
+
+    def test_sheet_values(self):
+        values = sheet_values(self._prices, ['date', 'ETH/USD', 'BTC/USD'])
+        self.assertSequenceEqual(values, [['date', 'ETH/USD', 'BTC/USD'],
+                                          ['2017-07-02 00:00:00', 280., 2500.5],
+                                          ['2017-07-01 12:00:00', 275.25, '']])
+
+    def test_save_frame(self):
+        service = FakeSheetsService({'PnL': [['old']] * 5})
+        save_frame(service, 'sheet-id', 'Prices', self._prices)
+        save_frame(service, 'sheet-id', 'PnL', self._prices, header=['date', 'ETH/USD'])
+        self.assertEqual(len(service.value_updates), 2)
+        self.assertSequenceEqual(service.tabs['Prices'], sheet_values(self._prices, self._prices.columns.tolist()))
+        self.assertEqual(service.sizes['Prices'], (3, 3))
+        self.assertSequenceEqual(service.tabs['PnL'], sheet_values(self._prices, ['date', 'ETH/USD']))
+        self.assertEqual(service.sizes['PnL'], (3, 2))
+
+    def test_chunked_updates(self):
+        service = FakeSheetsService({'Prices': list()})
+        values = [[row, row * 2, row * 3] for row in range(10)]
+        self.assertEqual(update_values(service, 'sheet-id', 'Prices', 1, values, max_cells=12), 3)
+        self.assertSequenceEqual([update['data'][0]['range'] for update in service.value_updates],
+                                 ["'Prices'!A1:C4", "'Prices'!A5:C8", "'Prices'!A9:C10"])
+        self.assertSequenceEqual(service.tabs['Prices'], values)
+
+    def test_sync_frame(self):
+        service = FakeSheetsService()
+        dates = [datetime(2017, 7, 1) + timedelta(hours=count) for count in range(200)]
+        prices = pandas.DataFrame({'date': list(reversed(dates)), 'ETH/USD': [float(count) for count in range(200)]},
+                                  columns=['date', 'ETH/USD'])
+        self.assertEqual(sync_frame(service, 'sheet-id', 'Prices', prices.iloc[10:]), 191)
+        self.assertIn('Prices-hashes', service.hidden)
+        self.assertNotIn('Prices', service.hidden)
+
+        # new rows on top, latest stored row updated and oldest rows dropped
+        prices.loc[10, 'ETH/USD'] = 1000.
+        del service.value_updates[:]
+        self.assertEqual(sync_frame(service, 'sheet-id', 'Prices', prices.iloc[:195]), 11)
+        self.assertSequenceEqual([(update['valueInputOption'], [data['range'] for data in update['data']])
+                                  for update in service.value_updates],
+                                 [('USER_ENTERED', ["'Prices'!A2:B12"]), ('RAW', ["'Prices-hashes'!A2:B12"])])
+        self.assertSequenceEqual(service.tabs['Prices'], sheet_values(prices.iloc[:195], ['date', 'ETH/USD']))
+        self.assertSequenceEqual([row[0] for row in service.tabs['Prices-hashes']],
+                                 [str(row[0]) for row in service.tabs['Prices']])
+
+        del service.value_updates[:]
+        self.assertEqual(sync_frame(service, 'sheet-id', 'Prices', prices.iloc[:195]), 0)
+        self.assertEqual(len(service.value_updates), 0)
+
+        # a changed header rewrites the whole tab
+        renamed = prices.rename(columns={'ETH/USD': 'ETH/EUR'})
+        self.assertEqual(sync_frame(service, 'sheet-id', 'Prices', renamed), 201)
+        self.assertSequenceEqual(service.tabs['Prices'], sheet_values(renamed, ['date', 'ETH/EUR']))
+        self.assertEqual(len(service.tabs['Prices-hashes']), 201)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    unittest.main()
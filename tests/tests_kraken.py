@@ -0,0 +1,223 @@
+import unittest
+import logging
+import base64
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from exchanges import kraken
+from ledgerstore import LedgerStore
+
+
+def _ledger_entry(count, entry_type, asset, amount):
+    return {'refid': 'R{}'.format(count), 'time': 1500000000 + 60 * count, 'type': entry_type, 'aclass': 'currency',
+            'asset': asset, 'amount': amount, 'fee': '0.0000000000', 'balance': '0.0000000000'}
+
+
+class FakeLedgersAPI(object):
+    """
+    Serves a fixed ledger in pages of page_size entries.
+    """
+
+    def __init__(self, entries, page_size):
+        self._entries = entries
+        self._page_size = page_size
+        self.calls = list()
+
+    def __call__(self, method, options=None, client=None):
+        self.calls.append((method, dict(options)))
+        offset = options.get('ofs', 0)
+        start = options.get('start', 0)
+        entry_ids = [entry_id for entry_id in sorted(self._entries) if self._entries[entry_id]['time'] > start]
+        page = {entry_id: self._entries[entry_id] for entry_id in entry_ids[offset:offset + self._page_size]}
+        return {'error': [], 'result': {'ledger': page, 'count': len(entry_ids)}}
+
+
+class FakeDepthAPI(object):
+    """
+    Serves two levels on each side of the book of any pair.
+    """
+
+    def __init__(self):
+        self.calls = list()
+
+    def __call__(self, method, options=None, client=None):
+        self.calls.append((method, dict(options)))
+        book = {'bids': [['100.0', '1.5', 1500000000], ['99.0', '2.0', 1500000001]],
+                'asks': [['101.0', '0.5', 1500000002], ['102.0', '3.0', 1500000003]]}
+        return {'error': [], 'result': {options['pair']: book}}
+
+
+class FakeClock(object):
+    """
+    Clock only moving forward when sleeping.
+    """
+
+    def __init__(self):
+        self.now = 0.
+        self.sleeps = list()
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse(object):
+
+    status_code = 200
+    text = '{"error": [], "result": {}}'
+
+    def json(self, parse_float=None):
+        return {'error': [], 'result': {}}
+
+
+class FakeSession(object):
+    """
+    Records posted requests, from any thread.
+    """
+
+    def __init__(self):
+        self.posts = list()
+        self._lock = threading.Lock()
+
+    def post(self, url, data=None, headers=None):
+        with self._lock:
+            self.posts.append((url, dict(data), dict(headers)))
+
+        return FakeResponse()
+
+
+class TestKrakenClient(unittest.TestCase):
+    """
+    Testing the thread-safe Kraken client.
+    """
+
+    def test_token_bucket(self):
+        clock = FakeClock()
+        bucket = kraken.TokenBucket(4, 0.5, clock=clock, sleep=clock.sleep)
+        self.assertEqual([bucket.acquire(2), bucket.acquire(2)], [0., 0.])
+        self.assertEqual(bucket.acquire(1), 2.)
+        clock.now += 10.
+        # refilled up to capacity only
+        self.assertEqual([bucket.acquire(2), bucket.acquire(2), bucket.acquire(2)], [0., 0., 4.])
+
+    def test_nonces(self):
+        client = kraken.KrakenClient()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            nonces = list(executor.map(lambda _: client.nonce(), range(1000)))
+
+        self.assertEqual(len(set(nonces)), len(nonces))
+        self.assertGreater(client.nonce(), max(nonces))
+
+    def test_private_calls(self):
+        client = kraken.KrakenClient('key', base64.b64encode(b'secret').decode(), counter_limit=20)
+        session = FakeSession()
+        client._session = session
+        options = {'ofs': 0}
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda method: kraken.api_call_private(method, options, client=client),
+                              ['Ledgers', 'Balance'] * 4))
+
+        self.assertEqual(options, {'ofs': 0})
+        nonces = [data['nonce'] for url, data, headers in session.posts]
+        self.assertEqual(len(set(nonces)), 8)
+        url, data, headers = session.posts[0]
+        self.assertTrue(url.startswith('https://api.kraken.com/0/private/'))
+        self.assertEqual(headers['API-Key'], 'key')
+        self.assertEqual(len(base64.b64decode(headers['API-Sign'])), 64)
+        # Ledgers calls count twice against the call counter
+        self.assertAlmostEqual(client._private_limiter._tokens, 20 - 4 * 2 - 4 * 1, delta=0.1)
+
+
+class TestKrakenAPI(unittest.TestCase):
+    """
+    Testing Kraken ledger retrieval.
+    """
+
+    def setUp(self):
+        self._entries = {
+            'L01': _ledger_entry(1, 'deposit', 'ZEUR', '500.0000'),
+            'L02': _ledger_entry(2, 'trade', 'ZEUR', '-192.2000'),
+            'L03': _ledger_entry(3, 'trade', 'XETH', '1.0000000000'),
+            'L04': _ledger_entry(4, 'trade', 'XETH', '-0.5000000000'),
+            'L05': _ledger_entry(5, 'trade', 'XXBT', '0.0300000000'),
+            'L06': _ledger_entry(6, 'withdrawal', 'XXBT', '-0.0300000000'),
+            'L07': _ledger_entry(7, 'transfer', 'XXRP', '10.00000000'),
+        }
+        self._api = FakeLedgersAPI(self._entries, page_size=3)
+        self._api_patch = mock.patch('exchanges.kraken.api_call_private', self._api)
+        self._api_patch.start()
+
+    def test_order_books_snapshot(self):
+        depth_api = FakeDepthAPI()
+        with mock.patch('exchanges.kraken.api_call_public', depth_api):
+            books = kraken.get_order_books(['XETHXXBT', 'XETHZEUR', 'XETHXXBT', 'XXBTZEUR', 'XETHZEUR'], depth=2)
+
+        self.assertSequenceEqual(sorted(options['pair'] for method, options in depth_api.calls),
+                                 ['XETHXXBT', 'XETHZEUR', 'XXBTZEUR'])
+        self.assertSequenceEqual(sorted(books), ['XETHXXBT', 'XETHZEUR', 'XXBTZEUR'])
+        bid, ask = books['XETHZEUR']
+        self.assertEqual(bid.iloc[0]['price'], 100)
+        self.assertEqual(ask.iloc[1]['volume'], 3)
+
+    def test_compact_order_book(self):
+        with mock.patch('exchanges.kraken.api_call_public', FakeDepthAPI()):
+            bid_df, ask_df = kraken.get_order_book('XETHZEUR', depth=2)
+            bid, ask = kraken.get_order_book('XETHZEUR', depth=2, compact=True)
+
+        self.assertEqual(bid.best()['price'], 100.)
+        self.assertEqual(ask.cumulative_volumes().tolist(), [0.5, 3.5])
+        for side, side_df in ((bid, bid_df), (ask, ask_df)):
+            frame = side.to_frame()
+            self.assertSequenceEqual(list(frame.columns), list(side_df.columns))
+            self.assertSequenceEqual(frame['timestamp'].tolist(), side_df['timestamp'].tolist())
+            self.assertSequenceEqual(frame['price'].tolist(), [float(price) for price in side_df['price']])
+            self.assertSequenceEqual(frame['volume'].tolist(), [float(volume) for volume in side_df['volume']])
+
+    def test_ledger_pages(self):
+        pages = kraken.iter_ledger_frames()
+        first_page = next(pages)
+        self.assertEqual(len(self._api.calls), 1)
+        self.assertSequenceEqual(first_page['ledger_id'].tolist(), ['L01', 'L02', 'L03'])
+        self.assertSequenceEqual(first_page['asset'].tolist(), ['EUR', 'EUR', 'ETH'])
+        self.assertSequenceEqual([len(page) for page in pages], [3, 1])
+        self.assertSequenceEqual([options['ofs'] for method, options in self._api.calls], [0, 3, 6])
+
+    def test_ledgers_info(self):
+        self.assertDictEqual(kraken.get_ledgers_info(), self._entries)
+
+    def test_retrieve_data(self):
+        with mock.patch('exchanges.kraken.connect'):
+            flows, trades, currencies = kraken.retrieve_data('key', 'secret')
+
+        self.assertSequenceEqual(flows.columns.tolist(), ('date', 'asset', 'amount', 'fee', 'exchange'))
+        self.assertSequenceEqual(trades.columns.tolist(), ('date', 'asset', 'amount', 'fee', 'exchange'))
+        self.assertSequenceEqual(flows['asset'].tolist(), ['EUR', 'BTC'])
+        self.assertEqual(len(trades), 4)
+        self.assertSetEqual(currencies, {'EUR', 'ETH', 'BTC', 'XRP'})
+
+    def test_sync_ledger(self):
+        with tempfile.TemporaryDirectory() as store_path:
+            entries = self._entries
+            self._api._entries = {entry_id: entries[entry_id] for entry_id in ('L01', 'L02', 'L03')}
+            ledger = kraken.sync_ledger(LedgerStore(store_path))
+            self.assertEqual(len(ledger), 3)
+
+            self._api._entries = entries
+            del self._api.calls[:]
+            ledger = kraken.sync_ledger(LedgerStore(store_path))
+            self.assertSequenceEqual(ledger['entry_id'].tolist(), sorted(entries))
+            # only entries from the latest stored second onwards are downloaded
+            self.assertEqual(len(self._api.calls), 2)
+            self.assertEqual(self._api.calls[0][1]['start'], entries['L03']['time'] - 1)
+
+    def tearDown(self):
+        self._api_patch.stop()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    unittest.main()
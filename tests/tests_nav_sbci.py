@@ -6,7 +6,7 @@ from decimal import Decimal
 
 import pandas
 
-from sbcireport import compute_trades_pnl, compute_pnl
+from sbcireport import compute_trades_pnl, compute_pnl, breakdown_flows
 
 
 class TestNavSBCI(unittest.TestCase):
@@ -39,6 +39,13 @@ class TestNavSBCI(unittest.TestCase):
         pnl_xrp = pnl['XRP'].tail(1).sum()
         self.assertAlmostEqual(pnl_xrp, 62.1341177, places=6)
 
+    def test_breakdown_flows(self):
+        flow_dates = pandas.to_datetime(['2017-07-02', '2017-07-04'])
+        balances_by_asset = pandas.DataFrame({'ETH': [1., 2.]}, index=pandas.Index(flow_dates, name='date'))
+        balances = pandas.DataFrame({'date': pandas.date_range('2017-07-01', periods=6, freq='D')})
+        segments = breakdown_flows(balances_by_asset, balances)
+        self.assertSequenceEqual(segments.tolist(), [-1, 0, 0, 1, 1, 1])
+
     def tearDown(self):
         self._example_order_hist_file.close()
         self._example_withdrawals_file.close()
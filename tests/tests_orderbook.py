@@ -0,0 +1,58 @@
+import unittest
+import logging
+from decimal import Decimal
+
+import numpy
+
+from orderbook import BookSide
+
+_LEVELS = [['100.0', '1.5', 1500000000], ['99.0', '2.0', 1500000001], ['97.5', '0.5', 1500000002]]
+
+
+class TestBookSide(unittest.TestCase):
+    """
+    Testing array-backed order book sides.
+    """
+
+    def setUp(self):
+        self._side = BookSide.from_levels(_LEVELS)
+
+    def test_levels(self):
+        self.assertEqual(len(self._side), 3)
+        self.assertEqual(self._side.best(), {'price': 100., 'volume': 1.5, 'timestamp': 1500000000.})
+        self.assertEqual(self._side.level(2)['price'], 97.5)
+        self.assertSequenceEqual(self._side['volume'].tolist(), [1.5, 2., 0.5])
+        self.assertRaises(KeyError, lambda: self._side['level'])
+        self.assertRaises(AttributeError, lambda: setattr(self._side, 'level', 0))
+
+    def test_cumulative_depth(self):
+        self.assertSequenceEqual(self._side.cumulative_volumes().tolist(), [1.5, 3.5, 4.])
+        self.assertSequenceEqual(self._side.cumulative_notionals().tolist(), [150., 348., 396.75])
+        self.assertEqual(self._side.depth_for(1.), 1)
+        self.assertEqual(self._side.depth_for(3.5), 2)
+        self.assertEqual(self._side.depth_for(5.), 4)
+
+    def test_decimal_levels(self):
+        side = BookSide.from_levels([[Decimal('0.0916'), Decimal('12.5'), Decimal('1500000000.5')]])
+        self.assertEqual(side.best(), {'price': 0.0916, 'volume': 12.5, 'timestamp': 1500000000.5})
+
+    def test_empty(self):
+        side = BookSide.from_levels([])
+        self.assertTrue(side.empty)
+        self.assertEqual(side.cumulative_volumes().shape, (0,))
+        self.assertTrue(side.to_frame().empty)
+
+    def test_to_frame(self):
+        frame = self._side.to_frame()
+        self.assertSequenceEqual(list(frame.columns), ['timestamp', 'price', 'volume'])
+        self.assertEqual(frame.index.name, 'level')
+        self.assertEqual(frame.iloc[1]['price'], 99.)
+        numpy.testing.assert_array_equal(frame['volume'].values, self._side.volume)
+
+    def tearDown(self):
+        pass
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    unittest.main()